@@ -26,6 +26,9 @@ for s in scales:
     exp.diag_table = diag
 
     exp.update_namelist({'constants_nml': {'omega': omega}})
+
+    # kill runs that blow up and retry them with a smaller timestep
+    exp.enable_watchdog(max_speed=250., retries=2)
     try:
         # run with a progress bar with description showing omega
         with exp_progress(exp, description='o%.0f d{day}' % s) as pbar:
@@ -38,5 +41,4 @@ for s in scales:
 
     except FailedRunError as e:
         # don't let a crash get in the way of good science
-        # (we could try and reduce timestep here if we wanted to be smarter)
         continue
\ No newline at end of file
@@ -4,16 +4,27 @@ Purpose is to make sure that any new commits keep the results of the test cases
 or only change the test cases it expects to (e.g. a bug fix will change the result).
 
 When you submit a new pull request, please run this test and report the results in the pull request.
+
+The two commits are compiled and run concurrently.  The output of each run is
+kept in an experiment named after the test case, the commit and a hash of the
+namelist, diag table and input files, so a commit that has already been run
+with the same configuration (usually the base commit) is not run again.
 """
 import numpy as np
 from isca import Experiment, IscaCodeBase, SocratesCodeBase, FailedRunError, GFDL_BASE, DiagTable
 from isca.util import exp_progress
+from isca.inputcache import sha256_file
 import xarray as xar
 import pdb
 import numpy as np
 import os
 import sys
 import f90nml
+import copy
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 def get_nml_diag(test_case_name):
     """Gets the appropriate namelist and input files from each of the test case scripts in the test_cases folder
@@ -226,81 +237,162 @@ def process_ids(base_commit_in, later_commit_in):
 
     return base_commit_short, later_commit_short
 
-def conduct_comparison_on_test_case(base_commit, later_commit, test_case_name, repo_to_use='git@github.com:execlim/Isca', num_cores_to_use=4):
-    """Process here is to checkout each commit in turn, compiles it if necessary, uses the appropriate nml for the test
-    case under consideration, and runs the code with the two commits in turn. The output is then compared for all variables
+_compiled = {}
+_compile_lock = threading.Lock()
+
+def compile_codebase(codebase_obj, repo_to_use, commit):
+    """Checks out and compiles a commit, once per codebase and commit even when
+    several test cases ask for it at the same time."""
+    key = (codebase_obj, repo_to_use, commit)
+    with _compile_lock:
+        if key not in _compiled:
+            _compiled[key] = (threading.Lock(), [])
+        lock, result = _compiled[key]
+    with lock:
+        if not result:
+            cb = codebase_obj(repo=repo_to_use, commit=commit)
+            cb.compile()
+            result.append(cb)
+    return result[0]
+
+def config_hash(nml, diag, input_files):
+    """Hash of the configuration a test case is run with, including the
+    contents of its input files."""
+    config = {'namelist': nml.todict() if hasattr(nml, 'todict') else nml,
+              'diag_table': {'calendar': diag.calendar, 'files': diag.files},
+              'input_files': sorted([os.path.basename(f), sha256_file(f)] for f in input_files)}
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:10]
+
+def cached_output_exists(exp):
+    """True if run 1 of `exp` has already completed with all of its output."""
+    return exp.run_is_complete(1)
+
+def run_test_case_for_commit(test_case_name, commit, nml, diag, input_files, codebase_obj, repo_to_use, num_cores_to_use):
+    """Compiles and runs the test case with one commit.
+    Returns the data directory and None, or None and the reason the run failed."""
+    try:
+        cb = compile_codebase(codebase_obj, repo_to_use, commit)
+        exp_name = test_case_name+'_trip_test_21_'+commit+'_'+config_hash(nml, diag, input_files)
+        exp = Experiment(exp_name, codebase=cb)
+        exp.namelist = copy.deepcopy(nml)
+        exp.diag_table = diag
+        exp.inputfiles = input_files
+    except Exception as e:
+        print('Compilation failed for '+test_case_name+' with commit '+commit+': '+repr(e))
+        return None, 'compile'
+
+    if cached_output_exists(exp):
+        print('Using cached output of '+test_case_name+' for commit '+commit+' in '+exp.datadir)
+        return exp.datadir, None
+
+    try:
+        # run with a progress bar
+        with exp_progress(exp, description=commit) as pbar:
+            exp.run(1, use_restart=False, num_cores=num_cores_to_use, overwrite_data=True)
+    except FailedRunError as e:
+        #If run fails then test automatically fails
+        return None, 'run'
+    return exp.datadir, None
+
+def compare_netcdf_files(base_file, later_file, chunk_size=10, stop_at_first_difference=True):
+    """Compares the variables of two netcdf files, reading them a chunk of `chunk_size`
+    steps along their first dimension at a time.  With `stop_at_first_difference` the
+    comparison ends at the first difference found.
+    Returns a list of (variable, max absolute difference) for the variables that differ."""
+    differences = []
+    with xar.open_dataset(base_file, decode_times=False) as base, xar.open_dataset(later_file, decode_times=False) as later:
+        for var in base.data_vars.keys():
+            if var not in later.data_vars:
+                differences.append((var, np.nan))
+            elif base[var].shape != later[var].shape:
+                differences.append((var, np.inf))
+            else:
+                dim = base[var].dims[0] if base[var].dims else None
+                length = base[var].shape[0] if dim is not None else 1
+                maxval = 0.
+                for start in range(0, length, chunk_size):
+                    if dim is None:
+                        a, b = base[var].values, later[var].values
+                    else:
+                        a = base[var].isel({dim: slice(start, start+chunk_size)}).values
+                        b = later[var].isel({dim: slice(start, start+chunk_size)}).values
+                    equal_nan = a.dtype.kind in 'fc'
+                    if not np.array_equal(a, b, equal_nan=equal_nan):
+                        if a.dtype.kind in 'iufc':
+                            diff = np.abs(b.astype(float) - a.astype(float))
+                            maxval = max(maxval, np.nanmax(diff) if not np.all(np.isnan(diff)) else np.nan)
+                        else:
+                            maxval = np.nan
+                        if stop_at_first_difference:
+                            break
+                if maxval != 0.:
+                    differences.append((var, maxval))
+            if differences and stop_at_first_difference:
+                break
+        for var in later.data_vars.keys():
+            if var not in base.data_vars and not (differences and stop_at_first_difference):
+                differences.append((var, np.nan))
+    return differences
+
+def conduct_comparison_on_test_case(base_commit, later_commit, test_case_name, repo_to_use='git@github.com:execlim/Isca', num_cores_to_use=4, stop_at_first_difference=True):
+    """Process here is to checkout each commit, compile it if necessary, use the appropriate nml for the test
+    case under consideration, and run the code with the two commits at the same time. The output is then compared for all variables
     in the diag file. If there are any differences in the output variables then the test classed as a failure."""
 
     data_dir_dict = {}
     nml_use, input_files_use, codebase_obj  = get_nml_diag(test_case_name)
-    
+    nml_use = copy.deepcopy(nml_use)
+
     if 'shallow_water' in test_case_name:
         diag_use = define_simple_diag_table_2d('shallow')    
     elif 'barotropic_vort_eq' in test_case_name:
         diag_use = define_simple_diag_table_2d('barotropic')            
     else:
         diag_use = define_simple_diag_table()
+
+    #Only run for 3 days to keep things short.
+    if 'main_nml' not in nml_use:
+        nml_use['main_nml'] = {}
+    nml_use['main_nml']['days'] = 3
         
     test_pass = True
     run_complete = True
     compile_successful=True
 
-    #Do the run for each of the commits in turn
-    for s in [base_commit, later_commit]:
-        exp_name = test_case_name+'_trip_test_21_'+s
-        cb = codebase_obj(repo=repo_to_use, commit=s)
-        try:
-            cb.compile()
-            exp = Experiment(exp_name, codebase=cb)
-            exp.namelist = nml_use.copy()
-            exp.diag_table = diag_use
-            exp.inputfiles = input_files_use
-
-            #Only run for 3 days to keep things short.
-            exp.update_namelist({
-            'main_nml': {
-            'days': 3,
-            }})
-        except:
-            run_complete = False
-            test_pass = False      
-            compile_successful=False                  
-            continue            
-
-
-        try:
-            # run with a progress bar
-            with exp_progress(exp, description=s) as pbar:
-                exp.run(1, use_restart=False, num_cores=num_cores_to_use)
-        except FailedRunError as e:
-            #If run fails then test automatically fails
+    #Do the runs for the two commits at the same time
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = {s: pool.submit(run_test_case_for_commit, test_case_name, s, nml_use, diag_use, input_files_use,
+                                  codebase_obj, repo_to_use, num_cores_to_use)
+                   for s in [base_commit, later_commit]}
+    for s, future in futures.items():
+        datadir, failure = future.result()
+        if failure is not None:
             run_complete = False
             test_pass = False
-            continue
+            if failure == 'compile':
+                compile_successful = False
+        else:
+            data_dir_dict[s] = datadir
 
+    if run_complete:
+        base_experiment_input_nml = f90nml.read(data_dir_dict[base_commit] +'/run0001/input.nml')
+        later_commit_input_nml    = f90nml.read(data_dir_dict[later_commit] +'/run0001/input.nml')
 
+        if base_experiment_input_nml!=later_commit_input_nml:
+            raise AttributeError(f'The two experiments to be compared have been run using different input namelists, and so the results may be different because of this. Try removing both {data_dir_dict[base_commit]} and {data_dir_dict[later_commit]} and try again.')
 
-        data_dir_dict[s] = exp.datadir
-    if run_complete:
         #For each of the diag files defined, compare the output
         for diag_file_entry in diag_use.files.keys():
-            base_commit_dataset  = xar.open_dataset(data_dir_dict[base_commit] +'/run0001/'+diag_file_entry+'.nc', decode_times=False)
-            later_commit_dataset = xar.open_dataset(data_dir_dict[later_commit]+'/run0001/'+diag_file_entry+'.nc', decode_times=False)
-
-            diff = later_commit_dataset - base_commit_dataset
+            differences = compare_netcdf_files(data_dir_dict[base_commit] +'/run0001/'+diag_file_entry+'.nc',
+                                               data_dir_dict[later_commit]+'/run0001/'+diag_file_entry+'.nc',
+                                               stop_at_first_difference=stop_at_first_difference)
 
             #Check each of the output variables for differences
-            for var in diff.data_vars.keys():
-                maxval = np.abs(diff[var]).max()
-                if maxval !=0.:
-                    print('Test failed for '+var+' max diff value = '+str(maxval.values))
-                    test_pass = False
-
-            base_experiment_input_nml = f90nml.read(data_dir_dict[base_commit] +'/run0001/input.nml')
-            later_commit_input_nml    = f90nml.read(data_dir_dict[later_commit] +'/run0001/input.nml')
-
-            if base_experiment_input_nml!=later_commit_input_nml:
-                raise AttributeError(f'The two experiments to be compared have been run using different input namelists, and so the results may be different because of this. This only happens when you have run the trip tests using one of the commit IDs before, and that you happen to have used a different version of the test cases on that previous occasion. Try removing both {data_dir_dict[base_commit]} and {data_dir_dict[later_commit]} and try again.')
+            for var, maxval in differences:
+                print('Test failed for '+var+' max diff value = '+str(maxval))
+                test_pass = False
+            if not test_pass and stop_at_first_difference:
+                break
 
         if test_pass:
             print('Test passed for '+test_case_name+'. Commit '+later_commit+' gives the same answer as commit '+base_commit)
@@ -342,12 +434,17 @@ def output_results_function(exp_outcome_dict, base_commit, later_commit):
     else:
         print('Nightmare, some tests have failed')
 
-def run_all_tests(base_commit, later_commit, exps_to_check, repo_to_use='git@github.com:execlim/Isca', num_cores_to_use=4):
+def run_all_tests(base_commit, later_commit, exps_to_check, repo_to_use='git@github.com:execlim/Isca', num_cores_to_use=4, parallel_tests=1, stop_at_first_difference=True):
 
     exp_outcome_dict = {}
 
-    #Run the test on each test case in turn
+    #Run the test on each test case, `parallel_tests` test cases at a time
+    with ThreadPoolExecutor(max_workers=parallel_tests) as pool:
+        futures = {exp_name: pool.submit(conduct_comparison_on_test_case, base_commit, later_commit, exp_name,
+                                         repo_to_use=repo_to_use, num_cores_to_use=num_cores_to_use,
+                                         stop_at_first_difference=stop_at_first_difference)
+                   for exp_name in exps_to_check}
     for exp_name in exps_to_check:
-        exp_outcome_dict[exp_name] = conduct_comparison_on_test_case(base_commit, later_commit, exp_name, repo_to_use = repo_to_use, num_cores_to_use=num_cores_to_use)
+        exp_outcome_dict[exp_name] = futures[exp_name].result()
 
     output_results_function(exp_outcome_dict, base_commit, later_commit)
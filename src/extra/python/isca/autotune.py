@@ -0,0 +1,221 @@
+"""Choose the number of cores to run an experiment on.
+
+The spectral core divides the latitude rows between processors: the number
+of cores must divide evenly into half the number of latitudes and be no
+more than the number of Fourier waves (see the description in
+`src/atmos_spectral/tools/transforms.html`).  Any other count fails at
+start up.
+
+`CoreAutotuner` enumerates the valid core counts for an experiment's
+resolution, optionally times short probe runs at some of them, fits a
+simple cost model
+
+    seconds per model day = a + b/n + c*n
+
+and picks the best count according to an objective:
+
+    'fastest'     the shortest predicted wall time
+    'core_hours'  the fewest core-hours per model day
+    'balanced'    the fastest count with a parallel efficiency of at least
+                  `min_efficiency` relative to a single core (default)
+
+    from isca.autotune import autotune
+    autotune(exp, max_cores=32)      # sets exp.num_cores
+    exp.run(1)
+
+Probe timings are cached in `$GFDL_WORK/autotune/cache.json`, keyed on
+the code base, resolution and namelist, so experiments with the same
+configuration are tuned instantly.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from isca import GFDL_WORK
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+# spectral_dynamics_nml defaults (T42)
+DEFAULT_RESOLUTION = {'lon_max': 128, 'lat_max': 64, 'num_fourier': 42, 'num_levels': 18}
+
+# namelist values that do not change the cost of a model day
+_IGNORED_SETTINGS = {
+    'main_nml': ('days', 'months', 'years', 'hours', 'minutes', 'seconds', 'current_date'),
+}
+
+_cache_lock = threading.Lock()
+
+
+def valid_core_counts(lat_max, num_fourier, max_cores=None):
+    """Core counts the spectral core can be decomposed over."""
+    half = lat_max // 2
+    limit = min(num_fourier, max_cores or num_fourier)
+    return [n for n in range(1, limit + 1) if half % n == 0]
+
+
+def check_core_count(exp, num_cores):
+    """Log a warning and return False if the spectral core of `exp` cannot
+    be decomposed over `num_cores`."""
+    if 'spectral_dynamics_nml' not in exp.namelist:
+        return True
+    res = experiment_resolution(exp)
+    valid = valid_core_counts(res['lat_max'], res['num_fourier'])
+    if num_cores not in valid:
+        exp.log.warning('%d cores is not a valid decomposition for lat_max=%d, num_fourier=%d; '
+                        'the model is likely to fail at start up.  Valid core counts: %s'
+                        % (num_cores, res['lat_max'], res['num_fourier'], valid))
+        return False
+    return True
+
+
+def experiment_resolution(exp):
+    nml = exp.namelist.get('spectral_dynamics_nml', {})
+    return {key: nml.get(key, default) for key, default in DEFAULT_RESOLUTION.items()}
+
+
+def fit_cost_model(cores, seconds_per_day):
+    """Least squares fit of t(n) = a + b/n + c*n to the timings.
+    With fewer than three timings the communication term c is dropped,
+    with one timing perfect scaling (t = b/n) is assumed.  Returns (a, b, c)."""
+    n = np.asarray(cores, dtype=float)
+    t = np.asarray(seconds_per_day, dtype=float)
+    if len(n) == 1:
+        return 0., t[0]*n[0], 0.
+    columns = [np.ones_like(n), 1./n] + ([n] if len(n) >= 3 else [])
+    coeffs = np.linalg.lstsq(np.column_stack(columns), t, rcond=None)[0]
+    a, b = coeffs[0], coeffs[1]
+    c = coeffs[2] if len(coeffs) > 2 else 0.
+    # a negative serial or communication cost is not physical
+    return max(a, 0.), max(b, 0.), max(c, 0.)
+
+
+class CoreAutotuner(Logger):
+    """Select the core count for `exp`.  See the module documentation."""
+
+    def __init__(self, exp, cachefile=P(GFDL_WORK, 'autotune', 'cache.json')):
+        self.exp = exp
+        self.cachefile = cachefile
+        self.resolution = experiment_resolution(exp)
+
+    def config_key(self):
+        """Hash of the code base, resolution and namelist."""
+        codebase = self.exp.codebase
+        try:
+            code = codebase.git_commit if codebase.commit is not None else codebase.source_fingerprint()
+        except Exception:
+            code = getattr(codebase, 'name', type(codebase).__name__)
+        namelist = {}
+        for section, values in self.exp.namelist.items():
+            ignored = _IGNORED_SETTINGS.get(section, ())
+            values = {k: v for k, v in values.items() if k not in ignored}
+            if values:
+                namelist[section] = values
+        config = {'codebase': [type(codebase).__name__, str(code)],
+                  'executable': getattr(codebase, 'executable_name', None),
+                  'resolution': self.resolution, 'namelist': namelist}
+        return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _load_cache(self):
+        if os.path.isfile(self.cachefile):
+            with open(self.cachefile) as f:
+                return json.load(f)
+        return {}
+
+    def timings(self):
+        """Cached {cores: seconds per model day} for this configuration."""
+        entry = self._load_cache().get(self.config_key(), {})
+        return {int(n): t for n, t in entry.get('timings', {}).items()}
+
+    def save_timings(self, timings):
+        with _cache_lock:
+            cache = self._load_cache()
+            entry = cache.setdefault(self.config_key(), {'resolution': self.resolution, 'timings': {}})
+            entry['timings'].update({str(n): t for n, t in timings.items()})
+            mkdir(os.path.dirname(self.cachefile))
+            fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(self.cachefile), prefix='.cache')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f, indent=1)
+            os.replace(tmpfile, self.cachefile)
+
+    def candidates(self, max_cores=None):
+        return valid_core_counts(self.resolution['lat_max'], self.resolution['num_fourier'],
+                                 max_cores or os.cpu_count())
+
+    def probe_counts(self, max_cores=None, num_probes=3):
+        """Core counts spread geometrically over the candidates."""
+        counts = self.candidates(max_cores)
+        if len(counts) <= num_probes:
+            return counts
+        idx = np.unique(np.round(np.geomspace(1, len(counts), num_probes)).astype(int) - 1)
+        return [counts[i] for i in idx]
+
+    def probe(self, cores, days=2):
+        """Time short runs of the experiment on each of `cores` and cache
+        the seconds per model day."""
+        from isca.benchmark import ScalingBenchmark
+        bench = ScalingBenchmark(self.exp, days=days, name='%s_autotune' % self.exp.name,
+                                 resultsdir=os.path.dirname(self.cachefile))
+        timings = {}
+        for n in cores:
+            result = bench.run_one(None, n)
+            if result['sypd']:
+                timings[n] = 86400. / (result['sypd'] * _days_per_year(self.exp))
+            else:
+                self.log.warning('Probe run on %d cores failed, excluding it' % n)
+        self.save_timings(timings)
+        return timings
+
+    def predict(self, timings, cores):
+        a, b, c = fit_cost_model(list(timings), list(timings.values()))
+        n = np.asarray(cores, dtype=float)
+        return a + b/n + c*n
+
+    def choose(self, max_cores=None, objective='balanced', min_efficiency=0.7, probe=True, days=2):
+        """Return the best core count for the experiment."""
+        counts = self.candidates(max_cores)
+        if not counts:
+            raise ValueError('No valid core counts for lat_max=%d, num_fourier=%d' %
+                             (self.resolution['lat_max'], self.resolution['num_fourier']))
+        timings = self.timings()
+        if probe and len([n for n in timings if n in counts]) < min(3, len(counts)):
+            timings.update(self.probe([n for n in self.probe_counts(max_cores) if n not in timings], days=days))
+        if not timings:
+            self.log.info('No timings available, assuming perfect scaling')
+            return counts[-1]
+
+        predicted = self.predict(timings, counts)
+        core_seconds = predicted * np.asarray(counts)
+        if objective == 'fastest':
+            best = int(np.argmin(predicted))
+        elif objective == 'core_hours':
+            best = int(np.argmin(core_seconds))
+        elif objective == 'balanced':
+            efficiency = core_seconds[0] / core_seconds
+            ok = np.flatnonzero(efficiency >= min_efficiency)
+            best = int(ok[np.argmin(predicted[ok])])
+        else:
+            raise ValueError("Unknown objective %r, use 'fastest', 'core_hours' or 'balanced'" % objective)
+        self.log.info('Chose %d cores for %s (%.1f s per model day predicted)' %
+                      (counts[best], self.exp.name, predicted[best]))
+        return counts[best]
+
+
+def _days_per_year(exp):
+    from isca.calendars import days_per_year
+    try:
+        return days_per_year(exp.get_calendar())
+    except ValueError:
+        return 360.
+
+
+def autotune(exp, max_cores=None, objective='balanced', min_efficiency=0.7, probe=True, days=2, apply=True):
+    """Choose the core count for `exp` and, if `apply` is True, make it
+    the default for `exp.run()`.  Returns the chosen count."""
+    cores = CoreAutotuner(exp).choose(max_cores, objective, min_efficiency, probe, days)
+    if apply:
+        exp.num_cores = cores
+    return cores
@@ -0,0 +1,264 @@
+"""Strong and weak scaling benchmarks of an experiment configuration.
+
+A benchmark takes an experiment, usually one of the test cases in
+`exp/test_cases`, and runs it for a few model days at each combination of
+resolution and core count.  For each run it records the throughput in
+simulated years per day (SYPD), the parallel efficiency and the peak memory
+of each MPI rank:
+
+    from isca.benchmark import ScalingBenchmark, load_test_case
+    exp = load_test_case('exp/test_cases/held_suarez/held_suarez_test_case.py')
+    bench = ScalingBenchmark(exp, days=5)
+    bench.strong(cores=[1, 2, 4, 8, 16], resolutions=[('T42', 25), ('T85', 25)])
+    bench.weak([(('T21', 25), 4), (('T42', 25), 16), (('T85', 25), 64)])
+    print(bench.format_results())
+
+Results are appended to `$GFDL_WORK/benchmarks/<name>.csv`, together with
+the commit of the code base, so that throughput can be compared between
+commits with `compare_results`.
+
+The throughput excludes model start up and is measured from the JSON
+progress records the model prints each day (see `isca.telemetry`).  Memory
+per rank is read from /proc and is only available for single node runs on
+Linux.
+"""
+import csv
+import os
+import runpy
+import socket
+import threading
+import time
+
+from isca import GFDL_WORK
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+RESULT_FIELDS = ('name', 'commit', 'host', 'date', 'resolution', 'num_levels', 'cores', 'days',
+                 'wall_time', 'model_wall_time', 'sypd', 'core_hours_per_year',
+                 'speedup', 'efficiency', 'max_rss_mb', 'mean_rss_mb', 'status')
+
+
+def load_test_case(filename, variable='exp'):
+    """Load the experiment defined at module level in a test case script,
+    without running the script's `__main__` block."""
+    namespace = runpy.run_path(filename, run_name='isca_benchmark')
+    try:
+        return namespace[variable]
+    except KeyError:
+        raise ValueError('%s does not define an experiment called %r' % (filename, variable))
+
+
+class RankMemoryMonitor(object):
+    """Polls /proc for the peak resident memory (VmHWM) of every process
+    running `executable` until stopped."""
+
+    def __init__(self, executable, interval=1.0):
+        # /proc/pid/comm is truncated to 15 characters
+        self.name = os.path.basename(executable)[:15]
+        self.interval = interval
+        self.peak = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _poll(self):
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(P('/proc', pid, 'comm')) as f:
+                    if f.read().strip() != self.name:
+                        continue
+                with open(P('/proc', pid, 'status')) as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            kb = int(line.split()[1])
+                            self.peak[pid] = max(self.peak.get(pid, 0), kb)
+            except (IOError, OSError, ValueError):
+                pass  # the process ended while it was being read
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._poll()
+            self._stop.wait(self.interval)
+
+    def start(self, *args):
+        if os.path.isdir('/proc'):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self, *args):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def max_rss_mb(self):
+        return max(self.peak.values()) / 1024. if self.peak else None
+
+    @property
+    def mean_rss_mb(self):
+        return sum(self.peak.values()) / 1024. / len(self.peak) if self.peak else None
+
+
+class ScalingBenchmark(Logger):
+    """Run short versions of `exp` over a range of resolutions and core counts.
+
+    days: length of each benchmark run in model days.
+    name: the name results are stored under, default the experiment name.
+    keep_output: keep the data of each benchmark run, otherwise it is deleted.
+    """
+
+    def __init__(self, exp, days=5, name=None, resultsdir=P(GFDL_WORK, 'benchmarks'), keep_output=False):
+        self.exp = exp
+        self.days = days
+        self.name = name or exp.name
+        self.resultsdir = resultsdir
+        self.resultsfile = P(resultsdir, '%s.csv' % self.name)
+        self.keep_output = keep_output
+        self.results = []
+
+    def _commit(self):
+        try:
+            return self.exp.codebase.git_commit.strip().strip('"\'')
+        except Exception:
+            return None
+
+    def _experiment(self, resolution, cores):
+        res, num_levels = resolution if isinstance(resolution, (tuple, list)) else (resolution, None)
+        exp = self.exp.derive('%s_benchmark_%s_%s_%d' % (self.name, res, num_levels or 'default', cores))
+        # derive() shares the namelist sections with the original experiment
+        exp.namelist = exp.namelist.copy()
+        for section in exp.namelist:
+            exp.namelist[section] = exp.namelist[section].copy()
+        main = exp.namelist.setdefault('main_nml', {})
+        for key in ('years', 'months', 'hours', 'minutes', 'seconds'):
+            main.pop(key, None)
+        main['days'] = self.days
+        if res is not None:
+            exp.update_namelist({'spectral_dynamics_nml': dict(exp.RESOLUTIONS[res])})
+            if num_levels is not None:
+                exp.update_namelist({'spectral_dynamics_nml': {'num_levels': num_levels}})
+        exp.enable_telemetry()
+        return exp, res, num_levels
+
+    def run_one(self, resolution, cores):
+        """Run a single benchmark and return its result."""
+        exp, res, num_levels = self._experiment(resolution, cores)
+        monitor = RankMemoryMonitor(exp.codebase.executable_name)
+        exp.on('run:ready', monitor.start)
+        self.log.info('Benchmarking %s at %s with %d cores' % (self.name, res, cores))
+        result = {'name': self.name, 'commit': self._commit(), 'host': socket.gethostname(),
+                  'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'resolution': res,
+                  'num_levels': num_levels, 'cores': cores, 'days': self.days}
+        start = time.time()
+        try:
+            exp.run(1, use_restart=False, num_cores=cores, overwrite_data=True)
+            result['status'] = 'ok'
+        except Exception as e:
+            self.log.error('Benchmark %s at %s with %d cores failed: %r' % (self.name, res, cores, e))
+            result['status'] = 'failed'
+        finally:
+            monitor.stop()
+        result['wall_time'] = time.time() - start
+        model_spans = [r for r in exp.timer.records if r['phase'] == 'model']
+        result['model_wall_time'] = model_spans[-1]['wall_time'] if model_spans else None
+        sypd = exp.telemetry.sypd
+        result['sypd'] = None if sypd != sypd else sypd
+        result['core_hours_per_year'] = 24. * cores / sypd if sypd and sypd == sypd else None
+        result['max_rss_mb'] = monitor.max_rss_mb
+        result['mean_rss_mb'] = monitor.mean_rss_mb
+        if not self.keep_output:
+            exp.rm_datadir()
+            exp.rm_workdir()
+        return result
+
+    def _record(self, results, reference=None):
+        """Add speedup and efficiency relative to `reference`, or the run
+        with fewest cores of the same resolution, and save the results."""
+        for r in results:
+            if reference is None:
+                group = [x for x in results if (x['resolution'], x['num_levels']) == (r['resolution'], r['num_levels'])
+                         and x['sypd']]
+                ref = min(group, key=lambda x: x['cores']) if group else None
+                ideal = float(r['cores']) / ref['cores'] if ref else None
+            else:
+                ref, ideal = reference, 1.0
+            if ref and r['sypd']:
+                r['speedup'] = r['sypd'] / ref['sypd']
+                r['efficiency'] = r['speedup'] / ideal
+            else:
+                r['speedup'] = r['efficiency'] = None
+        self.results.extend(results)
+        self.save(results)
+        return results
+
+    def strong(self, cores, resolutions=(None, )):
+        """Strong scaling: each resolution run on each number of cores.
+        Efficiency is relative to the fewest cores at the same resolution.
+        A resolution is a name from `Experiment.RESOLUTIONS`, or a
+        (name, num_levels) tuple.  None uses the experiment's resolution."""
+        results = [self.run_one(res, n) for res in resolutions for n in sorted(cores)]
+        return self._record(results)
+
+    def weak(self, configs):
+        """Weak scaling: `configs` is a list of (resolution, cores) pairs
+        chosen so that the work per core is roughly constant.  Efficiency is
+        the throughput relative to the first configuration."""
+        results = [self.run_one(res, n) for res, n in configs]
+        return self._record(results, reference=results[0] if results[0]['sypd'] else None)
+
+    def save(self, results):
+        mkdir(self.resultsdir)
+        new_file = not os.path.exists(self.resultsfile)
+        with open(self.resultsfile, 'a') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(results)
+        self.log.info('Benchmark results written to %s' % self.resultsfile)
+
+    def format_results(self, results=None):
+        def fmt(x, f):
+            return '-' if x is None else f % x
+        lines = ['%-6s %6s %6s %10s %10s %8s %10s %10s' % ('res', 'levels', 'cores', 'wall (s)', 'SYPD', 'eff.', 'core-h/yr', 'RSS (MB)')]
+        for r in results if results is not None else self.results:
+            lines.append('%-6s %6s %6d %10.1f %10s %8s %10s %10s' % (
+                r['resolution'], r['num_levels'] or '-', r['cores'], r['wall_time'], fmt(r['sypd'], '%.2f'),
+                fmt(r['efficiency'], '%.2f'), fmt(r['core_hours_per_year'], '%.1f'), fmt(r['max_rss_mb'], '%.0f')))
+        return '\n'.join(lines)
+
+
+def read_results(filename):
+    """Read a benchmark results file as a list of dicts."""
+    with open(filename) as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key in ('cores', 'days'):
+            row[key] = int(row[key])
+        for key in ('wall_time', 'model_wall_time', 'sypd', 'core_hours_per_year',
+                    'speedup', 'efficiency', 'max_rss_mb', 'mean_rss_mb'):
+            row[key] = float(row[key]) if row[key] not in ('', None) else None
+    return rows
+
+
+def compare_results(filename, commit_a, commit_b, tolerance=0.05):
+    """Compare the SYPD of two commits in a results file.  Returns a list of
+    (resolution, num_levels, cores, sypd_a, sypd_b, change) for the
+    configurations run at both commits, and logs those slower by more than
+    `tolerance`."""
+    from isca.loghandler import log
+    latest = {}
+    for row in read_results(filename):
+        if row['status'] == 'ok' and row['commit'] in (commit_a, commit_b):
+            latest[(row['commit'], row['resolution'], row['num_levels'], row['cores'])] = row['sypd']
+    comparison = []
+    for (commit, res, levels, cores), sypd_a in sorted(latest.items(), key=str):
+        if commit != commit_a or (commit_b, res, levels, cores) not in latest:
+            continue
+        sypd_b = latest[(commit_b, res, levels, cores)]
+        change = sypd_b / sypd_a - 1.
+        comparison.append((res, levels, cores, sypd_a, sypd_b, change))
+        if change < -tolerance:
+            log.warning('%s %s levels on %d cores is %.0f%% slower at %s than at %s' %
+                        (res, levels, cores, -100*change, commit_b, commit_a))
+    return comparison
@@ -0,0 +1,223 @@
+"""Array based date arithmetic for the calendars used by Isca.
+
+Converting model times to dates with cftime creates a python object for
+every time step, which is slow for long runs of 6-hourly output.  For the
+calendars Isca runs with, dates can be computed directly with integer
+arithmetic on the whole time array:
+
+    360_day     (also 'thirty_day' in main_nml and 'thirty_day_months' in output files)
+    noleap      (also '365_day', 'no_leap')
+    julian
+
+    from isca.calendars import day_number_to_date
+    dates = day_number_to_date(ds.time.values, ds.time.units, ds.time.calendar)
+    dates.year, dates.month, dates.day, dates.dayofyear, dates.season
+
+Results are cached on (units, calendar, time values), so converting the
+same time axis again is free.
+"""
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+
+import numpy as np
+
+CALENDAR_ALIASES = {
+    '360_day': '360_day', '360': '360_day', 'thirty_day_months': '360_day', 'thirty_day': '360_day',
+    'noleap': 'noleap', 'no_leap': 'noleap', '365_day': 'noleap',
+    'julian': 'julian',
+}
+
+SECONDS_PER_UNIT = {
+    'second': 1, 'seconds': 1, 'sec': 1, 'secs': 1, 's': 1,
+    'minute': 60, 'minutes': 60, 'min': 60, 'mins': 60,
+    'hour': 3600, 'hours': 3600, 'hr': 3600, 'hrs': 3600, 'h': 3600,
+    'day': 86400, 'days': 86400, 'd': 86400,
+}
+
+_UNITS = re.compile(r'^\s*(\w+)\s+since\s+(-?\d+)-(\d+)-(\d+)(?:[ T]+(\d+):(\d+)(?::(\d+(?:\.\d*)?))?)?')
+
+# days before the start of each month, in normal and leap years
+_CUMDAYS = np.array([0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365])
+_CUMDAYS_LEAP = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335, 366])
+
+_CACHE_SIZE = 32
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def normalise_calendar(calendar):
+    """Return the canonical name of `calendar`, or raise ValueError if it is
+    not one of the calendars supported by this module."""
+    try:
+        return CALENDAR_ALIASES[str(calendar).lower()]
+    except KeyError:
+        raise ValueError('Calendar %r is not supported, use one of %s' % (calendar, ', '.join(sorted(set(CALENDAR_ALIASES.values())))))
+
+
+def parse_units(units):
+    """Split CF time units into (seconds per unit, (year, month, day, seconds into day))."""
+    match = _UNITS.match(units)
+    if not match:
+        raise ValueError('Cannot parse time units %r' % units)
+    unit, year, month, day, hour, minute, second = match.groups()
+    try:
+        scale = SECONDS_PER_UNIT[unit.lower()]
+    except KeyError:
+        raise ValueError('Unknown time unit %r in %r' % (unit, units))
+    seconds = int(hour or 0)*3600 + int(minute or 0)*60 + float(second or 0)
+    return scale, (int(year), int(month), int(day), seconds)
+
+
+def _days_before_year(year, calendar):
+    """Days from 0001-01-01 to the start of `year`."""
+    y = year - 1
+    if calendar == '360_day':
+        return 360*y
+    if calendar == 'noleap':
+        return 365*y
+    return 365*y + y//4
+
+
+def _is_leap(year, calendar):
+    if calendar == 'julian':
+        return year % 4 == 0
+    return np.zeros(np.shape(year), dtype=bool)
+
+
+def _days_before_month(year, month, calendar):
+    if calendar == '360_day':
+        return 30*(month - 1)
+    return np.where(_is_leap(year, calendar), _CUMDAYS_LEAP[month - 1], _CUMDAYS[month - 1])
+
+
+def _split_days(days, calendar):
+    """Absolute day numbers (0 = 0001-01-01) to (year, month, day, dayofyear)."""
+    if calendar == '360_day':
+        year, doy = np.divmod(days, 360)
+        month = doy//30 + 1
+        day = doy % 30 + 1
+    else:
+        if calendar == 'noleap':
+            year, doy = np.divmod(days, 365)
+            leap = np.zeros(days.shape, dtype=bool)
+        else:
+            cycle, rem = np.divmod(days, 1461)
+            yic = np.minimum(rem//365, 3)
+            doy = rem - 365*yic
+            year = 4*cycle + yic
+            leap = (year + 1) % 4 == 0
+        cumdays = np.where(leap[..., np.newaxis], _CUMDAYS_LEAP, _CUMDAYS)
+        month = np.sum(cumdays[..., 1:] <= doy[..., np.newaxis], axis=-1) + 1
+        day = doy - np.take_along_axis(cumdays, (month - 1)[..., np.newaxis], axis=-1)[..., 0] + 1
+    return year + 1, month, day, doy + 1
+
+
+def date_to_day_number(year, month, day, calendar='360_day'):
+    """Days from 0001-01-01 to the given date(s), the inverse of `day_number_to_date`
+    with units 'days since 0001-01-01'."""
+    calendar = normalise_calendar(calendar)
+    year, month, day = (np.asarray(x) for x in (year, month, day))
+    return _days_before_year(year, calendar) + _days_before_month(year, month, calendar) + day - 1
+
+
+def days_per_year(calendar):
+    """Mean length of a year in days."""
+    return {'360_day': 360., 'noleap': 365., 'julian': 365.25}[normalise_calendar(calendar)]
+
+
+class CalendarDates(object):
+    """Date components of an array of model times.
+
+    Has the `year`, `month`, `day`, `hour`, `minute`, `second` and
+    `dayofyear` attributes of `cmip_time.FakeDT`, as integer arrays."""
+
+    def __init__(self, year, month, day, hour, minute, second, dayofyear, units, calendar):
+        self.year = year
+        self.month = month
+        self.day = day
+        self.hour = hour
+        self.minute = minute
+        self.second = second
+        self.dayofyear = dayofyear
+        self.units = units
+        self.calendar = calendar
+
+    def __len__(self):
+        return len(self.year)
+
+    def __getitem__(self, idx):
+        return CalendarDates(*(getattr(self, a)[idx] for a in
+                               ('year', 'month', 'day', 'hour', 'minute', 'second', 'dayofyear')),
+                             units=self.units, calendar=self.calendar)
+
+    @property
+    def season(self):
+        """0 = DJF, 1 = MAM, 2 = JJA, 3 = SON."""
+        return month_to_season(self.month)
+
+    @property
+    def two_months(self):
+        """0 = JF, 1 = MA, ... 5 = ND."""
+        return month_to_two_months(self.month)
+
+    @property
+    def dates(self):
+        """The dates as cftime objects, for code that needs them."""
+        import cftime
+        return np.array([cftime.datetime(*args, calendar=self.calendar) for args in
+                         zip(self.year.flat, self.month.flat, self.day.flat, self.hour.flat,
+                             self.minute.flat, self.second.flat)]).reshape(np.shape(self.year))
+
+
+def _cache_key(time, units, calendar):
+    digest = hashlib.sha1(np.ascontiguousarray(time).view(np.uint8)).hexdigest()
+    return (units, calendar, time.dtype.str, time.shape, digest)
+
+
+def day_number_to_date(time, units='days since 0001-01-01 00:00:00', calendar='360_day'):
+    """Convert an array of model times to a `CalendarDates`.
+    Times are rounded to the nearest second."""
+    calendar = normalise_calendar(calendar)
+    time = np.asarray(time)
+    key = _cache_key(time, units, calendar)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    scale, (year0, month0, day0, seconds0) = parse_units(units)
+    epoch_day = _days_before_year(year0, calendar) + _days_before_month(year0, month0, calendar) + day0 - 1
+    # work in integer seconds from the epoch day to avoid rounding drift
+    seconds = np.rint(time.astype(np.float64)*scale + seconds0).astype(np.int64)
+    days, seconds = np.divmod(seconds, 86400)
+    days = days + int(epoch_day)
+    year, month, day, dayofyear = _split_days(days, calendar)
+    hour, seconds = np.divmod(seconds, 3600)
+    minute, second = np.divmod(seconds, 60)
+    dates = CalendarDates(year, month, day, hour, minute, second, dayofyear, units, calendar)
+
+    with _cache_lock:
+        _cache[key] = dates
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return dates
+
+
+def month_to_season(month):
+    """0 = DJF, 1 = MAM, 2 = JJA, 3 = SON."""
+    return (np.asarray(month) % 12)//3
+
+
+def month_to_two_months(month):
+    """0 = JF, 1 = MA, ... 5 = ND."""
+    return (np.asarray(month) - 1)//2
+
+
+def recurring_to_sequential(values):
+    """Number each run of equal consecutive values: [1, 1, 2, 2, 1] -> [0, 0, 1, 1, 2]."""
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.zeros(0, dtype=int)
+    return np.concatenate([[0], np.cumsum(values[1:] != values[:-1])])
@@ -0,0 +1,334 @@
+"""A SQLite catalog of experiments, runs, output files and timings.
+
+With the catalog enabled, each completed run of an experiment is recorded
+in `$GFDL_WORK/catalog.sqlite`: the experiment's resolution and namelist
+hash, the commit the model was compiled from, the files in the run's
+output directory and the timings of each phase of the run.
+
+    exp.enable_catalog()
+    exp.run(1)
+
+Runs made before the catalog was enabled can be added by scanning the data
+directories, which reads the `input.nml` and `git_hash_used.txt` saved with
+each run.  Runs already in the catalog are skipped unless their directory
+has changed.
+
+    from isca.catalog import Catalog
+    catalog = Catalog()
+    catalog.scan()                      # all experiments in GFDL_DATA
+    catalog.runs(commit='1a2b3c4', resolution='T85')
+    catalog.experiments(name='held_suarez%')
+    catalog.usage()                     # bytes per experiment
+    catalog.query('SELECT ...', params)
+
+Query methods return lists of dicts.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import time
+
+from isca import GFDL_WORK, GFDL_DATA
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+_RUN_DIRECTORY = re.compile(r'^run(\d+)$')
+_COMMIT = re.compile(r'\b[0-9a-f]{40}\b')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    name TEXT PRIMARY KEY,
+    datadir TEXT,
+    codebase TEXT,
+    executable TEXT,
+    resolution TEXT,
+    lon_max INTEGER,
+    lat_max INTEGER,
+    num_levels INTEGER,
+    namelist_hash TEXT,
+    namelist TEXT,
+    diag_table TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    experiment TEXT,
+    run INTEGER,
+    outdir TEXT,
+    commit_id TEXT,
+    base_commit_id TEXT,
+    dirty INTEGER,
+    namelist_hash TEXT,
+    resolution TEXT,
+    num_cores INTEGER,
+    finished REAL,
+    dir_mtime REAL,
+    bytes INTEGER,
+    PRIMARY KEY (experiment, run)
+);
+CREATE TABLE IF NOT EXISTS files (
+    experiment TEXT,
+    run INTEGER,
+    name TEXT,
+    size INTEGER,
+    mtime REAL,
+    PRIMARY KEY (experiment, run, name)
+);
+CREATE TABLE IF NOT EXISTS timings (
+    experiment TEXT,
+    run INTEGER,
+    phase TEXT,
+    start REAL,
+    wall_time REAL,
+    bytes INTEGER,
+    cores INTEGER,
+    core_hours REAL,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_commit ON runs (commit_id);
+CREATE INDEX IF NOT EXISTS runs_namelist ON runs (namelist_hash);
+CREATE INDEX IF NOT EXISTS runs_resolution ON runs (resolution);
+CREATE INDEX IF NOT EXISTS timings_run ON timings (experiment, run);
+"""
+
+
+def namelist_hash(namelist):
+    """A hash of `namelist` as the model reads it.  The namelist is written
+    out and read back first, so that an experiment's namelist and the
+    input.nml saved with its runs have the same hash (group names are
+    lower case and single values are not lists once read)."""
+    import f90nml
+    buf = io.StringIO()
+    f90nml.Namelist(namelist).write(buf)
+    data = f90nml.reads(buf.getvalue()).todict()
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def namelist_resolution(namelist):
+    """(resolution name, lon_max, lat_max, num_levels) of a namelist."""
+    from isca.autotune import DEFAULT_RESOLUTION
+    if 'spectral_dynamics_nml' not in namelist:
+        return None, None, None, None
+    nml = namelist['spectral_dynamics_nml']
+    res = {key: nml.get(key, default) for key, default in DEFAULT_RESOLUTION.items()}
+    return 'T%d' % res['num_fourier'], res['lon_max'], res['lat_max'], res['num_levels']
+
+
+def read_source_control_status(filename):
+    """(commit, GFDL_BASE commit, dirty) from a `git_hash_used.txt` file."""
+    if not os.path.isfile(filename):
+        return None, None, None
+    with open(filename) as f:
+        text = f.read()
+    commits = _COMMIT.findall(text)
+    return (commits[0] if commits else None, commits[1] if len(commits) > 1 else None,
+            int('dirty commit' in text))
+
+
+class Catalog(Logger):
+    """The experiment catalog stored in the SQLite database `path`."""
+
+    def __init__(self, path=P(GFDL_WORK, 'catalog.sqlite')):
+        self.path = path
+        mkdir(os.path.dirname(path))
+        db = self.connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def connect(self):
+        """A new connection, so the catalog can be used from any thread.
+        Use as a context manager to commit."""
+        db = sqlite3.connect(self.path, timeout=60)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def query(self, sql, params=()):
+        db = self.connect()
+        try:
+            return [dict(row) for row in db.execute(sql, params)]
+        finally:
+            db.close()
+
+    def _execute(self, statements):
+        db = self.connect()
+        try:
+            with db:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        db.executemany(sql, params)
+                    else:
+                        db.execute(sql, params)
+        finally:
+            db.close()
+
+    # --- recording
+
+    def record_experiment(self, exp):
+        resolution, lon_max, lat_max, num_levels = namelist_resolution(exp.namelist)
+        codebase = exp.codebase
+        self._execute([(
+            'INSERT OR REPLACE INTO experiments VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',
+            (exp.name, exp.datadir, type(codebase).__name__, getattr(codebase, 'executable_name', None),
+             resolution, lon_max, lat_max, num_levels, namelist_hash(exp.namelist),
+             json.dumps(exp.namelist.todict() if hasattr(exp.namelist, 'todict') else exp.namelist, default=str),
+             json.dumps(exp.diag_table.files, default=str), time.time()))])
+
+    def _run_statements(self, experiment, i, outdir, num_cores=None, timings=None):
+        """Statements recording run `i` from its output directory."""
+        commit, base_commit, dirty = read_source_control_status(P(outdir, 'git_hash_used.txt'))
+        nml_file = P(outdir, 'input.nml')
+        nml_hash, resolution = None, None
+        if os.path.isfile(nml_file):
+            import f90nml
+            namelist = f90nml.read(nml_file)
+            nml_hash = namelist_hash(namelist)
+            resolution = namelist_resolution(namelist)[0]
+        files = []
+        for root, dirs, names in os.walk(outdir):
+            for name in names:
+                path = P(root, name)
+                st = os.stat(path)
+                files.append((experiment, i, os.path.relpath(path, outdir), st.st_size, st.st_mtime))
+        dir_mtime = os.stat(outdir).st_mtime
+        statements = [
+            ('INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?,?,'
+             '(SELECT COALESCE(?, num_cores) FROM (SELECT NULL) LEFT JOIN runs ON experiment=? AND run=?),?,?,?)',
+             (experiment, i, outdir, commit, base_commit, dirty, nml_hash, resolution,
+              num_cores, experiment, i, max([f[4] for f in files] or [dir_mtime]), dir_mtime,
+              sum(f[3] for f in files))),
+            ('DELETE FROM files WHERE experiment=? AND run=?', (experiment, i)),
+            ('INSERT INTO files VALUES (?,?,?,?,?)', files),
+        ]
+        if timings is not None:
+            statements.append(('DELETE FROM timings WHERE experiment=? AND run=?', (experiment, i)))
+            statements.append(('INSERT INTO timings VALUES (?,?,?,?,?,?,?,?,?)',
+                               [(experiment, i, t['phase'], t['start'], t['wall_time'], t['bytes'],
+                                 t['cores'], t['core_hours'], t['status']) for t in timings]))
+        return statements
+
+    def record_run(self, exp, i, num_cores=None):
+        """Record run `i` of `exp`: its output files, commit and phase timings.
+        Can be called again to update the record, e.g. once background
+        post-processing has finished."""
+        self.record_experiment(exp)
+        timings = [r for r in list(exp.timer.records) if r['run'] == i and r['status'] != 'running']
+        self._execute(self._run_statements(exp.name, i, exp.get_outputdir(i), num_cores, timings))
+
+    def scan(self, datadir=GFDL_DATA, experiments=None):
+        """Add the runs found in the experiment directories of `datadir`
+        (all of them, or the names in `experiments`).  Returns the number of
+        runs added or updated."""
+        known = {(r['experiment'], r['run']): r['dir_mtime'] for r in
+                 self.query('SELECT experiment, run, dir_mtime FROM runs')}
+        names = experiments or sorted(os.listdir(datadir))
+        count = 0
+        for name in names:
+            expdir = P(datadir, name)
+            if not os.path.isdir(expdir):
+                continue
+            statements = []
+            for entry in sorted(os.listdir(expdir)):
+                match = _RUN_DIRECTORY.match(entry)
+                outdir = P(expdir, entry)
+                if match is None or not os.path.isdir(outdir):
+                    continue
+                i = int(match.group(1))
+                if known.get((name, i)) == os.stat(outdir).st_mtime:
+                    continue
+                statements.extend(self._run_statements(name, i, outdir))
+                count += 1
+            if statements:
+                statements.append(('INSERT OR IGNORE INTO experiments (name, datadir, updated) VALUES (?,?,?)',
+                                   (name, expdir, time.time())))
+                self._execute(statements)
+        self.log.info('Catalog scan of %s added or updated %d runs' % (datadir, count))
+        return count
+
+    def forget(self, experiment, runs=None):
+        """Remove an experiment, or some of its runs, from the catalog."""
+        if runs is None:
+            where, params = 'experiment=?', (experiment, )
+            statements = [('DELETE FROM experiments WHERE name=?', (experiment, ))]
+        else:
+            runs = list(runs)
+            where = 'experiment=? AND run IN (%s)' % ','.join('?' * len(runs))
+            params = tuple([experiment] + runs)
+            statements = []
+        for table in ('runs', 'files', 'timings'):
+            statements.append(('DELETE FROM %s WHERE %s' % (table, where), params))
+        self._execute(statements)
+
+    # --- queries
+
+    def experiments(self, name=None, resolution=None, commit=None):
+        """Experiments, optionally matching a name (SQL LIKE pattern),
+        resolution (e.g. 'T42') or commit (or a prefix of it)."""
+        sql = 'SELECT * FROM experiments WHERE 1'
+        params = []
+        if name is not None:
+            sql += ' AND name LIKE ?'
+            params.append(name)
+        if resolution is not None:
+            sql += ' AND (resolution=? OR name IN (SELECT experiment FROM runs WHERE resolution=?))'
+            params.extend([resolution, resolution])
+        if commit is not None:
+            sql += ' AND name IN (SELECT experiment FROM runs WHERE commit_id LIKE ?)'
+            params.append(commit + '%')
+        return self.query(sql + ' ORDER BY name', params)
+
+    def runs(self, experiment=None, commit=None, resolution=None, namelist_hash=None):
+        """Runs with the wall time and core-hours of the model, optionally
+        filtered by experiment (SQL LIKE pattern), commit (or a prefix),
+        resolution or namelist hash."""
+        sql = ('SELECT r.*, '
+               '(SELECT SUM(wall_time) FROM timings t WHERE t.experiment=r.experiment AND t.run=r.run AND phase=\'model\') AS model_seconds, '
+               '(SELECT SUM(core_hours) FROM timings t WHERE t.experiment=r.experiment AND t.run=r.run) AS core_hours '
+               'FROM runs r WHERE 1')
+        params = []
+        if experiment is not None:
+            sql += ' AND r.experiment LIKE ?'
+            params.append(experiment)
+        if commit is not None:
+            sql += ' AND r.commit_id LIKE ?'
+            params.append(commit + '%')
+        if resolution is not None:
+            sql += ' AND r.resolution=?'
+            params.append(resolution)
+        if namelist_hash is not None:
+            sql += ' AND r.namelist_hash=?'
+            params.append(namelist_hash)
+        return self.query(sql + ' ORDER BY r.experiment, r.run', params)
+
+    def files(self, experiment, run=None, pattern=None):
+        """Files of an experiment's runs, optionally matching a glob `pattern`."""
+        sql = 'SELECT * FROM files WHERE experiment=?'
+        params = [experiment]
+        if run is not None:
+            sql += ' AND run=?'
+            params.append(run)
+        if pattern is not None:
+            sql += ' AND name GLOB ?'
+            params.append(pattern)
+        return self.query(sql + ' ORDER BY run, name', params)
+
+    def timings(self, experiment, run=None):
+        sql = 'SELECT * FROM timings WHERE experiment=?'
+        params = [experiment]
+        if run is not None:
+            sql += ' AND run=?'
+            params.append(run)
+        return self.query(sql + ' ORDER BY run, start', params)
+
+    def usage(self, experiment=None):
+        """Number of runs, bytes and date of the last run of each experiment."""
+        sql = ('SELECT experiment, COUNT(*) AS runs, SUM(bytes) AS bytes, MAX(finished) AS last_finished '
+               'FROM runs')
+        params = []
+        if experiment is not None:
+            sql += ' WHERE experiment LIKE ?'
+            params.append(experiment)
+        return self.query(sql + ' GROUP BY experiment ORDER BY bytes DESC', params)
@@ -1,5 +1,9 @@
 from contextlib import contextmanager
+import glob
+import hashlib
+import json
 import os
+import re
 import socket
 
 from jinja2 import Environment, FileSystemLoader
@@ -11,6 +15,20 @@ from .helpers import url_to_folder, destructive, useworkdir, mkdir, git, P, git_
 
 import pdb
 
+_mkmf_template_export = re.compile(r'^\s*(?:export\s+)?GFDL_MKMF_TEMPLATE=[\'"]?([^\'"\s;#]+)', re.MULTILINE)
+
+def env_mkmf_template(env_file):
+    """The mkmf template compile.sh uses after sourcing `env_file`: the
+    last GFDL_MKMF_TEMPLATE it exports, otherwise the value inherited from
+    the environment, otherwise ia64."""
+    compiler = None
+    if os.path.isfile(env_file):
+        with open(env_file) as f:
+            exports = _mkmf_template_export.findall(f.read())
+        if exports:
+            compiler = exports[-1]
+    return compiler or os.environ.get('GFDL_MKMF_TEMPLATE', 'ia64')
+
 class CodeBase(Logger):
     """The CodeBase.
 
@@ -239,9 +257,78 @@ class CodeBase(Logger):
             else:
                 self.log.info(line)
 
+    def _mkmf_template(self, debug=False):
+        if debug:
+            return P(self.templatedir, 'mkmf.template.debug')
+        compiler = env_mkmf_template(get_env_file())
+        return P(self.templatedir, 'mkmf.template.%s' % compiler)
+
+    def source_fingerprint(self):
+        """A hash of the size and modification time of every file that can
+        affect compilation: the files in `path_names`, the other files in the
+        same directories (e.g. .inc files) and the shared include directories."""
+        directories = set([P(self.srcdir, 'shared', 'include'), P(self.srcdir, 'shared', 'mpp', 'include')])
+        for path in self.path_names:
+            directories.add(os.path.dirname(P(self.srcdir, path)))
+        h = hashlib.sha1()
+        if self.commit is not None:
+            h.update(self.git_commit.encode())
+        for directory in sorted(directories):
+            if not os.path.isdir(directory):
+                continue
+            for f in sorted(os.listdir(directory)):
+                filepath = P(directory, f)
+                if os.path.isfile(filepath):
+                    st = os.stat(filepath)
+                    h.update(('%s %d %d\n' % (filepath, st.st_size, st.st_mtime_ns)).encode())
+        return h.hexdigest()
+
+    def config_fingerprint(self, compile_flags_str, debug=False):
+        """A hash of everything other than the source code that determines
+        how the code is compiled: path names, preprocessor flags, the mkmf
+        template and the environment file."""
+        h = hashlib.sha1()
+        h.update('\n'.join(self.path_names).encode())
+        h.update(compile_flags_str.encode())
+        h.update(str(debug).encode())
+        for filepath in (self._mkmf_template(debug), get_env_file()):
+            if os.path.isfile(filepath):
+                with open(filepath, 'rb') as f:
+                    h.update(f.read())
+        return h.hexdigest()
+
+    def read_compile_fingerprint(self):
+        fingerprint_file = P(self.builddir, 'compile_fingerprint.json')
+        if not os.path.isfile(fingerprint_file):
+            return None
+        with open(fingerprint_file) as f:
+            return json.load(f)
+
+    def write_compile_fingerprint(self, fingerprint):
+        with open(P(self.builddir, 'compile_fingerprint.json'), 'w') as f:
+            json.dump(fingerprint, f, indent=2)
+
+    def clean_build(self):
+        """Remove compiled objects so that everything is recompiled."""
+        objects = glob.glob(P(self.builddir, '*.o')) + glob.glob(P(self.builddir, '*.mod'))
+        if objects:
+            sh.rm(objects)
+        self.log.info('Removed %d compiled object files from %s' % (len(objects), self.builddir))
+
     @useworkdir
     @destructive
-    def compile(self, debug=False, optimisation=None):
+    def compile(self, debug=False, optimisation=None, jobs=None, force=False):
+        """Compile the model.
+
+        Compilation is skipped if the executable exists and neither the source
+        code nor the compile configuration has changed since it was built.
+        If only source files have changed, `make` rebuilds just those files;
+        if the configuration (flags, path_names, mkmf template, environment)
+        has changed, all objects are rebuilt.
+
+        `jobs`: number of parallel `make` jobs.
+        `force`: compile even if the executable appears up to date.
+        """
         env = get_env_file()
         mkdir(self.builddir)
 
@@ -260,6 +347,19 @@ class CodeBase(Logger):
         # get path_names from the directory
         if not self.path_names:
             self.path_names = self.read_path_names(P(self.srcdir, 'extra', 'model', self.name, 'path_names'))
+        fingerprint = {'config': self.config_fingerprint(compile_flags_str, debug),
+                       'source': self.source_fingerprint()}
+        previous = self.read_compile_fingerprint()
+        if previous is not None and not force:
+            if previous == fingerprint and os.path.isfile(self.executable_fullpath):
+                self.log.info('Executable %s is up to date, skipping compilation.' % self.executable_fullpath)
+                return
+            if previous['config'] != fingerprint['config']:
+                self.log.info('Compile configuration has changed, rebuilding all objects.')
+                self.clean_build()
+        elif force:
+            self.clean_build()
+
         self.write_path_names(self.path_names)
         path_names_str = P(self.builddir, 'path_names')
 
@@ -273,6 +373,7 @@ class CodeBase(Logger):
             'path_names': path_names_str,
             'executable_name': self.executable_name,
             'run_idb': debug,
+            'make_opts': '-j%d' % jobs if jobs else '',
         }
 
         self.templates.get_template('compile.sh').stream(**vars).dump(P(self.builddir, 'compile.sh'))
@@ -280,6 +381,7 @@ class CodeBase(Logger):
         for line in sh.bash(P(self.builddir, 'compile.sh'), _iter=True, _err_to_out=True):
             self._log_line(line)
 
+        self.write_compile_fingerprint(fingerprint)
         self.log.info('Compilation complete.')
 
 
@@ -0,0 +1,143 @@
+"""Combine the per-core netcdf output of the model in python.
+
+When run on more than one core, FMS writes one file per core, e.g.
+`atmos_monthly.nc.0000`, `atmos_monthly.nc.0001`, ... each holding part of
+the global domain.  This module does the same job as the `mppnccombine.x`
+tool in `postprocessing/`, but without shelling out and re-sourcing the
+environment for every file, and combines many files at once on a process
+pool:
+
+    from isca.combine import combine_files
+    combine_files(['/path/to/run/atmos_monthly.nc', '/path/to/run/atmos_daily.nc'])
+
+Decomposed dimensions are described by the `domain_decomposition` attribute
+on the corresponding dimension variable, which is the four integers
+(global_start, global_end, local_start, local_end), 1-based.
+
+Requires the `netCDF4` python package.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+
+import numpy as np
+
+from isca.loghandler import log
+
+_SKIP_VARIABLE_ATTRS = ('domain_decomposition', '_FillValue')
+_SKIP_GLOBAL_ATTRS = ('NumFilesInSet', )
+
+
+def find_fragments(filebase):
+    """Return the sorted list of files `filebase.NNNN`."""
+    return sorted(glob.glob(filebase + '.[0-9][0-9][0-9][0-9]'))
+
+
+def _decomposition(ds):
+    """Return {dimension: (global_start, global_end, local_start, local_end)}
+    for all decomposed dimensions in an open dataset."""
+    decomp = {}
+    for name in ds.dimensions:
+        if name in ds.variables and 'domain_decomposition' in ds.variables[name].ncattrs():
+            decomp[name] = tuple(int(x) for x in ds.variables[name].getncattr('domain_decomposition'))
+    return decomp
+
+
+def _local_slices(var, decomp):
+    """The position of a fragment's part of `var` in the global array."""
+    slices = []
+    for dim in var.dimensions:
+        if dim in decomp:
+            gs, ge, ls, le = decomp[dim]
+            slices.append(slice(ls - gs, le - gs + 1))
+        else:
+            slices.append(slice(None))
+    return tuple(slices)
+
+
+def combine_fragments(filebase, outfile=None, remove_fragments=False):
+    """Combine the fragments `filebase.NNNN` into a single file.
+
+    outfile: the path to write to, default is `filebase`.
+    remove_fragments: if True, delete the input fragments once combined.
+    Returns the path of the combined file.
+    """
+    from netCDF4 import Dataset
+
+    if outfile is None:
+        outfile = filebase
+    fragments = find_fragments(filebase)
+    if not fragments:
+        raise IOError('No netcdf fragments found matching %s.NNNN' % filebase)
+
+    inputs = [Dataset(f, 'r') for f in fragments]
+    try:
+        first = inputs[0]
+        expected = getattr(first, 'NumFilesInSet', len(inputs))
+        if expected != len(inputs):
+            raise IOError('Expected %d fragments of %s but found %d' % (expected, filebase, len(inputs)))
+        decomps = [_decomposition(ds) for ds in inputs]
+        for ds in inputs:
+            ds.set_auto_maskandscale(False)
+
+        with Dataset(outfile, 'w', format=first.data_model) as out:
+            out.setncatts({k: first.getncattr(k) for k in first.ncattrs() if k not in _SKIP_GLOBAL_ATTRS})
+
+            for name, dim in first.dimensions.items():
+                if dim.isunlimited():
+                    out.createDimension(name, None)
+                elif name in decomps[0]:
+                    gs, ge, _, _ = decomps[0][name]
+                    out.createDimension(name, ge - gs + 1)
+                else:
+                    out.createDimension(name, len(dim))
+
+            for name, var in first.variables.items():
+                attrs = var.ncattrs()
+                fill_value = var.getncattr('_FillValue') if '_FillValue' in attrs else None
+                outvar = out.createVariable(name, var.dtype, var.dimensions, fill_value=fill_value)
+                outvar.setncatts({k: var.getncattr(k) for k in attrs if k not in _SKIP_VARIABLE_ATTRS})
+            out.set_auto_maskandscale(False)
+
+            for name, outvar in out.variables.items():
+                var = first.variables[name]
+                if not any(dim in decomps[0] for dim in var.dimensions):
+                    # not decomposed, every fragment holds the full variable
+                    if var.size:
+                        outvar[:] = var[:]
+                    continue
+                # assemble the global array in memory and write it once
+                shape = tuple(len(out.dimensions[d]) if d in decomps[0] else len(first.dimensions[d])
+                              for d in var.dimensions)
+                buf = np.zeros(shape, dtype=var.dtype)
+                for ds, decomp in zip(inputs, decomps):
+                    buf[_local_slices(var, decomp)] = ds.variables[name][:]
+                outvar[:] = buf
+    finally:
+        for ds in inputs:
+            ds.close()
+
+    if remove_fragments:
+        for f in fragments:
+            os.remove(f)
+    log.debug('Combined %d fragments into %s' % (len(fragments), outfile))
+    return outfile
+
+
+def combine_files(filebases, processes=None, remove_fragments=False):
+    """Combine the fragments of several files concurrently.
+
+    filebases: a list of paths, each of which has fragments `path.NNNN`.
+    processes: size of the process pool.  Defaults to one per file, up to
+        the number of cpus.
+    """
+    filebases = list(filebases)
+    if not filebases:
+        return []
+    if processes is None:
+        processes = min(len(filebases), os.cpu_count() or 1)
+    if processes == 1 or len(filebases) == 1:
+        return [combine_fragments(f, remove_fragments=remove_fragments) for f in filebases]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(combine_fragments, f, remove_fragments=remove_fragments) for f in filebases]
+        return [f.result() for f in futures]
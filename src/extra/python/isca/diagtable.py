@@ -30,6 +30,17 @@ _TEMPLATE = Template("""
 {% endfor %}
 """)
 
+# length of the diag table time units in seconds, with 30 day months as
+# in the thirty_day calendar
+UNIT_SECONDS = {'seconds': 1, 'minutes': 60, 'hours': 3600, 'days': 86400,
+                'months': 30 * 86400, 'years': 360 * 86400}
+
+# bytes per value of the precision written in the diag table (2 = 32 bit)
+VALUE_BYTES = 4
+
+# axes assumed for fields whose axes are not known
+DEFAULT_AXES = ('lon', 'lat', 'pfull')
+
 def numorstr(x):
     """Try to parse a string into an int or float."""
     x = x.strip()
@@ -77,6 +88,50 @@ class DiagTable(object):
         d.files = copy.deepcopy(self.files)
         return d
 
+    def records(self, name, run_seconds, dt=None):
+        """The number of time records output file `name` gets in a run of
+        `run_seconds`.  A frequency of 0 writes every timestep `dt`, -1 only
+        at the end of the run."""
+        f = self.files[name]
+        if f['freq'] < 0:
+            return 1
+        if f['freq'] == 0:
+            return int(run_seconds // dt) if dt else 1
+        return int(run_seconds // (f['freq'] * UNIT_SECONDS[f['units'].lower().rstrip('s') + 's']))
+
+    def estimate_sizes(self, grid, run_seconds, dt=None, field_info=None):
+        """Estimate the size in bytes of each output file for one run.
+
+        grid: the size of each axis, {'lon', 'lat', 'pfull', 'phalf'}.
+        run_seconds: the length of a run.
+        field_info: {(module, field): {'axes': [axis, ...], 'static': bool}},
+            as in `isca.nmlindex`; fields without known axes are assumed
+            to be 3-D, and listed as 'assumed'.  Static fields are written once.
+        Returns {file: {'records', 'bytes', 'fields': {field: bytes}, 'assumed': [fields]}}.
+        """
+        field_info = field_info or {}
+        sizes = {}
+        for name, f in self.files.items():
+            records = self.records(name, run_seconds, dt)
+            fields, assumed = {}, []
+            for field in f['fields']:
+                info = field_info.get((field['module'], field['name']), {})
+                axes = info.get('axes')
+                if axes is None:
+                    axes = DEFAULT_AXES
+                    assumed.append(field['name'])
+                values = 1
+                for axis in axes:
+                    values *= grid[axis]
+                fields[field['name']] = values * VALUE_BYTES * (1 if info.get('static') else records)
+            # axes, their bounds and the time axis
+            overhead = 8 * (sum(grid.values()) + grid['lon'] + grid['lat'] + 2) + 8 * records
+            if any(field['time_avg'] for field in f['fields']):
+                overhead += 5 * 8 * records     # average_T1, average_T2, average_DT, time_bounds
+            sizes[name] = {'records': records, 'bytes': sum(fields.values()) + overhead,
+                           'fields': fields, 'assumed': assumed}
+        return sizes
+
     def has_calendar(self):
         if self.calendar is None or self.calendar.lower() == 'no_calendar':
             return False
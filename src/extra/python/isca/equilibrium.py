@@ -0,0 +1,199 @@
+"""Detect when an experiment has spun up.
+
+After each run the monitor reads the new output file only, reduces each
+chosen field to an area weighted global mean (vertically integrated or
+mass weighted for fields on model levels) and appends it to a series kept
+in `<datadir>/equilibrium.json`.  Once there are `window` runs, the drift of
+each series over the last `window` runs is tested; when every field passes
+the experiment is spun up.
+
+    exp.enable_equilibrium_monitor(['t_surf', 'sphum'], window=36, period=12,
+                                   tolerance={'t_surf': 0.1, 'sphum': 0.05})
+    last = exp.run_until_spun_up(1, 240, num_cores=16)
+
+`period` is the length of the seasonal cycle in runs: the series is
+averaged over whole cycles before the trend is fitted, so the seasonal
+cycle is not mistaken for drift.  Two tests are available:
+
+    'drift'         the change over the window of a linear fit is no more
+                    than `tolerance` (in the units of the field, given per
+                    field or for all) plus `relative_tolerance` times the mean
+    'significance'  the slope of a linear fit is not significantly different
+                    from zero at level `alpha` (requires scipy)
+
+With asynchronous post-processing the output of a run is only read once it
+reaches the data directory, so `run_until_spun_up` may do a run or two
+more than needed.  `run_chain` updates the monitor but does not stop early.
+"""
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+GRAVITY = 9.80
+
+
+def global_mean(filename, field, vertical='integrate', pressure_range=None):
+    """Area weighted global and time mean of `field` in `filename`.
+    Fields on model levels are integrated over the column (kg/m^2 times the
+    units of the field) with `vertical='integrate'`, or averaged over the
+    mass of the column with 'mean'.  `pressure_range=(pmin, pmax)` in hPa
+    restricts the levels used."""
+    from netCDF4 import Dataset
+    with Dataset(filename) as ds:
+        var = ds.variables[field]
+        dims = var.dimensions
+        data = np.ma.filled(var[:].astype(float), np.nan)
+        lat = ds.variables['lat'][:]
+        if 'latb' in ds.variables:
+            latb = np.deg2rad(ds.variables['latb'][:])
+            weights = np.abs(np.diff(np.sin(latb)))
+        else:
+            weights = np.cos(np.deg2rad(lat))
+        if 'pfull' in dims:
+            phalf = ds.variables['phalf'][:] * 100.
+            dp = np.abs(np.diff(phalf))
+            if pressure_range is not None:
+                pfull = ds.variables['pfull'][:]
+                dp = np.where((pfull >= pressure_range[0]) & (pfull <= pressure_range[1]), dp, 0.)
+
+    # move lat and lon to the end and average over them
+    lat_axis, lon_axis = dims.index('lat'), dims.index('lon')
+    data = np.moveaxis(data, (lat_axis, lon_axis), (-2, -1))
+    dims = [d for d in dims if d not in ('lat', 'lon')]
+    data = np.nansum(data * weights[:, None], axis=-2) / (weights.sum() * data.shape[-1])
+    data = data.sum(axis=-1)
+    if 'pfull' in dims:
+        axis = dims.index('pfull')
+        data = np.moveaxis(data, axis, -1)
+        if vertical == 'integrate':
+            data = (data * dp).sum(axis=-1) / GRAVITY
+        elif vertical == 'mean':
+            data = (data * dp).sum(axis=-1) / dp.sum()
+        else:
+            raise ValueError("Unknown vertical reduction %r, use 'integrate' or 'mean'" % vertical)
+    return float(np.mean(data))
+
+
+def drift(values, period=1):
+    """Change over `values` of a linear fit to the means over each period.
+    Returns (drift, slope per period, the period means)."""
+    values = np.asarray(values, dtype=float)
+    n = (len(values) // period) * period
+    blocks = values[len(values) - n:].reshape(-1, period).mean(axis=1)
+    if len(blocks) < 2:
+        return np.nan, np.nan, blocks
+    slope = np.polyfit(np.arange(len(blocks)), blocks, 1)[0]
+    return slope * len(blocks), slope, blocks
+
+
+class EquilibriumMonitor(Logger):
+    """Test global means of fields in the output for drift.
+    See the module documentation."""
+
+    def __init__(self, statefile, fields=('t_surf', ), filename='atmos_monthly.nc', window=36, period=12,
+                 tolerance=0.1, relative_tolerance=0., test='drift', alpha=0.05, vertical='integrate',
+                 pressure_range=None):
+        if window < 2 * period:
+            raise ValueError('The window (%d runs) must cover at least two periods of %d runs' % (window, period))
+        if test not in ('drift', 'significance'):
+            raise ValueError("Unknown test %r, use 'drift' or 'significance'" % test)
+        self.statefile = statefile
+        self.fields = list(fields)
+        self.filename = filename
+        self.window = window
+        self.period = period
+        self.tolerance = tolerance
+        self.relative_tolerance = relative_tolerance
+        self.test = test
+        self.alpha = alpha
+        self.vertical = vertical
+        self.pressure_range = pressure_range
+        self.series = {field: {} for field in self.fields}
+        self.equilibrated = False
+        self.result = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if os.path.isfile(self.statefile):
+            with open(self.statefile) as f:
+                state = json.load(f)
+            for field in self.fields:
+                self.series[field].update({int(i): v for i, v in state.get('series', {}).get(field, {}).items()})
+            self.check()
+
+    def save(self):
+        mkdir(os.path.dirname(self.statefile))
+        state = {'series': {f: {str(i): v for i, v in s.items()} for f, s in self.series.items()},
+                 'equilibrated': self.equilibrated, 'result': self.result}
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(self.statefile), prefix='.equilibrium')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmpfile, self.statefile)
+
+    def add_output(self, i, outdir):
+        """Add the global means of run `i` from its output directory."""
+        filename = P(outdir, self.filename)
+        values = {field: global_mean(filename, field, self.vertical, self.pressure_range) for field in self.fields}
+        with self._lock:
+            for field, value in values.items():
+                self.series[field][i] = value
+            self.check()
+            self.save()
+        return values
+
+    def recent(self, field):
+        """The values of the last `window` consecutive runs."""
+        series = self.series[field]
+        if not series:
+            return []
+        i = max(series)
+        values = []
+        while i in series and len(values) < self.window:
+            values.append(series[i])
+            i -= 1
+        return values[::-1]
+
+    def _tolerance(self, field):
+        if isinstance(self.tolerance, dict):
+            return self.tolerance.get(field, 0.)
+        return self.tolerance
+
+    def check(self):
+        """Test each field.  Sets and returns `equilibrated`."""
+        result = {}
+        for field in self.fields:
+            values = self.recent(field)
+            if len(values) < self.window:
+                result[field] = {'passed': False, 'runs': len(values)}
+                continue
+            change, slope, blocks = drift(values, self.period)
+            if self.test == 'drift':
+                limit = self._tolerance(field) + self.relative_tolerance * abs(np.mean(blocks))
+                passed = bool(abs(change) <= limit)
+                result[field] = {'passed': passed, 'drift': change, 'limit': limit}
+            else:
+                from scipy.stats import linregress
+                p = linregress(np.arange(len(blocks)), blocks).pvalue
+                passed = bool(p > self.alpha)
+                result[field] = {'passed': passed, 'drift': change, 'pvalue': p}
+        self.result = result
+        self.equilibrated = all(r['passed'] for r in result.values())
+        return self.equilibrated
+
+    def summary(self):
+        lines = []
+        for field, r in (self.result or {}).items():
+            if 'drift' not in r:
+                lines.append('%s: %d of %d runs' % (field, r['runs'], self.window))
+            elif 'limit' in r:
+                lines.append('%s: drift %.3g (limit %.3g) %s' % (field, r['drift'], r['limit'], 'ok' if r['passed'] else ''))
+            else:
+                lines.append('%s: drift %.3g (p=%.2f) %s' % (field, r['drift'], r['pvalue'], 'ok' if r['passed'] else ''))
+        return '\n'.join(lines)
@@ -1,12 +1,14 @@
 import os
 import re
+import shutil
+import tempfile
+import time
 
 from f90nml import Namelist
 from jinja2 import Environment, FileSystemLoader
 import glob
 import sh   
 import pdb
-import tarfile
 
 # from gfdl import create_alert
 # import getpass
@@ -15,6 +17,22 @@ from isca import GFDL_WORK, GFDL_DATA, GFDL_BASE, _module_directory, get_env_fil
 from isca.diagtable import DiagTable
 from isca.loghandler import Logger, clean_log_debug
 from isca.helpers import destructive, useworkdir, mkdir
+from isca.postprocess import PostProcessor
+from isca.combine import combine_files
+from isca.inputcache import InputFileCache
+from isca.restarts import TarGzRestartStorage, RESTART_SUFFIXES, extract_restart, _link_or_copy
+from isca.runindex import RunIndex
+from isca.telemetry import Telemetry
+from isca.timing import PhaseTimer, path_size
+from isca.autotune import check_core_count
+from isca.scratch import LocalScratch, copy_verified
+from isca.watchdog import Watchdog
+from isca.equilibrium import EquilibriumMonitor
+from isca.manifest import ManifestWriter
+from isca.catalog import Catalog
+from isca.memo import RunMemo
+from isca.preflight import Preflight, namelist_index
+from isca.iobudget import OutputBudget
 
 P = os.path.join
 
@@ -23,6 +41,8 @@ class CompilationError(Exception):
 
 class FailedRunError(Exception): pass
 
+class BlowUpError(FailedRunError): pass
+
 class Experiment(Logger, EventEmitter):
     """A basic GFDL experiment"""
 
@@ -56,7 +76,8 @@ class Experiment(Logger, EventEmitter):
     }
 
     runfmt = 'run%04d'
-    restartfmt = 'res%04d.tar.gz'
+    # written to the output directory of a run once all its output is in place
+    completefile = 'run_complete'
 
     def __init__(self, name, codebase, safe_mode=False, workbase=GFDL_WORK, database=GFDL_DATA):
         super(Experiment, self).__init__()
@@ -83,6 +104,51 @@ class Experiment(Logger, EventEmitter):
 
         self.namelist = Namelist()
 
+        # background worker pool for post-run tasks, see `enable_async_postprocessing`
+        self.postprocessor = None
+
+        # tool used to combine the per-core output files:
+        # 'mppnccombine' (the compiled tool in postprocessing/) or 'python' (isca.combine)
+        self.combine_tool = 'mppnccombine'
+        self.combine_processes = None
+
+        # format of the restart archives, see `isca.restarts`
+        self.restart_storage = TarGzRestartStorage()
+
+        # content addressed store of input files, see `enable_input_cache`
+        self.input_cache = None
+
+        # throughput metrics parsed from the model output, see `enable_telemetry`
+        self.telemetry = None
+
+        # node-local storage for the run directory, see `enable_local_scratch`
+        self.scratch = None
+
+        # number of cores used by `run()` and `run_chain()` when not given, see `isca.autotune`
+        self.num_cores = 8
+
+        # wall time, bytes moved and core-hours of each phase of a run, see `isca.timing`
+        self.timer = PhaseTimer(self)
+
+        # kills runs that go numerically unstable, see `enable_watchdog`
+        self.watchdog = None
+        self.current_process = None
+
+        # drift of global means of the output, see `enable_equilibrium_monitor`
+        self.equilibrium = None
+
+        # checksums of the output and restart files, see `enable_manifests`
+        self.manifest = None
+
+        # database of runs, files and timings, see `enable_catalog`
+        self.catalog = None
+
+        # index of completed runs by their specification, see enable_memoization
+        self.memo = None
+
+        # checks of the configuration before each run, see enable_preflight
+        self.preflight = None
+
     @destructive
     def rm_workdir(self):
         try:
@@ -115,9 +181,27 @@ class Experiment(Logger, EventEmitter):
         mkdir(self.rundir)
         self.log.info('Emptied run directory %r' % self.rundir)
 
+    @property
+    def restartfmt(self):
+        return 'res%04d' + self.restart_storage.suffix
+
     def get_restart_file(self, i):
         return P(self.restartdir, self.restartfmt % i)
 
+    def find_restart_file(self, i):
+        """Return the path to an existing restart archive for run `i`.
+        Archives written in a different restart storage format, e.g. before
+        `restart_storage` was changed, are also found.  Returns the default
+        path if no archive exists."""
+        resfile = self.get_restart_file(i)
+        if os.path.exists(resfile):
+            return resfile
+        for suffix in RESTART_SUFFIXES:
+            candidate = P(self.restartdir, ('res%04d' + suffix) % i)
+            if os.path.exists(candidate):
+                return candidate
+        return resfile
+
     def get_outputdir(self, run):
         return P(self.datadir, self.runfmt % run)
 
@@ -176,9 +260,9 @@ class Experiment(Logger, EventEmitter):
         #return clean_log_debug(outputstring)
 
     def delete_restart(self, run):
-        resfile = self.get_restart_file(run)
-        if os.path.isfile(resfile):
-            sh.rm(resfile)
+        resfile = self.find_restart_file(run)
+        if os.path.exists(resfile):
+            sh.rm('-r', resfile)
             self.log.info('Deleted restart file %s' % resfile)
 
     def get_calendar(self):
@@ -193,11 +277,23 @@ class Experiment(Logger, EventEmitter):
         outdir = P(self.datadir, self.runfmt % i)
         return os.path.isdir(outdir)
 
+    def run_is_complete(self, i):
+        """True if run `i` has its restart archive and all of its output.
+        With `enable_async_postprocessing` the output directory and restart
+        exist before the diagnostic output has been copied, so the run is
+        only complete once it has been marked as such."""
+        return (os.path.isfile(P(self.get_outputdir(i), self.completefile))
+                and os.path.exists(self.find_restart_file(i)))
+
+    def mark_run_complete(self, i):
+        with open(P(self.get_outputdir(i), self.completefile), 'w') as f:
+            f.write('%s\n' % time.strftime('%Y-%m-%dT%H:%M:%S'))
+
     @destructive
     @useworkdir
-    def run(self, i, restart_file=None, use_restart=True, multi_node=False, num_cores=8, overwrite_data=False, save_run=False, run_idb=False, nice_score=0, mpirun_opts=''):
+    def run(self, i, restart_file=None, use_restart=True, multi_node=False, num_cores=None, overwrite_data=False, save_run=False, run_idb=False, nice_score=0, mpirun_opts=''):
         """Run the model.0
-            `num_cores`: Number of mpi cores to distribute over.
+            `num_cores`: Number of mpi cores to distribute over.  Defaults to `self.num_cores`.
             `restart_file` (optional): A path to a valid restart archive.  If None and `use_restart=True`,
                                        restart file (i-1) will be used.
             `save_run`:  If True, copy the entire working directory over to GFDL_DATA
@@ -206,12 +302,190 @@ class Experiment(Logger, EventEmitter):
 
         """
 
-        self.clear_rundir()
+        if self.postprocessor is not None:
+            # raise any errors from the post-processing of previous runs
+            self.postprocessor.check()
+        num_cores = num_cores or self.num_cores
+        check_core_count(self, num_cores)
+        if self.preflight is not None:
+            self.preflight.check(self, num_cores)
+        self.select_rundir()
 
         indir =  P(self.rundir, 'INPUT')
         outdir = P(self.datadir, self.runfmt % i)
         resdir = P(self.rundir, 'RESTART')
 
+        spec_hash = None
+        if self.memo is not None:
+            spec_hash = self.memo.spec_hash(self, self.find_run_restart(i, restart_file, use_restart), num_cores)
+            entry = self.memo.lookup(self, spec_hash)
+            if entry is not None:
+                if entry['outdir'] == outdir:
+                    self.log.info('Run %d is unchanged since it was last run, not running it again' % i)
+                    return True
+                if not self.prepare_outputdir(i, overwrite_data):
+                    return False
+                self.memo.reuse(self, i, entry, spec_hash)
+                self.emit('run:finished', self, i)
+                if self.catalog is not None:
+                    self.catalog.record_run(self, i, num_cores)
+                return True
+
+        with self.timer.span('setup', i) as span:
+            self.clear_rundir()
+
+            if not self.prepare_outputdir(i, overwrite_data):
+                return False
+
+            self.setup_rundir()
+            span['bytes'] = path_size(indir)
+
+        with self.timer.span('restart_extract', i) as span:
+            restart_file = self.use_restart_archive(i, restart_file, use_restart)
+            span['bytes'] = path_size(restart_file)
+
+        self.write_runscript(num_cores, multi_node, run_idb, nice_score, mpirun_opts)
+        try:
+            with self.timer.span('model', i, cores=num_cores):
+                self.execute(i)
+        except BlowUpError as e:
+            if not self.reduce_timestep(i, str(e)):
+                raise
+            return self.run(i, restart_file=restart_file, use_restart=restart_file is not None,
+                            multi_node=multi_node, num_cores=num_cores, overwrite_data=True,
+                            save_run=save_run, run_idb=run_idb, nice_score=nice_score, mpirun_opts=mpirun_opts)
+        mkdir(outdir)
+
+        self.combine_restarts(num_cores, i)
+        self.write_restart_manifest(i)
+
+        # make the restart archive and delete the restart files
+        with self.timer.span('restart_archive', i) as span:
+            span['bytes'] = path_size(resdir)
+            self.make_restart_archive(self.get_restart_file(i), resdir)
+            sh.rm('-r', resdir)
+
+        self.collect_diag_output(i, num_cores)
+
+        with self.timer.span('save_run', i) as span:
+            if save_run:
+                # copy the complete run directory to GFDL_DATA so that the run can
+                # be recreated without the python script if required
+                mkdir(resdir)
+                span['bytes'] = path_size(self.rundir)
+                sh.cp(['-a', self.rundir, outdir])
+            else:
+                self.save_run_info(outdir)
+
+            self.clear_rundir()
+        if self.postprocessor is None:
+            self.mark_run_complete(i)
+        self.emit('run:finished', self, i)
+        if self.catalog is not None:
+            self.catalog.record_run(self, i, num_cores)
+        if spec_hash is not None:
+            self.memo.record(self, i, spec_hash)
+        return True
+
+    @destructive
+    @useworkdir
+    def run_chain(self, start, end, archive_interval=12, restart_file=None, use_restart=True, multi_node=False, num_cores=None, overwrite_data=False, run_idb=False, nice_score=0, mpirun_opts=''):
+        """Run the model for runs `start` to `end` inclusive in a single run directory.
+
+        Rather than archiving the restart files and extracting them again
+        between each run, the RESTART files of one run are moved to INPUT
+        ready for the next.  A restart archive is only written every
+        `archive_interval` runs, and for the final run.  If a run fails, the
+        restart from the last successful run is archived so the experiment
+        can be continued with `run()` or `run_chain()`.  A run that blows up
+        is retried in the same run directory as set by `enable_watchdog`.
+
+        Other arguments are as for `run()`.
+        """
+        if self.postprocessor is not None:
+            self.postprocessor.check()
+        num_cores = num_cores or self.num_cores
+        check_core_count(self, num_cores)
+        if self.preflight is not None:
+            self.preflight.check(self, num_cores, runs=end - start + 1)
+        self.select_rundir()
+
+        indir =  P(self.rundir, 'INPUT')
+        resdir = P(self.rundir, 'RESTART')
+
+        with self.timer.span('setup', start) as span:
+            self.clear_rundir()
+            self.setup_rundir()
+            span['bytes'] = path_size(indir)
+        with self.timer.span('restart_extract', start) as span:
+            restart_file = self.use_restart_archive(start, restart_file, use_restart)
+            span['bytes'] = path_size(restart_file)
+        self.write_runscript(num_cores, multi_node, run_idb, nice_score, mpirun_opts)
+
+        restart_names = []   # restart files in INPUT that have not been archived
+        last_run = None
+        try:
+            for i in range(start, end+1):
+                if not self.prepare_outputdir(i, overwrite_data):
+                    raise ValueError('Data for run %d already exists, cannot continue the run chain.' % i)
+
+                with self.timer.span('model', i, cores=num_cores):
+                    self.execute_retrying(i)
+                outdir = self.get_outputdir(i)
+                mkdir(outdir)
+                self.combine_restarts(num_cores, i)
+                self.write_restart_manifest(i)
+
+                if (i - start + 1) % archive_interval == 0 or i == end:
+                    with self.timer.span('restart_archive', i) as span:
+                        span['bytes'] = path_size(resdir)
+                        self.make_restart_archive(self.get_restart_file(i), resdir)
+                    archived = True
+                else:
+                    archived = False
+
+                # the restart files of this run are the initial conditions of the next
+                with self.timer.span('restart_move', i):
+                    if os.listdir(resdir):
+                        restart_names = os.listdir(resdir)
+                        for f in restart_names:
+                            os.replace(P(resdir, f), P(indir, f))
+                    else:
+                        # the archive took the files, e.g. DirectoryRestartStorage
+                        restart_names = self.extract_restart_archive(self.get_restart_file(i), indir)
+                if archived:
+                    restart_names = []
+                last_run = i
+
+                self.collect_diag_output(i, num_cores)
+                self.save_run_info(outdir)
+                if self.postprocessor is None:
+                    self.mark_run_complete(i)
+                self.emit('run:finished', self, i)
+                if self.catalog is not None:
+                    self.catalog.record_run(self, i, num_cores)
+        except Exception:
+            if restart_names:
+                self.log.warning('Run chain stopped, archiving restart from run %d' % last_run)
+                # stage next to the run directory, which may be on local scratch
+                tmpdir = tempfile.mkdtemp(dir=os.path.dirname(self.rundir), prefix='chain_restart')
+                try:
+                    for f in restart_names:
+                        _link_or_copy(P(indir, f), P(tmpdir, f))
+                    self.make_restart_archive(self.get_restart_file(last_run), tmpdir)
+                except Exception:
+                    self.log.exception('Could not archive the restart from run %d' % last_run)
+                finally:
+                    shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+        self.clear_rundir()
+        return True
+
+    def prepare_outputdir(self, i, overwrite_data=False):
+        """Check whether output for run `i` already exists, removing it if
+        `overwrite_data` is True.  Returns False if the run should not go ahead."""
+        outdir = self.get_outputdir(i)
         if self.check_for_existing_output(i):
             if overwrite_data:
                 self.log.warning('Data for run %d already exists and overwrite_data is True. Overwriting.' % i)
@@ -219,6 +493,12 @@ class Experiment(Logger, EventEmitter):
             else:
                 self.log.warn('Data for run %d already exists but overwrite_data is False. Stopping.' % i)
                 return False
+        return True
+
+    def setup_rundir(self):
+        """Write the configuration files to the run directory and copy over the input files."""
+        indir =  P(self.rundir, 'INPUT')
+        resdir = P(self.rundir, 'RESTART')
 
         # make the output run folder and copy over the input files
         mkdir([indir, resdir, self.restartdir])
@@ -229,30 +509,42 @@ class Experiment(Logger, EventEmitter):
         self.write_diag_table(self.rundir)
 
         for filename in self.inputfiles:
-            sh.cp([filename, P(indir, os.path.split(filename)[1])])
-
-        if multi_node:
-            mpirun_opts += ' -bootstrap pbsdsh -f $PBS_NODEFILE'
+            if self.input_cache is not None:
+                self.input_cache.link_into(filename, indir)
+            else:
+                sh.cp([filename, P(indir, os.path.split(filename)[1])])
 
+    def find_run_restart(self, i, restart_file=None, use_restart=True):
+        """Return the restart archive run `i` would start from, or None."""
         if use_restart and not restart_file and i == 1:
             # no restart file specified, but we are at first run number
             self.log.warn('use_restart=True, but restart_file not specified.  As this is run 1, assuming spin-up from namelist stated initial conditions so continuing.')
             use_restart = False
 
-        if use_restart:
-            if not restart_file:
-                # get the restart from previous iteration
-                restart_file = self.get_restart_file(i - 1)
-            if not os.path.isfile(restart_file):
-                self.log.error('Restart file not found, expecting file %r' % restart_file)
-                raise IOError('Restart file not found, expecting file %r' % restart_file)
-            else:
-                self.log.info('Using restart file %r' % restart_file)
-
-            self.extract_restart_archive(restart_file, indir)
+        if not use_restart:
+            return None
+        if not restart_file:
+            # get the restart from previous iteration
+            restart_file = self.find_restart_file(i - 1)
+        if not os.path.exists(restart_file):
+            self.log.error('Restart file not found, expecting file %r' % restart_file)
+            raise IOError('Restart file not found, expecting file %r' % restart_file)
+        return restart_file
+
+    def use_restart_archive(self, i, restart_file=None, use_restart=True):
+        """Extract the restart archive for run `i` into the run directory.
+        Returns the restart file used, or None."""
+        restart_file = self.find_run_restart(i, restart_file, use_restart)
+        if restart_file is not None:
+            self.log.info('Using restart file %r' % restart_file)
+            self.extract_restart_archive(restart_file, P(self.rundir, 'INPUT'))
         else:
             self.log.info('Running without restart file')
-            restart_file = None
+        return restart_file
+
+    def write_runscript(self, num_cores=8, multi_node=False, run_idb=False, nice_score=0, mpirun_opts=''):
+        if multi_node:
+            mpirun_opts += ' -bootstrap pbsdsh -f $PBS_NODEFILE'
 
         vars = {
             'rundir': self.rundir,
@@ -270,16 +562,31 @@ class Experiment(Logger, EventEmitter):
         # employ the template to create a runscript
         t = runscript.stream(**vars).dump(P(self.rundir, 'run.sh'))
 
+    def execute(self, i):
+        """Run the model executable in the prepared run directory."""
+        telemetry = self.telemetry
+        watchdog = self.watchdog
+
         def _outhandler(line):
+            if watchdog is not None:
+                watchdog.check_output(self, line)
+            record = telemetry.parse(line) if telemetry is not None else None
             handled = self.emit('run:output', self, line)
-            if not handled: # only log the output when no event handler is used
+            if record is not None:
+                self.emit('run:progress', self, telemetry)
+            elif not handled: # only log the output when no event handler is used
                 self.log_output(line)
 
+        if telemetry is not None:
+            telemetry.start(i, self.get_calendar())
+        if watchdog is not None:
+            watchdog.start(i)
         self.emit('run:ready', self, i)
         self.log.info("Beginning run %d" % i)
         try:
             #for line in sh.bash(P(self.rundir, 'run.sh'), _iter=True, _err_to_out=True):
             proc = sh.bash(P(self.rundir, 'run.sh'), _bg=True, _out=_outhandler, _err_to_out=True)
+            self.current_process = proc
             self.log.info('process running as {}'.format(proc.process.pid))
             proc.wait()
             completed = True
@@ -292,76 +599,333 @@ class Experiment(Logger, EventEmitter):
             raise e
         except sh.ErrorReturnCode as e:
             completed = False
+            if watchdog is not None and watchdog.reason is not None:
+                self.emit('run:failed', self)
+                raise BlowUpError(watchdog.reason)
             self.log.error("Run %d failed. See log for details." % i)
             self.log.error("Error: %r" % e)
             self.emit('run:failed', self)
             raise FailedRunError()
+        finally:
+            self.current_process = None
+
+        if watchdog is not None and watchdog.reason is not None:
+            # the run finished before it could be killed
+            self.emit('run:failed', self)
+            raise BlowUpError(watchdog.reason)
+
+        if telemetry is not None:
+            telemetry.finish()
+            outdir = self.get_outputdir(i)
+            mkdir(outdir)
+            telemetry.save(P(outdir, 'telemetry.json'))
+            self.log.info('Run %d: %.2f model days per second, %.2f simulated years per day' %
+                          (i, telemetry.model_days_per_second, telemetry.sypd))
 
         self.emit('run:complete', self, i)
         self.log.info('Run %d complete' % i)
-        mkdir(outdir)
 
+    def combine_restarts(self, num_cores, i=None):
+        """Combine the per-core restart files in the RESTART directory."""
         if num_cores > 1:
-            # use postprocessing tool to combine the output from several cores
-            codebase_combine_script = P(self.codebase.builddir, 'mppnccombine_run.sh')
-            if not os.path.exists(codebase_combine_script):
-                self.log.warning('combine script does not exist in the commit you are running Isca from.  Falling back to using $GFDL_BASE mppnccombine_run.sh script')
-                sh.ln('-s',  P(GFDL_BASE, 'postprocessing', 'mppnccombine_run.sh'), codebase_combine_script)
-            combinetool = sh.Command(codebase_combine_script)
+            resdir = P(self.rundir, 'RESTART')
+            # combine the restart files immediately, the next run needs them
+            restartfiles = [r.replace('.0000', '') for r in glob.glob(P(resdir, '*.res.nc.0000'))]
+            with self.timer.span('combine_restarts', i, cores=self.combine_cores()) as span:
+                self.combine_netcdf_files(restartfiles)
+                span['bytes'] = path_size(*restartfiles)
+            for restartfile in restartfiles:
+                sh.rm(glob.glob(restartfile+'.????'))
+                self.log.debug("Restart file %s combined" % restartfile)
+
+    def write_restart_manifest(self, i):
+        """Add the restart files of run `i` to its manifest."""
+        if self.manifest is not None:
+            self.manifest.add_directory(self.get_outputdir(i), P(self.rundir, 'RESTART'), 'RESTART')
+
+    def collect_diag_output(self, i, num_cores):
+        """Combine the diagnostic output of run `i` and copy it to the data
+        directory, in the background if `enable_async_postprocessing` is used."""
+        if self.postprocessor is not None:
+            # move the diagnostic output out of the way so the next run can
+            # start while it is combined and copied in the background
+            # next to the run directory, so this stays on local scratch if used
+            stagedir = P(os.path.dirname(self.rundir), 'postprocess', self.runfmt % i)
+            mkdir(stagedir)
+            if num_cores > 1 and self.combine_tool == 'mppnccombine':
+                # resolve the combine tool here rather than in the worker threads
+                self.get_combine_tool()
             for file in self.diag_table.files:
-                netcdf_file = '%s.nc' % file
-                filebase = P(self.rundir, netcdf_file)
+                sh.mv(glob.glob(P(self.rundir, '%s.nc*' % file)), stagedir)
+            self.postprocessor.submit(self.process_diag_output, i, stagedir, num_cores, cleanup=True,
+                                      mark_complete=True, description='%s run %d output' % (self.name, i))
+        else:
+            self.process_diag_output(i, self.rundir, num_cores)
+
+    def save_run_info(self, outdir):
+        # just save some useful diagnostic information
+        self.write_namelist(outdir)
+        self.write_field_table(outdir)
+        self.write_diag_table(outdir)
+        self.codebase.write_source_control_status(P(outdir, 'git_hash_used.txt'))
+
+    def get_combine_tool(self):
+        """Return the command used to combine the per-core netcdf output."""
+        codebase_combine_script = P(self.codebase.builddir, 'mppnccombine_run.sh')
+        if not os.path.exists(codebase_combine_script):
+            self.log.warning('combine script does not exist in the commit you are running Isca from.  Falling back to using $GFDL_BASE mppnccombine_run.sh script')
+            sh.ln('-s',  P(GFDL_BASE, 'postprocessing', 'mppnccombine_run.sh'), codebase_combine_script)
+        return sh.Command(codebase_combine_script)
+
+    def combine_cores(self):
+        """Number of cores used to combine netcdf files."""
+        if self.combine_tool == 'python':
+            return self.combine_processes or os.cpu_count() or 1
+        return 1
+
+    def combine_netcdf(self, filebase):
+        """Combine the fragments `filebase.NNNN` written by each core into `filebase`."""
+        self.combine_netcdf_files([filebase])
+
+    def combine_netcdf_files(self, filebases):
+        """Combine the fragments of each of `filebases`.
+        With `combine_tool = 'python'` the files are combined concurrently
+        on a pool of `combine_processes` processes."""
+        if self.combine_tool == 'python':
+            combine_files(filebases, processes=self.combine_processes)
+        elif self.combine_tool == 'mppnccombine':
+            combinetool = self.get_combine_tool()
+            for filebase in filebases:
                 combinetool(self.codebase.builddir, filebase)
-                # copy the combined netcdf file into the data archive directory
-                sh.cp(filebase, P(outdir, netcdf_file))
-                # remove all netcdf fragments from the run directory
+        else:
+            raise ValueError('Unknown combine_tool %r, use "mppnccombine" or "python"' % self.combine_tool)
+
+    def process_diag_output(self, i, sourcedir, num_cores, cleanup=False, mark_complete=False):
+        """Combine the diagnostic output of run `i` found in `sourcedir` and
+        copy it to the data directory.  If `cleanup` is True, `sourcedir` is
+        removed afterwards.  If `mark_complete` is True, the run is marked
+        complete once its output is in place."""
+        outdir = self.get_outputdir(i)
+        filebases = [P(sourcedir, '%s.nc' % file) for file in self.diag_table.files]
+        if num_cores > 1:
+            # use postprocessing tool to combine the output from several cores
+            with self.timer.span('combine_output', i, cores=self.combine_cores()) as span:
+                self.combine_netcdf_files(filebases)
+                span['bytes'] = path_size(*filebases)
+        if self.manifest is not None:
+            self.manifest.add_files(outdir, {os.path.basename(f): f for f in filebases})
+        with self.timer.span('copy_output', i) as span:
+            span['bytes'] = path_size(*filebases)
+            for filebase in filebases:
+                netcdf_file = os.path.basename(filebase)
+                # copy the netcdf file into the data archive directory
+                if self.scratch is not None:
+                    copy_verified(filebase, P(outdir, netcdf_file))
+                else:
+                    sh.cp(filebase, P(outdir, netcdf_file))
+                # remove all netcdf fragments from the source directory
                 sh.rm(glob.glob(filebase+'*'))
                 self.log.debug('%s combined and copied to data directory' % netcdf_file)
-
-            for restart in glob.glob(P(resdir, '*.res.nc.0000')):
-                restartfile = restart.replace('.0000', '')
-                combinetool(self.codebase.builddir, restartfile)
-                sh.rm(glob.glob(restartfile+'.????'))
-                self.log.debug("Restart file %s combined" % restartfile)
-
+        if num_cores > 1:
             self.emit('run:combined', self, i)
+        if cleanup:
+            sh.rm('-r', sourcedir)
+        if mark_complete:
+            self.mark_run_complete(i)
+        if self.equilibrium is not None:
+            self.update_equilibrium(i)
+        if self.catalog is not None and cleanup:
+            # update the record of the run now the output is in place
+            self.catalog.record_run(self, i)
+
+    def enable_async_postprocessing(self, max_workers=2, max_pending=4):
+        """Combine and copy diagnostic output in the background so that the
+        next run can start as soon as the restart archive has been written.
+
+        At most `max_pending` runs may be waiting for post-processing before
+        `run()` blocks.  Call `wait_for_postprocessing()` before using the
+        output data."""
+        self.postprocessor = PostProcessor(max_workers, max_pending)
+
+    def enable_input_cache(self, cachedir=None, link='hardlink'):
+        """Link input files into the run directory from a content addressed
+        cache instead of copying them at the start of every run."""
+        kwargs = {'link': link} if cachedir is None else {'cachedir': cachedir, 'link': link}
+        self.input_cache = InputFileCache(**kwargs)
+
+    def enable_local_scratch(self, scratchdir=None, min_free_gb=5.0, async_drain=True):
+        """Run the model in a directory on node-local storage (`scratchdir`,
+        default $TMPDIR) rather than in GFDL_WORK, and drain the output to
+        GFDL_DATA with checksum verification.  Runs fall back to GFDL_WORK
+        when less than `min_free_gb` is free.  If `async_drain` is True,
+        asynchronous post-processing is enabled so the output is drained in
+        the background.  See `isca.scratch`."""
+        self.scratch = LocalScratch(scratchdir, min_free_gb)
+        self.shared_rundir = self.rundir
+        if async_drain and self.postprocessor is None:
+            self.enable_async_postprocessing()
+
+    def select_rundir(self):
+        """Use the local scratch run directory if there is space for it."""
+        if self.scratch is None:
+            return
+        if self.scratch.has_space():
+            self.rundir = P(self.scratch.workdir(self), 'run')
         else:
+            self.log.warning('Falling back to the run directory in GFDL_WORK')
+            self.rundir = self.shared_rundir
+        self.log.info('Running in %s' % self.rundir)
+
+    def enable_telemetry(self, window=10):
+        """Record the model throughput from the JSON progress records the
+        model prints each day.  Turns on `spectral_dynamics_nml:json_logging`.
+        See `isca.telemetry`."""
+        self.update_namelist({'spectral_dynamics_nml': {'json_logging': True}})
+        self.telemetry = Telemetry(window=window)
+
+    def enable_watchdog(self, max_speed=250., min_temperature=None, max_temperature=None, retries=0, dt_factor=0.5, min_dt=60, **limits):
+        """Kill runs as soon as the maximum wind speed or global mean
+        temperature printed each day is NaN or outside the given limits.
+        Limits on other fields of the progress records can be given as
+        `field=(minimum, maximum)`.  A run that blows up in `run` or
+        `run_chain` is retried up to `retries` times with `dt_atmos` reduced
+        by `dt_factor`, but not below `min_dt`.  Turns on `spectral_dynamics_nml:json_logging`.
+        See `isca.watchdog`."""
+        self.update_namelist({'spectral_dynamics_nml': {'json_logging': True}})
+        self.watchdog = Watchdog(max_speed, min_temperature, max_temperature, limits, retries, dt_factor, min_dt)
+
+    def execute_retrying(self, i):
+        """Execute run `i`, and repeat it from the same INPUT files with a
+        smaller timestep if it blows up and the watchdog allows."""
+        while True:
+            try:
+                return self.execute(i)
+            except BlowUpError as e:
+                if not self.reduce_timestep(i, str(e)):
+                    raise
+            os.remove(P(self.rundir, 'input.nml'))
+            self.write_namelist(self.rundir)
+            resdir = P(self.rundir, 'RESTART')
+            shutil.rmtree(resdir)
+            mkdir(resdir)
             for file in self.diag_table.files:
-                netcdf_file = '%s.nc' % file
-                filebase = P(self.rundir, netcdf_file)
-                sh.cp(filebase, P(outdir, netcdf_file))
-                sh.rm(glob.glob(filebase+'*'))
-                self.log.debug('%s copied to data directory' % netcdf_file)
+                for f in glob.glob(P(self.rundir, file + '.nc*')):
+                    os.remove(f)
 
-        # make the restart archive and delete the restart files
-        self.make_restart_archive(self.get_restart_file(i), resdir)
-        sh.rm('-r', resdir)
-
-        if save_run:
-            # copy the complete run directory to GFDL_DATA so that the run can
-            # be recreated without the python script if required
-            mkdir(resdir)
-            sh.cp(['-a', self.rundir, outdir])
-        else:
-            # just save some useful diagnostic information
-            self.write_namelist(outdir)
-            self.write_field_table(outdir)
-            self.write_diag_table(outdir)
-            self.codebase.write_source_control_status(P(outdir, 'git_hash_used.txt'))
+    def kill_run(self):
+        """Terminate the model if it is running."""
+        proc = self.current_process
+        if proc is not None and proc.process.is_alive()[0]:
+            proc.process.terminate()
 
-        self.clear_rundir()
-        self.emit('run:finished', self, i)
+    def reduce_timestep(self, i, reason):
+        """Reduce `dt_atmos` after run `i` blew up.  Returns False if the
+        run should not be retried."""
+        dt = self.namelist.get('main_nml', {}).get('dt_atmos')
+        new_dt = self.watchdog.next_timestep(i, dt)
+        self.watchdog.record(self, i, reason, dt, new_dt)
+        self.emit('run:blowup', self, i, reason, new_dt)
+        if new_dt is None:
+            self.log.error('Run %d blew up (%s), not retrying' % (i, reason))
+            return False
+        self.log.warning('Run %d blew up (%s), retrying with dt_atmos=%d (was %d)' % (i, reason, new_dt, dt))
+        self.update_namelist({'main_nml': {'dt_atmos': new_dt}})
         return True
 
+    def enable_equilibrium_monitor(self, fields=('t_surf', ), filename='atmos_monthly.nc', window=36, period=12, tolerance=0.1, **kwargs):
+        """Test the global means of `fields` in the output for drift after
+        each run, to find when the experiment has spun up.  Further keyword
+        arguments are passed to `EquilibriumMonitor`.  See `isca.equilibrium`."""
+        self.equilibrium = EquilibriumMonitor(P(self.datadir, 'equilibrium.json'), fields, filename,
+                                              window, period, tolerance, **kwargs)
+
+    def update_equilibrium(self, i):
+        was_spun_up = self.equilibrium.equilibrated
+        self.equilibrium.add_output(i, self.get_outputdir(i))
+        self.log.debug('Equilibrium after run %d:\n%s' % (i, self.equilibrium.summary()))
+        if self.equilibrium.equilibrated and not was_spun_up:
+            self.log.info('%s is spun up after run %d:\n%s' % (self.name, i, self.equilibrium.summary()))
+            self.emit('run:spun_up', self, i)
+
+    @property
+    def spun_up(self):
+        return self.equilibrium is not None and self.equilibrium.equilibrated
+
+    def run_until_spun_up(self, start, end, **kwargs):
+        """Run `start` to `end`, stopping early once the equilibrium
+        monitor finds the experiment has spun up.  Keyword arguments are
+        passed to `run()`.  Returns the number of the last run."""
+        if self.equilibrium is None:
+            raise ValueError('Use enable_equilibrium_monitor() before run_until_spun_up()')
+        for i in range(start, end + 1):
+            if self.spun_up:
+                return i - 1
+            self.run(i, **kwargs)
+            kwargs.pop('restart_file', None)
+            kwargs.pop('use_restart', None)
+        self.log.warning('%s has not spun up after run %d' % (self.name, end))
+        return end
+
+    def enable_manifests(self, chunk_size=1):
+        """Write a manifest of hashes and statistics of each variable, for
+        every `chunk_size` time steps, of the output and restart files of
+        each run to `runNNNN/manifest.json`.  See `isca.manifest`."""
+        self.manifest = ManifestWriter(chunk_size)
+
+    def enable_catalog(self, path=None):
+        """Record each completed run, its output files, commit and phase
+        timings in a SQLite catalog, by default `$GFDL_WORK/catalog.sqlite`.
+        See `isca.catalog`."""
+        self.catalog = Catalog(path) if path is not None else Catalog()
+
+    def enable_memoization(self, storedir=None):
+        """Record the specification of each completed run (model build,
+        namelist, diag table, input files and restart) and satisfy a run with
+        the same specification by linking the earlier output and restart into
+        place instead of running the model.  Only `run` is memoized, not
+        `run_chain`.  See `isca.memo`."""
+        self.memo = RunMemo(storedir) if storedir is not None else RunMemo()
+
+    def enable_preflight(self, strict=False):
+        """Check the namelist, input files, grid and diag table against the
+        source tree before each run, raising PreflightError instead of
+        starting a run that would fail or silently ignore settings.
+        `run_chain` also warns if the output of its runs will not fit on the
+        disk.  With `strict`, warnings are raised too.  See `isca.preflight`."""
+        self.preflight = Preflight(strict)
+
+    def plan_output(self, runs=1):
+        """Estimate the disk space `runs` runs will need, per output file
+        and for restarts, against the space free for the data directory.
+        Returns an `isca.iobudget.OutputBudget`; see its `summary` and
+        `suggestions`."""
+        index = namelist_index(self.codebase) if os.path.isdir(self.codebase.srcdir) else None
+        budget = OutputBudget(self, runs, index)
+        if not budget.fits():
+            self.log.warning('%d runs of %s will not fit in the free disk space, only %d will'
+                             % (runs, self.name, budget.runs_that_fit()))
+        return budget
+
+    def wait_for_postprocessing(self):
+        """Block until all background post-processing is complete.
+        Raises PostProcessingError if any of it failed."""
+        if self.postprocessor is not None:
+            self.postprocessor.wait()
+
+    def open_output(self, filename='atmos_monthly.nc', runs=None, variables=None, decode_times=False):
+        """Open the diagnostic output `filename` of `runs` (default: all runs)
+        as a lazily loaded xarray Dataset.  See `isca.runindex`."""
+        return RunIndex(self.datadir, filename).open(runs=runs, variables=variables, decode_times=decode_times)
+
     def make_restart_archive(self, archive_file, restart_directory):
-        with tarfile.open(archive_file, 'w:gz') as tar:
-            tar.add(restart_directory, arcname='.')
+        self.restart_storage.save(archive_file, restart_directory)
         self.log.info("Restart archive created at %s" % archive_file)
 
     def extract_restart_archive(self, archive_file, input_directory):
-        with tarfile.open(archive_file, 'r:gz') as tar:
-            tar.extractall(path=input_directory)
+        # the model only reads its INPUT files, so they can share the stored restart
+        names = extract_restart(archive_file, input_directory, link=True)
         self.log.info("Restart %s extracted to %s" % (archive_file, input_directory))
+        return names
 
     def derive(self, new_experiment_name):
         """Derive a new experiment based on this one."""
@@ -369,6 +933,31 @@ class Experiment(Logger, EventEmitter):
         new_exp.namelist = self.namelist.copy()
         new_exp.diag_table = self.diag_table.copy()
         new_exp.inputfiles = self.inputfiles[:]
+        new_exp.combine_tool = self.combine_tool
+        new_exp.combine_processes = self.combine_processes
+        new_exp.restart_storage = self.restart_storage
+        new_exp.input_cache = self.input_cache
+        new_exp.num_cores = self.num_cores
+        if self.scratch is not None:
+            new_exp.enable_local_scratch(self.scratch.scratchdir, self.scratch.min_free_gb, async_drain=False)
+        if self.telemetry is not None:
+            new_exp.telemetry = Telemetry(window=self.telemetry.window)
+        if self.watchdog is not None:
+            w = self.watchdog
+            new_exp.watchdog = Watchdog(None, limits=w.limits, retries=w.retries, dt_factor=w.dt_factor, min_dt=w.min_dt)
+        if self.manifest is not None:
+            new_exp.enable_manifests(self.manifest.chunk_size)
+        if self.catalog is not None:
+            new_exp.catalog = self.catalog
+        if self.memo is not None:
+            new_exp.memo = self.memo
+        if self.preflight is not None:
+            new_exp.enable_preflight(self.preflight.strict)
+        if self.equilibrium is not None:
+            m = self.equilibrium
+            new_exp.enable_equilibrium_monitor(m.fields, m.filename, m.window, m.period, m.tolerance,
+                                               relative_tolerance=m.relative_tolerance, test=m.test, alpha=m.alpha,
+                                               vertical=m.vertical, pressure_range=m.pressure_range)
 
         return new_exp
 
@@ -0,0 +1,129 @@
+"""A content addressed cache of model input files.
+
+Input files such as SSTs, ozone and land masks are usually identical from
+one run to the next and between members of an ensemble.  Rather than
+copying them into `run/INPUT` at the start of every run, the cache stores
+one copy of each distinct file under `GFDL_WORK/input_cache`, named by the
+SHA-256 hash of its contents, and links that copy into the run directory.
+
+Files are only hashed when they are first seen or when their size or
+modification time changes, so the cost of setting up a run is proportional
+to the number of input files that have changed rather than the total size
+of all the input files.
+
+    exp.enable_input_cache()
+    exp.run(1)
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+from isca import GFDL_WORK
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+
+def sha256_file(filename, blocksize=1 << 20):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class InputFileCache(Logger):
+    """Content addressed store of input files.
+
+    `link` is how files are placed in the run directory: 'hardlink'
+    (falls back to a symlink across filesystems) or 'symlink'.
+    Cached objects are made read-only so that a model writing to a linked
+    input file cannot change the cached copy."""
+
+    def __init__(self, cachedir=P(GFDL_WORK, 'input_cache'), link='hardlink'):
+        if link not in ('hardlink', 'symlink'):
+            raise ValueError('link must be "hardlink" or "symlink", not %r' % link)
+        self.cachedir = cachedir
+        self.objectdir = P(cachedir, 'objects')
+        self.indexfile = P(cachedir, 'index.json')
+        self.link = link
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def index(self):
+        """Map of absolute file path -> {'size', 'mtime', 'hash'}."""
+        if self._index is None:
+            if os.path.isfile(self.indexfile):
+                with open(self.indexfile) as f:
+                    self._index = json.load(f)
+            else:
+                self._index = {}
+        return self._index
+
+    def save_index(self):
+        mkdir(self.cachedir)
+        fd, tmpfile = tempfile.mkstemp(dir=self.cachedir, prefix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmpfile, self.indexfile)
+
+    def file_hash(self, filename):
+        """Return the content hash of `filename`, only reading the file
+        if its size or modification time has changed since it was last hashed."""
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        with self._lock:
+            entry = self.index.get(filename)
+            if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+                return entry['hash']
+        self.log.debug('Hashing input file %s' % filename)
+        digest = sha256_file(filename)
+        with self._lock:
+            self.index[filename] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'hash': digest}
+            self.save_index()
+        return digest
+
+    def object_path(self, digest):
+        return P(self.objectdir, digest[:2], digest)
+
+    def store(self, filename):
+        """Add `filename` to the cache if needed.  Returns the cached path."""
+        obj = self.object_path(self.file_hash(filename))
+        if not os.path.exists(obj):
+            mkdir(os.path.dirname(obj))
+            fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(obj), prefix='.tmp')
+            os.close(fd)
+            shutil.copyfile(filename, tmpfile)
+            os.chmod(tmpfile, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmpfile, obj)
+            self.log.info('Added %s to the input cache' % filename)
+        return obj
+
+    def link_into(self, filename, directory):
+        """Place `filename` in `directory` by linking to its cached copy."""
+        obj = self.store(filename)
+        dest = P(directory, os.path.basename(filename))
+        if os.path.lexists(dest):
+            os.remove(dest)
+        if self.link == 'hardlink':
+            try:
+                os.link(obj, dest)
+                return dest
+            except OSError:
+                pass  # e.g. different filesystems
+        os.symlink(obj, dest)
+        return dest
+
+    def clear(self):
+        """Remove every cached file and the index."""
+        if os.path.isdir(self.cachedir):
+            for root, dirs, files in os.walk(self.objectdir):
+                for f in files:
+                    os.chmod(P(root, f), stat.S_IWUSR | stat.S_IRUSR)
+            shutil.rmtree(self.cachedir)
+        self._index = None
+        self.log.info('Cleared input cache %s' % self.cachedir)
@@ -0,0 +1,174 @@
+"""Plan the disk space the output of an experiment will need.
+
+The size of each diagnostic output file is estimated from the resolution,
+the number of levels, the axes of each field (from the namelist index of
+the source tree, see `isca.nmlindex`), the output frequency and the
+precision written by the diag table.  Together with the restart archives
+this gives the volume of a run, which is projected over the whole
+experiment and compared with the space free under `GFDL_DATA`.
+
+    budget = exp.plan_output(runs=120)
+    print(budget.summary())
+    budget.fits()             # False if the output will not fit
+    budget.suggestions()      # [(bytes saved per run, suggestion), ...]
+
+Restart archives are measured when the experiment already has some, and
+otherwise estimated as eight double precision 3-D fields (two time levels
+of wind, temperature and humidity).  Files are not compressed, so the
+estimate of the output should be close; the restart estimate is rougher.
+"""
+import os
+import shutil
+
+from isca.loghandler import Logger
+from isca.diagtable import UNIT_SECONDS
+from isca.autotune import DEFAULT_RESOLUTION
+
+# the namelist groups giving the grid of each model, with the names of the
+# longitude and latitude sizes and whether the model has levels
+GRID_NAMELISTS = (
+    ('spectral_dynamics_nml', 'lon_max', 'lat_max', True),
+    ('column_nml', 'lon_max', 'lat_max', True),
+    ('shallow_dynamics_nml', 'num_lon', 'num_lat', False),
+    ('barotropic_dynamics_nml', 'num_lon', 'num_lat', False),
+)
+
+RESTART_FIELDS = 8
+
+
+def format_bytes(n):
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if abs(n) < 1000 or unit == 'TB':
+            return '%.1f %s' % (n, unit) if unit != 'B' else '%d B' % n
+        n /= 1000.
+
+
+def run_seconds(namelist):
+    """The length of a run set in main_nml, with 30 day months."""
+    main = namelist.get('main_nml', {})
+    return (main.get('seconds', 0) + main.get('minutes', 0) * 60 + main.get('hours', 0) * 3600
+            + main.get('days', 0) * 86400 + main.get('months', 0) * UNIT_SECONDS['months']
+            + main.get('years', 0) * UNIT_SECONDS['years'])
+
+
+def model_grid(exp, index=None):
+    """The size of each axis of the model grid, {'lon', 'lat', 'pfull', 'phalf'}."""
+    for group, lon, lat, has_levels in GRID_NAMELISTS:
+        if group in exp.namelist:
+            break
+    else:
+        group, lon, lat, has_levels = GRID_NAMELISTS[0]
+    values = {lon: DEFAULT_RESOLUTION['lon_max'], lat: DEFAULT_RESOLUTION['lat_max'],
+              'num_levels': DEFAULT_RESOLUTION['num_levels'] if has_levels else 1}
+    if index is not None:
+        for key, info in index.groups.get(group, {}).items():
+            if key in values and isinstance(info['default'], int):
+                values[key] = info['default']
+    values.update({k: v for k, v in exp.namelist.get(group, {}).items() if k in values})
+    levels = values['num_levels']
+    return {'lon': values[lon], 'lat': values[lat], 'pfull': levels, 'phalf': levels + 1}
+
+
+def free_space(path):
+    """Bytes free on the filesystem `path` is, or will be, on."""
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+class OutputBudget(Logger):
+    """The projected output volume of `runs` runs of `exp`, against the
+    space free for its data directory."""
+
+    def __init__(self, exp, runs=1, index=None, restart_bytes=None):
+        self.exp = exp
+        self.runs = runs
+        self.grid = model_grid(exp, index)
+        self.run_seconds = run_seconds(exp.namelist)
+        dt = exp.namelist.get('main_nml', {}).get('dt_atmos')
+        self.field_info = {}
+        if index is not None:
+            self.field_info = {(module, name): info for module, fields in index.diag_fields.items()
+                               for name, info in fields.items()}
+        self.files = exp.diag_table.estimate_sizes(self.grid, self.run_seconds, dt, self.field_info)
+        self.output_bytes = sum(f['bytes'] for f in self.files.values())
+        if restart_bytes is None:
+            restart_bytes = self.measured_restart_bytes()
+        self.restart_estimated = restart_bytes is None
+        if self.restart_estimated:
+            restart_bytes = RESTART_FIELDS * 8 * self.grid['lon'] * self.grid['lat'] * self.grid['pfull']
+        self.restart_bytes = restart_bytes
+        self.free = free_space(exp.datadir)
+
+    def measured_restart_bytes(self):
+        """The size of the most recent restart archive of the experiment, or None."""
+        if not os.path.isdir(self.exp.restartdir):
+            return None
+        archives = sorted(os.listdir(self.exp.restartdir))
+        if not archives:
+            return None
+        path = os.path.join(self.exp.restartdir, archives[-1])
+        if os.path.isdir(path):
+            return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        return os.path.getsize(path)
+
+    @property
+    def bytes_per_run(self):
+        return self.output_bytes + self.restart_bytes
+
+    @property
+    def total(self):
+        return self.runs * self.bytes_per_run
+
+    def fits(self, margin=0.1):
+        """True if the projected volume, plus `margin` of it, fits in the free space."""
+        return self.total * (1 + margin) <= self.free
+
+    def runs_that_fit(self, margin=0.1):
+        return int(self.free // (self.bytes_per_run * (1 + margin))) if self.bytes_per_run else self.runs
+
+    def suggestions(self):
+        """Cheaper configurations, as [(bytes saved per run, description)]
+        with the largest saving first."""
+        suggestions = []
+        month = UNIT_SECONDS['months']
+        monthly_records = max(int(self.run_seconds // month), 1)
+        for name, f in self.files.items():
+            table = self.exp.diag_table.files[name]
+            if f['records'] > 1:
+                suggestions.append((f['bytes'] // 2, 'halve the output frequency of %s (every %s %s)'
+                                    % (name, table['freq'], table['units'])))
+            if f['records'] > monthly_records:
+                fields = sorted(set(field['name'] for field in table['fields'] if self._is_3d(field)))
+                saved = sum(f['fields'][field] for field in fields) * (1 - monthly_records / float(f['records']))
+                if fields and saved > 0:
+                    suggestions.append((int(saved), 'write the 3-D fields of %s (%s) to a monthly file instead'
+                                        % (name, ', '.join(fields))))
+        if self.runs > 12:
+            suggestions.append((self.restart_bytes * 11 // 12,
+                                'keep only every 12th restart archive once runs have finished'))
+        return sorted(suggestions, reverse=True)
+
+    def _is_3d(self, field):
+        info = self.field_info.get((field['module'], field['name']), {})
+        axes = info.get('axes')
+        return not info.get('static') and (axes is None or 'pfull' in axes or 'phalf' in axes)
+
+    def summary(self, suggestions=3):
+        lines = ['%s: %d runs of %g days on a %dx%dx%d grid' % (
+            self.exp.name, self.runs, self.run_seconds / 86400., self.grid['lon'], self.grid['lat'], self.grid['pfull'])]
+        for name, f in sorted(self.files.items(), key=lambda x: -x[1]['bytes']):
+            table = self.exp.diag_table.files[name]
+            line = '  %-24s every %s %-7s %4d records  %10s per run' % (
+                name, table['freq'], table['units'], f['records'], format_bytes(f['bytes']))
+            if f['assumed']:
+                line += '  (assumed 3-D: %s)' % ', '.join(f['assumed'])
+            lines.append(line)
+        lines.append('  %-24s %42s per run%s' % ('restarts', format_bytes(self.restart_bytes),
+                                                 ' (estimate)' if self.restart_estimated else ''))
+        lines.append('total %s per run, %s for %d runs, %s free: %s' % (
+            format_bytes(self.bytes_per_run), format_bytes(self.total), self.runs, format_bytes(self.free),
+            'fits' if self.fits() else 'only %d runs fit' % self.runs_that_fit()))
+        for saved, suggestion in self.suggestions()[:suggestions]:
+            lines.append('  %s: saves %s per run' % (suggestion, format_bytes(saved)))
+        return '\n'.join(lines)
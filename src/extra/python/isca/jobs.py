@@ -0,0 +1,552 @@
+"""Submit experiment runs to a batch scheduler.
+
+A job runs a range of runs of an experiment defined at module level in a
+python script (such as the test cases in `exp/test_cases`).  A long
+integration is split into a chain of jobs, each depending on the success
+of the one before; an ensemble of experiments is submitted as a job array.
+
+    from isca.jobs import JobManager, SlurmBackend
+    backend = SlurmBackend(partition='compute', time='12:00:00', cores_per_node=16,
+                           setup=['source activate isca_env'])
+    jobs = JobManager(backend, name='hs_sweep')
+    jobs.submit_chain('held_suarez_test_case.py', 1, 120, runs_per_job=12, num_cores=16)
+    jobs.submit_ensemble([('sweep.py', 'exp_%d' % k) for k in range(8)], 1, 24, num_cores=16)
+
+    jobs.update()              # poll the scheduler
+    jobs.resubmit_failed()     # resubmit failed jobs and anything waiting on them
+
+Backends are provided for SLURM (`SlurmBackend`) and PBS (`PBSBackend`),
+and `LocalBackend` runs the same job scripts as local subprocesses, for
+testing or for a single workstation.
+
+With `preflight=True` each experiment is loaded and checked (see
+`isca.preflight`) before anything is queued.
+
+Runs that are already complete are skipped when a job starts, so
+resubmitted jobs carry on from where they stopped.  The state of all jobs
+is kept in `$GFDL_WORK/jobs/<name>/jobs.json`.  Local jobs submitted by an
+earlier python process are no longer tracked, so `update` marks them
+completed or failed by whether their runs are complete.
+"""
+import inspect
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+from jinja2 import Environment, FileSystemLoader
+
+from isca import GFDL_WORK, EventEmitter, _module_directory
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+UNKNOWN = 'unknown'
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobSubmissionError(Exception):
+    pass
+
+
+class JobBackend(Logger):
+    """Base class for batch schedulers.
+
+    setup: shell lines run at the start of each job, e.g. to activate the
+        python environment.
+    python: the python interpreter the job uses.
+    """
+    name = None
+    array_variable = None
+    # whether the scheduler still knows about jobs once the python process
+    # that submitted them has exited
+    persistent = True
+
+    def __init__(self, setup=None, python=sys.executable):
+        self.setup = list(setup or [])
+        self.python = python
+
+    def directives(self, job, array_size=None, dependency=None):
+        return []
+
+    def write_script(self, job, array_size=None, dependency=None):
+        templates = Environment(loader=FileSystemLoader(P(_module_directory, 'templates')))
+        task_index = '${%s}' % self.array_variable if array_size else ''
+        templates.get_template('job.sh').stream(
+            name=job['name'], directives=self.directives(job, array_size, dependency),
+            setup=self.setup, jobdir=job['jobdir'], python=self.python,
+            specfile=job['specfile'], task_index=task_index).dump(job['script'])
+        return job['script']
+
+    def submit(self, job, array_size=None, dependency=None):
+        """Submit `job`, optionally as an array of `array_size` tasks and
+        starting only after job id `dependency` completes successfully.
+        Returns the job id."""
+        raise NotImplementedError
+
+    def status(self, job_id):
+        """One of PENDING, RUNNING, COMPLETED, FAILED, CANCELLED or UNKNOWN."""
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        raise NotImplementedError
+
+    def _call(self, cmd):
+        try:
+            return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode().strip()
+        except (OSError, subprocess.CalledProcessError) as e:
+            output = getattr(e, 'output', b'') or b''
+            raise JobSubmissionError('%s failed: %s %s' % (' '.join(cmd), e, output.decode().strip()))
+
+
+class SlurmBackend(JobBackend):
+    name = 'slurm'
+    array_variable = 'SLURM_ARRAY_TASK_ID'
+
+    STATES = {'PENDING': PENDING, 'CONFIGURING': PENDING, 'REQUEUED': PENDING,
+              'RUNNING': RUNNING, 'COMPLETING': RUNNING, 'COMPLETED': COMPLETED,
+              'CANCELLED': CANCELLED, 'FAILED': FAILED, 'TIMEOUT': FAILED, 'NODE_FAIL': FAILED,
+              'OUT_OF_MEMORY': FAILED, 'PREEMPTED': FAILED, 'BOOT_FAIL': FAILED, 'DEADLINE': FAILED}
+
+    def __init__(self, partition=None, account=None, time='03:00:00', cores_per_node=None,
+                 extra_directives=None, **kwargs):
+        super(SlurmBackend, self).__init__(**kwargs)
+        self.partition = partition
+        self.account = account
+        self.time = time
+        self.cores_per_node = cores_per_node
+        self.extra_directives = list(extra_directives or [])
+
+    def directives(self, job, array_size=None, dependency=None):
+        n = job['num_cores']
+        d = ['--job-name=%s' % job['name'], '--time=%s' % self.time, '--ntasks=%d' % n,
+             '--export=ALL', '--output=%s' % P(job['jobdir'], 'slurm_%A_%a.out' if array_size else 'slurm_%j.out')]
+        if self.cores_per_node:
+            d.append('--nodes=%d' % -(-n // self.cores_per_node))
+        if self.partition:
+            d.append('--partition=%s' % self.partition)
+        if self.account:
+            d.append('--account=%s' % self.account)
+        if array_size:
+            d.append('--array=%s' % array_size)
+        if dependency:
+            d.append('--dependency=afterok:%s' % dependency)
+        return ['#SBATCH %s' % x for x in d + self.extra_directives]
+
+    def submit(self, job, array_size=None, dependency=None):
+        script = self.write_script(job, array_size, dependency)
+        return self._call(['sbatch', '--parsable', script]).split(';')[0]
+
+    def status(self, job_id):
+        out = self._call(['sacct', '-n', '-X', '-P', '-o', 'State', '-j', str(job_id)])
+        states = [self.STATES.get(line.split()[0].rstrip('+'), UNKNOWN) for line in out.splitlines() if line.strip()]
+        return _combine_states(states)
+
+    def cancel(self, job_id):
+        self._call(['scancel', str(job_id)])
+
+
+class PBSBackend(JobBackend):
+    name = 'pbs'
+    array_variable = 'PBS_ARRAY_INDEX'
+
+    def __init__(self, queue=None, account=None, walltime='03:00:00', cores_per_node=None,
+                 extra_directives=None, **kwargs):
+        super(PBSBackend, self).__init__(**kwargs)
+        self.queue = queue
+        self.account = account
+        self.walltime = walltime
+        self.cores_per_node = cores_per_node
+        self.extra_directives = list(extra_directives or [])
+
+    def directives(self, job, array_size=None, dependency=None):
+        n = job['num_cores']
+        per_node = self.cores_per_node or n
+        nodes = -(-n // per_node)
+        d = ['-N %s' % job['name'][:15], '-l walltime=%s' % self.walltime,
+             '-l select=%d:ncpus=%d:mpiprocs=%d' % (nodes, min(n, per_node), min(n, per_node)),
+             '-V', '-j oe', '-o %s' % job['jobdir']]
+        if self.queue:
+            d.append('-q %s' % self.queue)
+        if self.account:
+            d.append('-A %s' % self.account)
+        if array_size:
+            d.append('-J %s' % array_size)
+        if dependency:
+            d.append('-W depend=afterok:%s' % dependency)
+        return ['#PBS %s' % x for x in d + self.extra_directives]
+
+    def submit(self, job, array_size=None, dependency=None):
+        script = self.write_script(job, array_size, dependency)
+        return self._call(['qsub', script])
+
+    def status(self, job_id):
+        try:
+            out = self._call(['qstat', '-x', '-f', '-t', str(job_id)])
+        except JobSubmissionError:
+            return UNKNOWN
+        states = []
+        for block in out.split('\n\n'):
+            state = re.search(r'job_state = (\w)', block)
+            exit_status = re.search(r'Exit_status = (-?\d+)', block)
+            if state is None or ('array = True' in block):
+                continue
+            s = state.group(1)
+            if s in 'QHWT':
+                states.append(PENDING)
+            elif s in 'RE':
+                states.append(RUNNING)
+            elif s in 'FX':
+                states.append(COMPLETED if exit_status and exit_status.group(1) == '0' else FAILED)
+            else:
+                states.append(UNKNOWN)
+        return _combine_states(states)
+
+    def cancel(self, job_id):
+        self._call(['qdel', str(job_id)])
+
+
+class LocalBackend(JobBackend):
+    """Runs job scripts as local subprocesses, `max_parallel` at a time.
+    Dependencies and arrays behave as on a batch scheduler.  The state of
+    the jobs is only known to the python process that submitted them."""
+    name = 'local'
+    array_variable = 'ISCA_ARRAY_INDEX'
+    persistent = False
+
+    def __init__(self, max_parallel=1, **kwargs):
+        super(LocalBackend, self).__init__(**kwargs)
+        self._slots = threading.Semaphore(max_parallel)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._next_id = 0
+
+    def submit(self, job, array_size=None, dependency=None):
+        script = self.write_script(job, array_size, dependency)
+        tasks = _array_indices(array_size) if array_size else [None]
+        with self._lock:
+            self._next_id += 1
+            # unique across python processes, as ids are kept in jobs.json
+            job_id = 'local%d.%d' % (os.getpid(), self._next_id)
+            self._jobs[job_id] = {'tasks': {t: PENDING for t in tasks}, 'procs': {}, 'cancelled': False}
+        thread = threading.Thread(target=self._run, args=(job_id, script, job['jobdir'], tasks, dependency))
+        thread.daemon = True
+        thread.start()
+        return job_id
+
+    def _set(self, job_id, task, state):
+        with self._lock:
+            self._jobs[job_id]['tasks'][task] = state
+
+    def _run(self, job_id, script, jobdir, tasks, dependency):
+        if dependency is not None:
+            self.wait(dependency)
+            if self.status(dependency) != COMPLETED:
+                for t in tasks:
+                    self._set(job_id, t, CANCELLED)
+                return
+        threads = []
+        for task in tasks:
+            t = threading.Thread(target=self._run_task, args=(job_id, script, jobdir, task))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+    def _run_task(self, job_id, script, jobdir, task):
+        with self._slots:
+            if self._jobs[job_id]['cancelled']:
+                self._set(job_id, task, CANCELLED)
+                return
+            env = dict(os.environ)
+            if task is not None:
+                env[self.array_variable] = str(task)
+            suffix = '' if task is None else '_%s' % task
+            with open(P(jobdir, '%s%s.out' % (job_id, suffix)), 'w') as out:
+                proc = subprocess.Popen(['bash', script], stdout=out, stderr=subprocess.STDOUT, env=env)
+                with self._lock:
+                    self._jobs[job_id]['procs'][task] = proc
+                self._set(job_id, task, RUNNING)
+                code = proc.wait()
+        if self._jobs[job_id]['cancelled']:
+            self._set(job_id, task, CANCELLED)
+        else:
+            self._set(job_id, task, COMPLETED if code == 0 else FAILED)
+
+    def status(self, job_id):
+        with self._lock:
+            if job_id not in self._jobs:
+                return UNKNOWN
+            return _combine_states(list(self._jobs[job_id]['tasks'].values()))
+
+    def wait(self, job_id, interval=0.2):
+        """Block until `job_id` has finished."""
+        import time
+        while self.status(job_id) not in FINISHED + (UNKNOWN, ):
+            time.sleep(interval)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['cancelled'] = True
+            procs = list(job['procs'].values())
+            for task, state in job['tasks'].items():
+                if state == PENDING:
+                    job['tasks'][task] = CANCELLED
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+
+
+def _array_indices(array_size):
+    """Indices of an array specification such as '0-7' or '3,5'."""
+    indices = []
+    for part in str(array_size).split(','):
+        if '-' in part:
+            a, b = part.split('-')
+            indices.extend(range(int(a), int(b) + 1))
+        else:
+            indices.append(int(part))
+    return indices
+
+
+def _combine_states(states):
+    """The state of a job from the states of its tasks."""
+    if not states:
+        return UNKNOWN
+    for state in (RUNNING, PENDING, FAILED, CANCELLED, UNKNOWN):
+        if state in states:
+            return state
+    return COMPLETED
+
+
+class JobManager(Logger, EventEmitter):
+    """Submit, track and resubmit the jobs of a campaign called `name`.
+
+    Events emitted:
+        'job:submitted' (manager, job)
+        'job:state' (manager, job) when the state of a job changes
+    """
+
+    def __init__(self, backend, name='default', statedir=P(GFDL_WORK, 'jobs')):
+        super(JobManager, self).__init__()
+        self.backend = backend
+        self.name = name
+        self.jobdir = P(statedir, name)
+        self.statefile = P(self.jobdir, 'jobs.json')
+        self.jobs = []
+        self.load_state()
+
+    def load_state(self):
+        if os.path.isfile(self.statefile):
+            with open(self.statefile) as f:
+                self.jobs = json.load(f)
+
+    def save_state(self):
+        mkdir(self.jobdir)
+        tmpfile = self.statefile + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmpfile, self.statefile)
+
+    def _new_job(self, name, tasks, num_cores, array=False, depends_on=None, chain=None):
+        n = len(self.jobs)
+        job = {'index': n, 'name': '%s_%d_%s' % (self.name, n, name), 'tasks': tasks, 'num_cores': num_cores,
+               'array': array, 'depends_on': depends_on, 'chain': chain, 'attempts': 0,
+               'job_id': None, 'state': None, 'jobdir': self.jobdir,
+               'specfile': P(self.jobdir, 'job_%d.json' % n), 'script': P(self.jobdir, 'job_%d.sh' % n)}
+        mkdir(self.jobdir)
+        with open(job['specfile'], 'w') as f:
+            json.dump(tasks, f, indent=2)
+        self.jobs.append(job)
+        return job
+
+    def _submit(self, job):
+        dependency = None
+        if job['depends_on'] is not None:
+            parent = self.jobs[job['depends_on']]
+            if parent['state'] != COMPLETED:
+                dependency = parent['job_id']
+        array_size = '0-%d' % (len(job['tasks']) - 1) if job['array'] else None
+        job['job_id'] = self.backend.submit(job, array_size=array_size, dependency=dependency)
+        job['state'] = PENDING
+        job['attempts'] += 1
+        self.save_state()
+        self.log.info('Submitted %s as %s job %s' % (job['name'], self.backend.name, job['job_id']))
+        self.emit('job:submitted', self, job)
+        return job
+
+    def check_experiment(self, script, variable, num_cores, strict=False):
+        """Load the experiment `variable` in `script` and check it before
+        it is queued, raising PreflightError.  See `isca.preflight`."""
+        from isca.benchmark import load_test_case
+        from isca.preflight import Preflight
+        exp = load_test_case(script, variable)
+        return Preflight(strict).check(exp, num_cores)
+
+    def submit_chain(self, script, start, end, runs_per_job=12, num_cores=8, variable='exp',
+                     use_restart=True, restart_file=None, method='run', preflight=False, **run_kwargs):
+        """Submit runs `start` to `end` of the experiment `variable` in
+        `script` as a chain of jobs of `runs_per_job` runs each.
+        `method` is 'run' or 'run_chain', and is passed the other keyword
+        arguments.  With `preflight` the experiment is checked first.
+        Returns the list of jobs."""
+        check_run_kwargs(method, run_kwargs)
+        script = os.path.abspath(script)
+        if preflight:
+            self.check_experiment(script, variable, num_cores)
+        chain = '%s:%s' % (script, variable)
+        jobs = []
+        for first in range(start, end + 1, runs_per_job):
+            last = min(first + runs_per_job - 1, end)
+            task = {'script': script, 'variable': variable, 'start': first, 'end': last,
+                    'num_cores': num_cores, 'method': method, 'run_kwargs': run_kwargs,
+                    'use_restart': use_restart if first == start else True,
+                    'restart_file': restart_file if first == start else None}
+            depends_on = jobs[-1]['index'] if jobs else None
+            jobs.append(self._new_job('%s_%d-%d' % (variable, first, last), [task], num_cores,
+                                      depends_on=depends_on, chain=chain))
+        for job in jobs:
+            self._submit(job)
+        return jobs
+
+    def submit_ensemble(self, members, start, end, num_cores=8, use_restart=True, method='run', preflight=False,
+                        **run_kwargs):
+        """Submit runs `start` to `end` of each member as one job array.
+        `members` is a list of (script, variable) pairs.  With `preflight`
+        each member is checked first."""
+        check_run_kwargs(method, run_kwargs)
+        if preflight:
+            for script, variable in members:
+                self.check_experiment(script, variable, num_cores)
+        tasks = [{'script': os.path.abspath(script), 'variable': variable, 'start': start, 'end': end,
+                  'num_cores': num_cores, 'method': method, 'run_kwargs': run_kwargs,
+                  'use_restart': use_restart, 'restart_file': None} for script, variable in members]
+        job = self._new_job('ensemble_%d-%d' % (start, end), tasks, num_cores, array=True)
+        return self._submit(job)
+
+    def update(self):
+        """Poll the state of every unfinished job.  Returns the list of jobs."""
+        for job in self.jobs:
+            if job['job_id'] is None or job['state'] in FINISHED:
+                continue
+            state = self.backend.status(job['job_id'])
+            if state == UNKNOWN and not self.backend.persistent:
+                # submitted by an earlier python process
+                state = self.state_from_runs(job)
+            if state != job['state']:
+                job['state'] = state
+                self.log.info('%s (%s) is %s' % (job['name'], job['job_id'], state))
+                self.emit('job:state', self, job)
+        self.save_state()
+        return self.jobs
+
+    def state_from_runs(self, job):
+        """COMPLETED if every run of `job` is complete, else FAILED."""
+        from isca.benchmark import load_test_case
+        for task in job['tasks']:
+            try:
+                exp = load_test_case(task['script'], task['variable'])
+            except Exception as e:
+                self.log.warning('Cannot load %s from %s: %r' % (task['variable'], task['script'], e))
+                return FAILED
+            if first_incomplete_run(exp, task['start'], task['end']) is not None:
+                return FAILED
+        return COMPLETED
+
+    def _dependents(self, job):
+        return [j for j in self.jobs if j['depends_on'] == job['index']]
+
+    def resubmit_failed(self, max_attempts=3):
+        """Resubmit failed jobs, and the jobs of the same chain that were
+        waiting on them.  Returns the resubmitted jobs."""
+        self.update()
+        resubmitted = []
+        for job in self.jobs:
+            if job['state'] not in (FAILED, CANCELLED) or job in resubmitted:
+                continue
+            if job['depends_on'] is not None and self.jobs[job['depends_on']]['state'] != COMPLETED:
+                continue  # resubmitted along with the job it depends on
+            if job['attempts'] >= max_attempts:
+                self.log.warning('%s has failed %d times, not resubmitting' % (job['name'], job['attempts']))
+                continue
+            chain = [job]
+            while self._dependents(chain[-1]):
+                chain.extend(self._dependents(chain[-1]))
+            for j in chain[1:]:
+                if j['state'] not in FINISHED and j['job_id'] is not None:
+                    self.backend.cancel(j['job_id'])
+            for j in chain:
+                if j['state'] != COMPLETED:
+                    self._submit(j)
+                    resubmitted.append(j)
+        return resubmitted
+
+    def summary(self):
+        counts = {}
+        for job in self.jobs:
+            counts[job['state']] = counts.get(job['state'], 0) + 1
+        return counts
+
+
+def first_incomplete_run(exp, start, end):
+    """The first run in start..end that is not complete."""
+    for i in range(start, end + 1):
+        if not exp.run_is_complete(i):
+            return i
+    return None
+
+
+# the run arguments set by `run_task` rather than by the caller
+_TASK_ARGS = ('self', 'i', 'start', 'end', 'restart_file', 'use_restart', 'num_cores', 'overwrite_data')
+
+
+def check_run_kwargs(method, run_kwargs):
+    """Check `run_kwargs` are arguments of Experiment.`method` before the
+    jobs are queued, rather than when they start."""
+    from isca.experiment import Experiment
+    if method not in ('run', 'run_chain'):
+        raise ValueError("method must be 'run' or 'run_chain', not %r" % method)
+    params = inspect.signature(getattr(Experiment, method)).parameters
+    unknown = sorted(k for k in run_kwargs if k not in params or k in _TASK_ARGS)
+    if unknown:
+        raise TypeError('%s() cannot be given %s in a job' % (method, ', '.join(unknown)))
+
+
+def run_task(task):
+    """Run the runs of one job task.  This is what a submitted job executes."""
+    from isca.benchmark import load_test_case
+    exp = load_test_case(task['script'], task['variable'])
+    first = first_incomplete_run(exp, task['start'], task['end'])
+    if first is None:
+        exp.log.info('Runs %d-%d already complete' % (task['start'], task['end']))
+        return
+    kwargs = dict(task['run_kwargs'], num_cores=task['num_cores'])
+    use_restart = task['use_restart'] if first == task['start'] else True
+    restart_file = task['restart_file'] if first == task['start'] else None
+    # output of the interrupted run is incomplete
+    kwargs['overwrite_data'] = True
+    if task['method'] == 'run_chain':
+        exp.run_chain(first, task['end'], restart_file=restart_file, use_restart=use_restart, **kwargs)
+    else:
+        for i in range(first, task['end'] + 1):
+            exp.run(i, restart_file=restart_file, use_restart=use_restart, **kwargs)
+            restart_file, use_restart = None, True
+    exp.wait_for_postprocessing()
+
+
+if __name__ == '__main__':
+    # python -m isca.jobs specfile [task index]
+    with open(sys.argv[1]) as f:
+        tasks = json.load(f)
+    index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    run_task(tasks[index])
@@ -0,0 +1,221 @@
+"""Checksum manifests of model output for reproducibility checks.
+
+With manifests enabled, each diagnostic output file and restart file is
+summarised as it is produced: for every variable and every `chunk_size`
+steps along its first dimension (usually time) the manifest records a
+SHA-256 hash of the raw values and their minimum, maximum and mean.  The
+manifest of a run is written to `<datadir>/runNNNN/manifest.json`.
+
+    exp.enable_manifests()
+    exp.run(1)
+
+Comparing two runs then only needs the manifests:
+
+    from isca.manifest import compare_runs
+    result = compare_runs(exp_a.get_outputdir(1), exp_b.get_outputdir(1), rtol=1e-12)
+    print(result)
+
+`compare_manifests` reports 'identical' when every hash matches, 'close'
+when the hashes differ but the statistics of every chunk agree within the
+tolerances, and otherwise 'different' with the first diverging file,
+variable and step.  The statistics are a summary, so 'close' is weaker
+than a pointwise comparison of the data.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from isca.loghandler import Logger
+from isca.helpers import P
+
+MANIFEST_FILE = 'manifest.json'
+
+_manifest_lock = threading.Lock()
+
+
+def variable_chunks(var, chunk_size=1):
+    """Summaries of `var` for each `chunk_size` steps along its first dimension."""
+    var.set_auto_maskandscale(False)
+    if var.ndim == 0 or var.shape[0] == 0:
+        slices = [Ellipsis]
+    else:
+        slices = [slice(start, start + chunk_size) for start in range(0, var.shape[0], chunk_size)]
+    chunks = []
+    for s in slices:
+        data = np.ascontiguousarray(var[s])
+        chunk = {'sha256': hashlib.sha256(data.tobytes()).hexdigest()}
+        if data.dtype.kind in 'iuf' and data.size:
+            values = data.astype(float)
+            if not np.all(np.isnan(values)):
+                chunk.update(min=float(np.nanmin(values)), max=float(np.nanmax(values)),
+                             mean=float(np.nanmean(values)))
+        chunks.append(chunk)
+    return chunks
+
+
+def netcdf_manifest(filename, chunk_size=1):
+    """Manifest entry for a netcdf file."""
+    from netCDF4 import Dataset
+    variables = {}
+    with Dataset(filename) as ds:
+        for name, var in ds.variables.items():
+            variables[name] = {'dimensions': list(var.dimensions), 'shape': list(var.shape),
+                               'dtype': str(var.dtype), 'chunk_size': chunk_size,
+                               'chunks': variable_chunks(var, chunk_size)}
+    return {'variables': variables}
+
+
+def file_manifest(filename, chunk_size=1):
+    """Manifest entry for `filename`: per variable summaries of a netcdf
+    file, or a hash of the contents of any other file."""
+    if filename.endswith('.nc'):
+        try:
+            return netcdf_manifest(filename, chunk_size)
+        except OSError:
+            pass    # not a netcdf file after all
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return {'sha256': h.hexdigest()}
+
+
+class ManifestWriter(Logger):
+    """Adds the files produced by each run to the manifest of the run."""
+
+    def __init__(self, chunk_size=1):
+        self.chunk_size = chunk_size
+
+    def add_files(self, outdir, files):
+        """Summarise `files`, {name in manifest: path}, and add them to the
+        manifest in `outdir`."""
+        entries = {name: file_manifest(path, self.chunk_size) for name, path in files.items()}
+        with _manifest_lock:
+            manifest = read_manifest(outdir) if os.path.isfile(P(outdir, MANIFEST_FILE)) else {'files': {}}
+            manifest['files'].update(entries)
+            fd, tmpfile = tempfile.mkstemp(dir=outdir, prefix='.manifest')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmpfile, P(outdir, MANIFEST_FILE))
+        return entries
+
+    def add_directory(self, outdir, directory, prefix):
+        files = {P(prefix, name): P(directory, name) for name in sorted(os.listdir(directory))
+                 if os.path.isfile(P(directory, name))}
+        return self.add_files(outdir, files)
+
+
+def read_manifest(path):
+    """Read a manifest from a file or a run output directory."""
+    if os.path.isdir(path):
+        path = P(path, MANIFEST_FILE)
+    with open(path) as f:
+        return json.load(f)
+
+
+class ManifestComparison(object):
+    """The result of `compare_manifests`.
+
+    status: 'identical', 'close' or 'different'.
+    first_difference: (file, variable, step) where the manifests first
+        differ beyond the tolerances, or None.  variable and step are None
+        for differences in whole files.
+    differences: [(file, variable, step, reason)] for every difference.
+    """
+
+    def __init__(self, status, first_difference=None, differences=None):
+        self.status = status
+        self.first_difference = first_difference
+        self.differences = differences or []
+
+    def __bool__(self):
+        return self.status != 'different'
+
+    def __str__(self):
+        if self.status != 'different':
+            return self.status
+        file, variable, step = self.first_difference
+        reason = self.differences[0][3]
+        if variable is None:
+            return 'different: %s (%s)' % (file, reason)
+        return 'different: %s variable %s at step %s (%s)' % (file, variable, step, reason)
+
+    def __repr__(self):
+        return '<ManifestComparison %s>' % self
+
+
+def _stats_close(a, b, rtol, atol):
+    for key in ('min', 'max', 'mean'):
+        if (key in a) != (key in b):
+            return False
+        if key in a and not np.isclose(a[key], b[key], rtol=rtol, atol=atol):
+            return False
+    return True
+
+
+def compare_manifests(a, b, rtol=0., atol=0., stop_at_first_difference=True):
+    """Compare two manifests (dicts, manifest files or run output
+    directories).  Returns a `ManifestComparison`."""
+    if not isinstance(a, dict):
+        a = read_manifest(a)
+    if not isinstance(b, dict):
+        b = read_manifest(b)
+    differences = []
+    close = False
+
+    def different(file, variable, step, reason):
+        differences.append((file, variable, step, reason))
+        return stop_at_first_difference
+
+    for file in sorted(set(a['files']) | set(b['files'])):
+        if file not in a['files'] or file not in b['files']:
+            if different(file, None, None, 'only in %s manifest' % ('second' if file in b['files'] else 'first')):
+                break
+            continue
+        fa, fb = a['files'][file], b['files'][file]
+        if 'variables' not in fa or 'variables' not in fb:
+            if fa.get('sha256') != fb.get('sha256'):
+                if different(file, None, None, 'contents differ'):
+                    break
+            continue
+        stop = False
+        for name in sorted(set(fa['variables']) | set(fb['variables'])):
+            va, vb = fa['variables'].get(name), fb['variables'].get(name)
+            if va is None or vb is None:
+                stop = different(file, name, None, 'only in one manifest')
+            elif va['shape'] != vb['shape'] or va['chunk_size'] != vb['chunk_size']:
+                stop = different(file, name, None, 'shape %s != %s' % (va['shape'], vb['shape']))
+            else:
+                for k, (ca, cb) in enumerate(zip(va['chunks'], vb['chunks'])):
+                    if ca['sha256'] == cb['sha256']:
+                        continue
+                    step = k * va['chunk_size']
+                    if rtol or atol:
+                        if _stats_close(ca, cb, rtol, atol):
+                            close = True
+                            continue
+                    stop = different(file, name, step, 'min/max/mean %s/%s/%s != %s/%s/%s' % (
+                        ca.get('min'), ca.get('max'), ca.get('mean'), cb.get('min'), cb.get('max'), cb.get('mean')))
+                    break
+            if stop:
+                break
+        if stop:
+            break
+
+    if differences:
+        return ManifestComparison('different', differences[0][:3], differences)
+    return ManifestComparison('close' if close else 'identical')
+
+
+def compare_runs(outdir_a, outdir_b, rtol=0., atol=0., stop_at_first_difference=True):
+    """Compare the manifests of two run output directories."""
+    return compare_manifests(outdir_a, outdir_b, rtol, atol, stop_at_first_difference)
+
+
+def compare_experiments(exp_a, exp_b, runs, rtol=0., atol=0.):
+    """Compare runs of two experiments.  Returns {run: ManifestComparison}."""
+    return {i: compare_runs(exp_a.get_outputdir(i), exp_b.get_outputdir(i), rtol, atol) for i in runs}
@@ -0,0 +1,160 @@
+"""Reuse the output of identical runs instead of running the model again.
+
+A run is fully determined by the compiled model, the namelist, diag table
+and field table, the contents of the input files, the restart it starts
+from and the number of cores.  With memoization enabled the hash of this
+specification is recorded for every completed run, and a later run with
+the same specification, under any experiment name, is satisfied by
+linking the earlier output and restart archive into place rather than
+launching the model.
+
+    exp.enable_memoization()
+    exp.run(1, use_restart=False)     # runs the model, or reuses a match
+
+Restarts are identified by the specification of the run that wrote them,
+so a chain of runs repeated under a new name is reused run by run.  Other
+restart archives are identified by their contents.  The index is kept in
+`$GFDL_WORK/memo/index.json`.  Only `run()` is memoized, not `run_chain()`.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from isca import GFDL_WORK
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+from isca.inputcache import InputFileCache
+from isca.restarts import RESTART_SUFFIXES, _link_or_copy
+
+_index_lock = threading.Lock()
+
+
+def link_tree(src, dst):
+    """Hard link (or copy) the files of directory `src` into `dst`."""
+    mkdir(dst)
+    for name in os.listdir(src):
+        s, d = P(src, name), P(dst, name)
+        if os.path.isdir(s):
+            link_tree(s, d)
+        else:
+            _link_or_copy(s, d)
+
+
+def codebase_fingerprint(codebase):
+    """Identifies the compiled model."""
+    fingerprint = None
+    if hasattr(codebase, 'read_compile_fingerprint'):
+        fingerprint = codebase.read_compile_fingerprint()
+    if fingerprint is None:
+        try:
+            fingerprint = codebase.git_commit if codebase.commit is not None else codebase.source_fingerprint()
+        except Exception:
+            fingerprint = None
+    return [type(codebase).__name__, getattr(codebase, 'executable_name', None), fingerprint]
+
+
+class RunMemo(Logger):
+    """Index of completed runs by the hash of their specification."""
+
+    def __init__(self, storedir=P(GFDL_WORK, 'memo')):
+        self.storedir = storedir
+        self.indexfile = P(storedir, 'index.json')
+        self.hasher = InputFileCache(cachedir=P(storedir, 'file_hashes'))
+
+    def _load(self):
+        if os.path.isfile(self.indexfile):
+            with open(self.indexfile) as f:
+                return json.load(f)
+        return {'runs': {}, 'restarts': {}}
+
+    def _save(self, index):
+        mkdir(self.storedir)
+        fd, tmpfile = tempfile.mkstemp(dir=self.storedir, prefix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmpfile, self.indexfile)
+
+    def file_hash(self, exp, filename):
+        hasher = exp.input_cache if exp.input_cache is not None else self.hasher
+        return hasher.file_hash(filename)
+
+    def restart_hash(self, exp, restart_file):
+        """The spec hash of the run that wrote `restart_file`, or a hash
+        of its contents."""
+        if restart_file is None:
+            return None
+        path = os.path.realpath(restart_file)
+        st = os.stat(path)
+        entry = self._load()['restarts'].get(path)
+        if entry and entry['mtime'] == st.st_mtime_ns:
+            return 'run:' + entry['spec']
+        if os.path.isdir(path):
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(path)):
+                h.update(name.encode())
+                h.update(self.file_hash(exp, P(path, name)).encode())
+            return 'dir:' + h.hexdigest()
+        return 'file:' + self.file_hash(exp, path)
+
+    def spec(self, exp, restart_file, num_cores):
+        """The canonical specification of a run of `exp`."""
+        namelist = exp.namelist.todict() if hasattr(exp.namelist, 'todict') else exp.namelist
+        field_table = exp.field_table_file
+        return {
+            'codebase': codebase_fingerprint(exp.codebase),
+            'namelist': namelist,
+            # the calendar sets the base date written to the diag table
+            'diag_table': {'calendar': exp.diag_table.calendar, 'files': exp.diag_table.files},
+            'field_table': self.file_hash(exp, field_table) if os.path.isfile(field_table) else None,
+            'inputfiles': sorted([os.path.basename(f), self.file_hash(exp, f)] for f in exp.inputfiles),
+            'restart': self.restart_hash(exp, restart_file),
+            'num_cores': num_cores,
+        }
+
+    def spec_hash(self, exp, restart_file, num_cores):
+        spec = self.spec(exp, restart_file, num_cores)
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    def lookup(self, exp, spec_hash):
+        """The recorded run for `spec_hash` if its output is complete and
+        its restart still exists, else None."""
+        entry = self._load()['runs'].get(spec_hash)
+        if entry is None:
+            return None
+        if not (os.path.exists(entry['restart']) and os.path.isfile(P(entry['outdir'], exp.completefile))):
+            return None
+        return entry
+
+    def record(self, exp, i, spec_hash, reused=False):
+        """Record that run `i` of `exp` has the specification `spec_hash`.
+        Reused runs only record their restart, so the index keeps pointing
+        at the run that produced the output."""
+        restart = os.path.realpath(exp.find_restart_file(i))
+        with _index_lock:
+            index = self._load()
+            if not reused or spec_hash not in index['runs']:
+                index['runs'][spec_hash] = {'experiment': exp.name, 'run': i,
+                                            'outdir': exp.get_outputdir(i), 'restart': restart}
+            index['restarts'][restart] = {'spec': spec_hash, 'mtime': os.stat(restart).st_mtime_ns}
+            self._save(index)
+
+    def reuse(self, exp, i, entry, spec_hash):
+        """Link the output and restart of `entry` in as run `i` of `exp`."""
+        link_tree(entry['outdir'], exp.get_outputdir(i))
+        restart = entry['restart']
+        suffix = next(s for s in RESTART_SUFFIXES if restart.endswith(s))
+        dest = P(exp.restartdir, ('res%04d' % i) + suffix)
+        mkdir(exp.restartdir)
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        elif os.path.exists(dest):
+            os.remove(dest)
+        if os.path.isdir(restart):
+            link_tree(restart, dest)
+        else:
+            _link_or_copy(restart, dest)
+        self.record(exp, i, spec_hash, reused=True)
+        self.log.info('Run %d of %s reused from run %d of %s' % (i, exp.name, entry['run'], entry['experiment']))
@@ -0,0 +1,314 @@
+"""An index of the namelist groups and diagnostic fields in the source tree.
+
+The Fortran source is scanned for `namelist` statements; the declaration of
+each parameter gives its type and default value.  Calls to
+`register_diag_field` and `register_static_field` give the diagnostic
+fields each module can output and, where the axes can be recognised, their
+dimensions.  The index is stored in
+`$GFDL_WORK/namelist_index/` and refreshed incrementally: only files whose
+modification time or size has changed are scanned again.
+
+    from isca.nmlindex import NamelistIndex
+    index = NamelistIndex(codebase.srcdir)
+    index.groups['spectral_dynamics_nml']['num_fourier']
+    # {'type': 'integer', 'default': 42, 'array': False}
+
+The scan follows the conventions used in the source tree rather than
+parsing Fortran: defaults set by assignment at run time or through named
+constants are recorded as None or as the constant's name.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from isca import GFDL_WORK
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+FORTRAN_EXTENSIONS = ('.f90', '.F90')
+
+# changes when the format of the scan results changes
+INDEX_VERSION = 2
+
+_TYPES = {'real': 'real', 'integer': 'integer', 'logical': 'logical', 'character': 'character',
+          'complex': 'complex', 'double precision': 'real'}
+
+_declaration = re.compile(r'^\s*(real|integer|logical|character|complex|double\s+precision|type\s*\(\s*\w+\s*\))'
+                          r'\s*(?:\([^:]*?\)|\*\s*\d+)?\s*((?:,[^:]*)?)::(.*)$', re.IGNORECASE)
+_entity = re.compile(r'^\s*(\w+)\s*(\([^=]*\))?\s*(?:\*\s*\d+)?\s*(?:=(?!>)\s*(.*))?$', re.DOTALL)
+_namelist = re.compile(r'^\s*namelist\s*(/.*)$', re.IGNORECASE)
+_register = re.compile(r'register_(diag|static)_field\s*\(\s*(?:trim\s*\(\s*)?(\w+|\'[^\']*\'|"[^"]*")\s*\)?'
+                       r'\s*,\s*[\'"](\w+)[\'"]\s*,\s*(\(/.*?/\)|\w+\s*(?:\([^)]*\))?)', re.IGNORECASE)
+
+# the axes of the model grid by position in the `axes` array
+_AXES = ('lon', 'lat', 'pfull', 'phalf')
+
+_index_lock = threading.Lock()
+
+
+def _strip_comment(line):
+    quote = None
+    for k, c in enumerate(line):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c == '!':
+            return line[:k]
+    return line
+
+
+def fortran_statements(text):
+    """The statements in Fortran source `text`, without comments and with
+    continuation lines joined."""
+    statements = []
+    current = ''
+    for line in text.splitlines():
+        if line.lstrip().startswith('#'):
+            continue    # preprocessor directive
+        line = _strip_comment(line).strip()
+        if current and not line:
+            continue    # comment or blank line within a continued statement
+        if current and line.startswith('&'):
+            line = line[1:]
+        if line.endswith('&'):
+            current += line[:-1] + ' '
+            continue
+        current += line
+        if current.strip():
+            statements.append(current)
+        current = ''
+    if current.strip():
+        statements.append(current)
+    return statements
+
+
+def split_top_level(text, sep=','):
+    """Split `text` at `sep` outside brackets and quotes."""
+    parts, depth, quote, start = [], 0, None, 0
+    for k, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == sep and depth == 0:
+            parts.append(text[start:k])
+            start = k + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def parse_value(value):
+    """A Fortran literal as a python value.  Array constructors and named
+    constants are returned as strings."""
+    value = value.strip()
+    if not value:
+        return None
+    if value[0] in '\'"' and value[-1] == value[0]:
+        return value[1:-1]
+    lower = value.lower()
+    if lower in ('.true.', '.t.'):
+        return True
+    if lower in ('.false.', '.f.'):
+        return False
+    number = re.sub(r'_\w+$', '', lower)     # kind suffix, e.g. 1.0_dp
+    try:
+        return int(number)
+    except ValueError:
+        pass
+    try:
+        return float(number.replace('d', 'e'))
+    except ValueError:
+        return value
+
+
+def _axis(name):
+    name = name.strip().lower()
+    mo = re.match(r'^axes\((\d)\)$', name)
+    if mo:
+        k = int(mo.group(1)) - 1
+        return _AXES[k] if k < len(_AXES) else None
+    for key, axis in (('half', 'phalf'), ('full', 'pfull'), ('lev', 'pfull'), ('lon', 'lon'), ('lat', 'lat')):
+        if key in name:
+            return axis
+    return None
+
+
+def field_axes(axes):
+    """The grid axes named by the axes argument of `register_diag_field`,
+    e.g. ['lon', 'lat', 'pfull'], or None if they cannot be recognised."""
+    a = re.sub(r'\s+', '', axes).lower()
+    if a == 'time':
+        return []    # no axes, the field is a global value
+    if a.startswith('(/'):
+        axes = [_axis(x) for x in split_top_level(a[2:-2])]
+        return None if None in axes else axes
+    mo = re.match(r'^\w+\((\d):(\d)\)$', a)
+    if mo:
+        return list(_AXES[int(mo.group(1)) - 1:int(mo.group(2))])
+    if 'half' in a:
+        return ['lon', 'lat', 'phalf']
+    if '3d' in a or a.endswith('(full)'):
+        return ['lon', 'lat', 'pfull']
+    if '2d' in a:
+        return ['lon', 'lat']
+    return None
+
+
+def scan_source(text):
+    """The namelist groups and diagnostic fields declared in Fortran source
+    `text`: ({group: {param: {'type', 'default', 'array'}}},
+    {module: {field: {'axes', 'static'}}})."""
+    statements = fortran_statements(text)
+    declarations = {}
+    namelists = {}
+    registered = []
+    for statement in statements:
+        mo = _declaration.match(statement)
+        if mo:
+            vartype = re.sub(r'\s+', ' ', mo.group(1).lower())
+            vartype = _TYPES.get(vartype, 'derived')
+            dimension = 'dimension' in mo.group(2).lower()
+            for entity in split_top_level(mo.group(3)):
+                me = _entity.match(entity)
+                if me and me.group(1).lower() not in declarations:
+                    default = parse_value(me.group(3)) if me.group(3) is not None else None
+                    declarations[me.group(1).lower()] = {'type': vartype, 'default': default,
+                                                         'array': dimension or me.group(2) is not None}
+            continue
+        mo = _namelist.match(statement)
+        if mo:
+            # namelist /group/ a, b /other_group/ c
+            parts = re.split(r'/\s*(\w+)\s*/', mo.group(1))
+            for group, params in zip(parts[1::2], parts[2::2]):
+                nml = namelists.setdefault(group.lower(), [])
+                nml.extend(p.lower() for p in split_top_level(params))
+            continue
+        registered.extend(_register.findall(statement))
+
+    groups = {}
+    for group, params in namelists.items():
+        groups[group] = {p: declarations.get(p, {'type': None, 'default': None, 'array': False}) for p in params}
+    diag_fields = {}
+    for kind, module, field, axes in registered:
+        if module[0] in '\'"':
+            module = module[1:-1]
+        else:
+            # usually a variable such as mod_name = 'dynamics'
+            module = declarations.get(module.lower(), {}).get('default')
+            if not isinstance(module, str):
+                continue
+        fields = diag_fields.setdefault(module, {})
+        if field not in fields:
+            fields[field] = {'axes': field_axes(axes), 'static': kind.lower() == 'static'}
+    return groups, diag_fields
+
+
+class NamelistIndex(Logger):
+    """Namelist groups, their parameters and defaults, and the diagnostic
+    fields of each module in the source tree `srcdir`."""
+
+    def __init__(self, srcdir, indexfile=None, refresh=True):
+        self.srcdir = os.path.abspath(srcdir)
+        if indexfile is None:
+            key = hashlib.sha1(self.srcdir.encode()).hexdigest()[:12]
+            indexfile = P(GFDL_WORK, 'namelist_index', '%s.json' % key)
+        self.indexfile = indexfile
+        self.files = {}
+        self._groups = None
+        self._diag_fields = None
+        if os.path.isfile(self.indexfile):
+            with open(self.indexfile) as f:
+                state = json.load(f)
+            if state.get('srcdir') == self.srcdir and state.get('version') == INDEX_VERSION:
+                self.files = state['files']
+        if refresh:
+            self.refresh()
+
+    def source_files(self):
+        for root, dirnames, filenames in os.walk(self.srcdir, followlinks=True):
+            dirnames[:] = [d for d in dirnames if not d.startswith(('.', '__'))]
+            for filename in filenames:
+                if filename.endswith(FORTRAN_EXTENSIONS) and not filename.startswith('._'):
+                    yield P(root, filename)
+
+    def refresh(self):
+        """Scan the files that have changed since the index was last saved.
+        Returns the number of files scanned."""
+        seen = set()
+        scanned = 0
+        for path in self.source_files():
+            relpath = os.path.relpath(path, self.srcdir)
+            seen.add(relpath)
+            st = os.stat(path)
+            entry = self.files.get(relpath)
+            if entry and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                continue
+            with open(path, encoding='latin-1') as f:
+                groups, diag_fields = scan_source(f.read())
+            self.files[relpath] = {'mtime': st.st_mtime_ns, 'size': st.st_size,
+                                   'namelists': groups, 'diag_fields': diag_fields}
+            scanned += 1
+        removed = set(self.files) - seen
+        for relpath in removed:
+            del self.files[relpath]
+        if scanned or removed:
+            self.log.debug('Namelist index of %s: scanned %d files, removed %d' % (self.srcdir, scanned, len(removed)))
+            self._groups = self._diag_fields = None
+            self.save()
+        return scanned
+
+    def save(self):
+        with _index_lock:
+            directory = os.path.dirname(self.indexfile)
+            mkdir(directory)
+            fd, tmpfile = tempfile.mkstemp(dir=directory, prefix='.index')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'srcdir': self.srcdir, 'version': INDEX_VERSION, 'files': self.files}, f)
+            os.replace(tmpfile, self.indexfile)
+
+    @property
+    def groups(self):
+        """{group: {param: {'type', 'default', 'array'}}} over all files."""
+        if self._groups is None:
+            groups = {}
+            for relpath in sorted(self.files):
+                for group, params in self.files[relpath]['namelists'].items():
+                    merged = groups.setdefault(group, {})
+                    for param, info in params.items():
+                        if param not in merged or merged[param]['type'] is None:
+                            merged[param] = info
+            self._groups = groups
+        return self._groups
+
+    @property
+    def diag_fields(self):
+        """{module: {field: {'axes', 'static'}}} over all files."""
+        if self._diag_fields is None:
+            fields = {}
+            for relpath in sorted(self.files):
+                for module, names in self.files[relpath]['diag_fields'].items():
+                    merged = fields.setdefault(module, {})
+                    for name, info in names.items():
+                        if name not in merged or merged[name]['axes'] is None:
+                            merged[name] = info
+            self._diag_fields = fields
+        return self._diag_fields
+
+    def group_files(self, group):
+        """The files declaring namelist `group`."""
+        return sorted(relpath for relpath, entry in self.files.items() if group in entry['namelists'])
+
+    def defaults(self):
+        """The default value of every parameter as {group: {param: value}}."""
+        return {group: {param: info['default'] for param, info in params.items()}
+                for group, params in self.groups.items()}
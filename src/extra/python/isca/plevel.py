@@ -0,0 +1,305 @@
+"""Interpolate model output from sigma to pressure levels with numpy.
+
+This is a python implementation of the algorithm used by the Fortran
+`plev.x` tool in `postprocessing/plevel_interpolation` (see
+`run_pressure_interp.F90` and `pressure_interp.F90`), so that output can be
+interpolated without compiling the tool or starting a shell per file.
+
+- Full level pressures are computed from `pk`, `bk` and `ps` as in the model.
+- Fields are interpolated linearly in log(pressure), with the same limits
+  on extrapolation above the top and below the bottom model level.
+- Values below the surface are set to missing, unless `mask_below_surface=False`
+  in which case temperature is extrapolated with a 6.5 K/km lapse rate.
+- `slp` and `height` can be derived as with `plevel.sh`.
+
+The file is processed `time_chunk` time steps at a time so that memory
+use is bounded regardless of the length of the file.
+
+    from isca.plevel import interpolate_files
+    interpolate_files([(infile, outfile), ...], p_levs=[100000, 85000, 50000, 25000])
+
+Requires the `netCDF4` python package.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from isca.loghandler import log
+
+# constants as in plev_constants.F90 and run_pressure_interp.F90
+GRAV = 9.80
+RDGAS = 287.04
+RVGAS = 461.50
+TLAPSE = 6.5e-3
+TREF = 288.
+PREF = 101325.
+GORG = GRAV / (RDGAS*TLAPSE)
+MRGOG = -1./GORG
+D608 = (RVGAS-RDGAS)/RDGAS
+
+DEFAULT_MISSING_VALUE = 9.969209968386869e+36  # netcdf default fill value for floats
+HEIGHT_MISSING_VALUE = -1000.
+SLP_MISSING_VALUE = -1.
+
+
+def full_level_pressure(phalf):
+    """Full level pressure from half level pressure, as in the spectral model.
+    The vertical axis is axis 1."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lph = np.where(phalf > 0., phalf*np.log(np.where(phalf > 0., phalf, 1.)), 0.)
+        return np.exp((lph[:, 1:] - lph[:, :-1]) / (phalf[:, 1:] - phalf[:, :-1]) - 1.0)
+
+
+class PressureInterpolator(object):
+    """Interpolation indices and weights from full model levels to `pout`
+    for one chunk of time steps.
+
+    pk, bk: half level coefficients, shape (nlev+1,)
+    ps: surface pressure, shape (nt, ...) in Pa
+    pout: output pressure levels in Pa
+    """
+    def __init__(self, pk, bk, ps, pout):
+        expand = (slice(None), ) + (np.newaxis, )*(ps.ndim - 1)
+        self.phalf = pk[expand] + bk[expand]*ps[:, np.newaxis]
+        self.pfull = full_level_pressure(self.phalf)
+        self.log_pfull = np.log(self.pfull)
+        self.pout = np.asarray(pout, dtype=np.float64)
+        self.log_pout = np.log(self.pout)
+        nlev = self.pfull.shape[1]
+
+        # for each output level, index of the first model level k >= 1 with
+        # pfull[k] >= pout.  Points below the lowest level are masked.
+        shape = (ps.shape[0], len(self.pout)) + ps.shape[1:]
+        self.index = np.empty(shape, dtype=np.intp)
+        for n, lp in enumerate(self.log_pout):
+            self.index[:, n] = 1 + np.sum(self.log_pfull[:, 1:] < lp, axis=1)
+        self.mask = self.index > nlev - 1
+        self.index = np.minimum(self.index, nlev - 1)
+
+        lpk = self.take(self.log_pfull)
+        lpkm1 = self.take(self.log_pfull, -1)
+        dlp = lpkm1 - lpk
+        # with a single level there is no layer to interpolate across
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factr = np.where(dlp != 0., (self.log_pout[self._levels] - lpk) / dlp, 0.)
+        # limit extrapolation above the top and below the bottom level
+        self.factr = np.clip(factr, -0.5, 1.5)
+
+    @property
+    def _levels(self):
+        """Index to broadcast a 1D array over output levels."""
+        return (np.newaxis, slice(None)) + (np.newaxis, )*(self.index.ndim - 2)
+
+    def take(self, data, offset=0):
+        return np.take_along_axis(data, self.index + offset, axis=1)
+
+    def interp(self, data):
+        dk = self.take(data)
+        return dk + self.factr*(self.take(data, -1) - dk)
+
+    def extrapolate_temp(self, tin, tout):
+        """Below ground temperature from a constant lapse rate (temp_extrap)."""
+        k = self.index - 1
+        rrlaps = 1./TLAPSE
+        rglp21 = 0.5*(RDGAS/GRAV) * (self.log_pout[self._levels] - np.take_along_axis(self.log_pfull, k, axis=1))
+        textrap = np.take_along_axis(tin, k, axis=1) * (rrlaps + rglp21)/(rrlaps - rglp21)
+        return np.where(self.mask, textrap, tout)
+
+    def full_level_height(self, zsurf, temp, sphum):
+        """Height of the full model levels in metres (compute_height)."""
+        nlev = temp.shape[1]
+        zfull = np.empty_like(temp)
+        ptop_zero = np.any(self.phalf[:, 0] <= 0.)
+        zb = zsurf*GRAV
+        lpb = np.log(self.phalf[:, nlev])
+        with np.errstate(divide='ignore'):
+            for k in range(nlev-1, -1, -1):
+                lpf = self.log_pfull[:, k]
+                wtb = lpb - lpf
+                lpt = np.log(self.phalf[:, k])
+                # a zero top pressure has no log: use the lower half layer twice
+                wta = wtb if k == 0 and ptop_zero else lpf - lpt
+                vt = temp[:, k]*(1.0 + D608*sphum[:, k])*RDGAS
+                zt = zb + vt*(wta + wtb)
+                zfull[:, k] = (zb + vt*wtb)/GRAV
+                zb = zt
+                lpb = lpt
+        return zfull
+
+    def height(self, zsurf, tin, tout, qin, qout):
+        """Height of the output pressure levels by hydrostatic interpolation."""
+        zin = self.full_level_height(zsurf, tin, qin)
+        tvin = self.take(tin*(1. + D608*qin))
+        tvout = tout*(1. + D608*qout)
+        return ((self.take(self.log_pfull) - self.log_pout[self._levels]) *
+                (tvout + tvin)*0.5*RDGAS/GRAV + self.take(zin))
+
+    def slp(self, zsurf, temp):
+        """Sea level pressure in hPa."""
+        pbot = self.phalf[:, -1]
+        sig = self.pfull / pbot[:, np.newaxis]
+        kr = np.argmax(sig > 0.8, axis=1)[:, np.newaxis]
+        sigr = np.take_along_axis(sig, kr, axis=1)[:, 0]
+        tbot = np.take_along_axis(temp, kr, axis=1)[:, 0] * sigr**MRGOG
+        with np.errstate(invalid='ignore'):
+            slp = 0.01*pbot*(1.0 + TLAPSE*zsurf/tbot)**GORG
+        return np.where(np.abs(zsurf) > 0.0001, slp, 0.01*pbot)
+
+
+def _missing_value(var):
+    for attr in ('missing_value', '_FillValue'):
+        if attr in var.ncattrs():
+            return var.getncattr(attr)
+    return DEFAULT_MISSING_VALUE
+
+
+def interpolate_to_pressure(infile, outfile, p_levs, var_names=None, all_fields=True,
+                            mask_below_surface=True, time_chunk=10):
+    """Interpolate the 3D fields in `infile` to the pressure levels `p_levs` (Pa).
+
+    var_names: fields to interpolate, may include the derived fields 'slp' and
+        'height'.  If `all_fields` is True, all fields on full model levels are
+        interpolated as well.
+    mask_below_surface: set values below the surface to missing.
+    time_chunk: number of time steps held in memory at once.
+    """
+    from netCDF4 import Dataset
+
+    # plevel.sh calls the derived height field `hght`
+    var_names = ['height' if v == 'hght' else v for v in (var_names or [])]
+    pout = np.array(sorted(p_levs, reverse=True), dtype=np.float64)
+
+    with Dataset(infile, 'r') as src, Dataset(outfile, 'w', format=src.data_model) as dst:
+        src.set_auto_mask(False)
+        for required in ('pk', 'bk', 'ps'):
+            if required not in src.variables:
+                raise ValueError('%s does not contain %r, which is needed to interpolate to pressure levels' % (infile, required))
+        pk = src.variables['pk'][:].astype(np.float64)
+        bk = src.variables['bk'][:].astype(np.float64)
+        ps_var = src.variables['ps']
+        time_dim = ps_var.dimensions[0]
+        horizontal = ps_var.dimensions[1:]
+        nt = len(src.dimensions[time_dim])
+
+        def on_full_levels(var):
+            return var.dimensions[:2] == (time_dim, 'pfull') and var.dimensions[2:] == horizontal
+
+        to_interp = [name for name, var in src.variables.items()
+                     if on_full_levels(var) and (all_fields or name in var_names)]
+        derived = [name for name in ('slp', 'height') if name in var_names]
+        if ('height' in derived or not mask_below_surface) and 'temp' not in src.variables:
+            raise ValueError('%s does not contain temp, needed for height and extrapolation' % infile)
+        if 'height' in derived and 'temp' not in to_interp:
+            to_interp.append('temp')
+        if 'slp' in derived and 'temp' not in src.variables:
+            raise ValueError('%s does not contain temp, needed for slp' % infile)
+        if derived and 'zsurf' not in src.variables:
+            log.warning('zsurf not found in %s, assuming zero surface height' % infile)
+
+        # --- define the output file ---
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+        for name, dim in src.dimensions.items():
+            if name == 'pfull':
+                dst.createDimension(name, len(pout))
+            else:
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+        copied = []
+        for name, var in src.variables.items():
+            if name == 'pfull':
+                out = dst.createVariable('pfull', 'f8', ('pfull',))
+                out.setncatts({'units': 'hPa', 'long_name': 'pressure', 'axis': 'Z', 'positive': 'down'})
+                out[:] = pout/100.
+                continue
+            if 'pfull' in var.dimensions and name not in to_interp:
+                continue
+            if 'phalf' in var.dimensions and len(var.dimensions) > 1:
+                log.debug('Skipping half level field %s' % name)
+                continue
+            attrs = {k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'}
+            fill = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+            if name in to_interp:
+                missing = _missing_value(var)
+                fill = missing
+                attrs['missing_value'] = missing
+            out = dst.createVariable(name, var.dtype, var.dimensions, fill_value=fill)
+            out.setncatts(attrs)
+            if name not in to_interp:
+                copied.append(name)
+        if 'height' in derived:
+            out = dst.createVariable('height', 'f4', (time_dim, 'pfull') + horizontal, fill_value=HEIGHT_MISSING_VALUE)
+            out.setncatts({'units': 'm', 'long_name': 'height', 'missing_value': HEIGHT_MISSING_VALUE})
+        if 'slp' in derived:
+            out = dst.createVariable('slp', 'f4', (time_dim, ) + horizontal, fill_value=SLP_MISSING_VALUE)
+            out.setncatts({'units': 'hPa', 'long_name': 'sea level pressure', 'missing_value': SLP_MISSING_VALUE})
+        dst.set_auto_mask(False)
+
+        for name in copied:
+            if time_dim not in src.variables[name].dimensions and src.variables[name].size:
+                dst.variables[name][:] = src.variables[name][:]
+
+        zsurf = src.variables['zsurf'][:].astype(np.float64) if 'zsurf' in src.variables else 0.
+
+        # --- interpolate chunk by chunk in time ---
+        for t0 in range(0, nt, time_chunk):
+            t1 = min(t0 + time_chunk, nt)
+            for name in copied:
+                var = src.variables[name]
+                if var.dimensions and var.dimensions[0] == time_dim:
+                    dst.variables[name][t0:t1] = var[t0:t1]
+
+            ps = src.variables['ps'][t0:t1].astype(np.float64)
+            interp = PressureInterpolator(pk, bk, ps, pout)
+
+            tin = tout = None
+            if 'temp' in src.variables and ('temp' in to_interp or derived):
+                tin = src.variables['temp'][t0:t1].astype(np.float64)
+                tout = interp.interp(tin)
+                if not mask_below_surface:
+                    tout = interp.extrapolate_temp(tin, tout)
+
+            for name in to_interp:
+                var = src.variables[name]
+                if name == 'temp':
+                    result = tout
+                else:
+                    result = interp.interp(var[t0:t1].astype(np.float64))
+                if mask_below_surface:
+                    result = np.where(interp.mask, dst.variables[name].missing_value, result)
+                dst.variables[name][t0:t1] = result.astype(var.dtype)
+
+            if 'height' in derived:
+                if 'sphum' in src.variables:
+                    qin = src.variables['sphum'][t0:t1].astype(np.float64)
+                    qout = interp.interp(qin)
+                else:
+                    qin = np.zeros_like(tin)
+                    qout = np.zeros_like(tout)
+                height = interp.height(zsurf, tin, tout, qin, qout)
+                if mask_below_surface:
+                    height = np.where(interp.mask, HEIGHT_MISSING_VALUE, height)
+                dst.variables['height'][t0:t1] = height.astype(np.float32)
+
+            if 'slp' in derived:
+                if tin is None:
+                    tin = src.variables['temp'][t0:t1].astype(np.float64)
+                dst.variables['slp'][t0:t1] = interp.slp(zsurf, tin).astype(np.float32)
+
+    log.debug('Interpolated %s to %d pressure levels in %s' % (infile, len(pout), outfile))
+    return outfile
+
+
+def interpolate_files(file_pairs, p_levs, processes=None, **kwargs):
+    """Interpolate many files concurrently on a process pool.
+
+    file_pairs: a list of (infile, outfile) tuples.
+    Other arguments are passed to `interpolate_to_pressure`.
+    """
+    file_pairs = list(file_pairs)
+    if processes is None:
+        processes = min(len(file_pairs), os.cpu_count() or 1)
+    if processes <= 1:
+        return [interpolate_to_pressure(i, o, p_levs, **kwargs) for i, o in file_pairs]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(interpolate_to_pressure, i, o, p_levs, **kwargs) for i, o in file_pairs]
+        return [f.result() for f in futures]
@@ -0,0 +1,78 @@
+"""A small background worker pool for post-run tasks.
+
+Once the model has finished a run, combining the diagnostic output and
+copying it to the data directory does not need to hold up the start of the
+next run.  A `PostProcessor` accepts these tasks and runs them on a pool of
+threads.  The number of outstanding tasks is bounded so that a slow
+filesystem cannot cause an unlimited backlog of run directories to pile up
+in GFDL_WORK.  If a task fails, the exception is re-raised the next time
+the pool is used, so failures are never silently lost.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from isca.loghandler import Logger
+
+
+class PostProcessingError(Exception):
+    pass
+
+
+class PostProcessor(Logger):
+    def __init__(self, max_workers=2, max_pending=4):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def _wrap(self, fn, description):
+        def _task(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                self.log.error('Background task %r failed: %r' % (description, e))
+                with self._lock:
+                    self._errors.append((description, e))
+                raise
+            finally:
+                self._slots.release()
+        return _task
+
+    def check(self):
+        """Raise a PostProcessingError if any background task has failed."""
+        with self._lock:
+            if not self._errors:
+                return
+            description, e = self._errors[0]
+            self._errors = []
+        raise PostProcessingError('Background task %r failed: %r' % (description, e)) from e
+
+    def submit(self, fn, *args, description=None, **kwargs):
+        """Queue `fn(*args, **kwargs)` to run in the background.
+        Blocks while `max_pending` tasks are already outstanding."""
+        self.check()
+        description = description or fn.__name__
+        self._slots.acquire()
+        self.log.debug('Queued background task %r' % description)
+        future = self._executor.submit(self._wrap(fn, description), *args, **kwargs)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()] + [future]
+        return future
+
+    def wait(self):
+        """Block until all queued tasks are finished."""
+        with self._lock:
+            futures = self._futures[:]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass  # recorded in self._errors by the task wrapper
+        self.check()
+
+    def shutdown(self):
+        self.wait()
+        self._executor.shutdown()
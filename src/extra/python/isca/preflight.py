@@ -0,0 +1,239 @@
+"""Check an experiment for mistakes before it is run or queued.
+
+Typos in the namelist or the diag table, missing input files and core
+counts the grid cannot be divided over otherwise only show up once the
+model has started, or not at all: FMS ignores namelist groups no module
+reads and diag table fields no module registers.  The checks use the
+namelist index of the source tree (see `isca.nmlindex`) and take a few
+milliseconds once the index has been built.
+
+    exp.enable_preflight()
+    exp.run(1)                    # raises PreflightError before setting up the run
+
+    from isca.preflight import Preflight
+    for level, message in Preflight().check(exp, num_cores=16, raise_errors=False):
+        print(level, message)
+
+Errors are raised as `PreflightError`; warnings are logged, or raised too
+with `strict=True`.  Given the number of runs, `check` also warns if their
+projected output will not fit on the disk (see `isca.iobudget`).
+"""
+import difflib
+import os
+import re
+
+from isca.loghandler import Logger
+from isca.nmlindex import NamelistIndex
+from isca.autotune import DEFAULT_RESOLUTION, valid_core_counts
+from isca.iobudget import OutputBudget, format_bytes
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# python types accepted for each Fortran type
+_ACCEPTED = {
+    'logical': (bool, ),
+    'integer': (int, ),
+    'real': (int, float),
+    'character': (str, ),
+    'complex': (int, float, complex),
+}
+
+_tracer = re.compile(r'"tracer"\s*,\s*"\w+"\s*,\s*"(\w+)"', re.IGNORECASE)
+
+_indexes = {}
+
+
+class PreflightError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        super(PreflightError, self).__init__('\n'.join('%s: %s' % p for p in problems))
+
+
+def namelist_index(codebase):
+    """The (refreshed) namelist index of the source tree of `codebase`."""
+    index = _indexes.get(codebase.srcdir)
+    if index is None:
+        index = _indexes[codebase.srcdir] = NamelistIndex(codebase.srcdir)
+    else:
+        index.refresh()
+    return index
+
+
+def _suggest(name, candidates):
+    close = difflib.get_close_matches(name, list(candidates), n=1)
+    return ' (did you mean %r?)' % close[0] if close else ''
+
+
+def _type_ok(value, fortran_type):
+    accepted = _ACCEPTED.get(fortran_type)
+    if accepted is None:
+        return True
+    values = value if isinstance(value, list) else [value]
+    for v in values:
+        if v is None:
+            continue    # null value, e.g. x = 1, , 3
+        if not isinstance(v, accepted) or (isinstance(v, bool) and bool not in accepted):
+            return False
+    return True
+
+
+def check_namelist(exp, index):
+    """Unknown groups and parameters, and values of the wrong type."""
+    problems = []
+    groups = index.groups
+    for group, params in exp.namelist.items():
+        known = groups.get(group.lower())
+        if known is None:
+            problems.append((ERROR, 'namelist group %s is not read by any module%s' % (group, _suggest(group.lower(), groups))))
+            continue
+        if not hasattr(params, 'items'):
+            continue
+        for param, value in params.items():
+            info = known.get(param.lower())
+            if info is None:
+                problems.append((ERROR, '%s is not a parameter of %s%s' % (param, group, _suggest(param.lower(), known))))
+            elif isinstance(value, list) and len(value) > 1 and not info['array'] and info['type'] is not None:
+                problems.append((ERROR, '%s:%s is a scalar but was given %d values' % (group, param, len(value))))
+            elif not _type_ok(value, info['type']):
+                problems.append((ERROR, '%s:%s should be %s, not %r' % (group, param, info['type'], value)))
+    return problems
+
+
+def check_inputfiles(exp):
+    """Input files that do not exist, and INPUT/ files named in the
+    namelist that are not among the input files."""
+    problems = []
+    names = set()
+    for filename in exp.inputfiles:
+        names.add(os.path.basename(filename))
+        if not os.path.isfile(filename):
+            problems.append((ERROR, 'input file %s does not exist' % filename))
+    for group, params in exp.namelist.items():
+        if not hasattr(params, 'items'):
+            continue
+        for param, value in params.items():
+            for v in (value if isinstance(value, list) else [value]):
+                if isinstance(v, str) and v.strip().startswith('INPUT/'):
+                    name = v.strip()[len('INPUT/'):]
+                    if name and name not in names:
+                        problems.append((ERROR, '%s:%s refers to %s, which is not an input file' % (group, param, v.strip())))
+    return problems
+
+
+def experiment_grid(exp, index=None):
+    """lon_max, lat_max, num_fourier and num_spherical of the spectral core,
+    from the namelist or the defaults in the source."""
+    defaults = dict(DEFAULT_RESOLUTION, num_spherical=DEFAULT_RESOLUTION['num_fourier'] + 1)
+    if index is not None:
+        for key, info in index.groups.get('spectral_dynamics_nml', {}).items():
+            if key in defaults and isinstance(info['default'], int):
+                defaults[key] = info['default']
+    nml = exp.namelist.get('spectral_dynamics_nml', {})
+    return {key: nml.get(key, value) for key, value in defaults.items() if key != 'num_levels'}
+
+
+def check_grid(exp, num_cores, index=None):
+    """Spectral truncations that do not fit the grid and core counts the
+    grid cannot be divided over.  Input files are not compared with the
+    grid, as the model interpolates most of them."""
+    problems = []
+    if 'spectral_dynamics_nml' not in exp.namelist:
+        return problems
+    grid = experiment_grid(exp, index)
+    lon_max, lat_max, num_fourier = grid['lon_max'], grid['lat_max'], grid['num_fourier']
+    if lat_max % 2:
+        problems.append((ERROR, 'lat_max=%d must be even' % lat_max))
+    if lon_max < 3 * num_fourier + 1:
+        problems.append((WARNING, 'lon_max=%d is too small for num_fourier=%d without aliasing (needs at least %d)'
+                         % (lon_max, num_fourier, 3 * num_fourier + 1)))
+    if grid['num_spherical'] != num_fourier + 1:
+        problems.append((WARNING, 'num_spherical=%d is not num_fourier+1=%d (triangular truncation)'
+                         % (grid['num_spherical'], num_fourier + 1)))
+    if num_cores is not None:
+        valid = valid_core_counts(lat_max, num_fourier)
+        if num_cores not in valid:
+            problems.append((ERROR, '%d cores is not a valid decomposition for lat_max=%d, num_fourier=%d; valid core counts: %s'
+                             % (num_cores, lat_max, num_fourier, valid)))
+    return problems
+
+
+def field_table_tracers(filename):
+    """The names of the tracers in a field table."""
+    if not os.path.isfile(filename):
+        return set()
+    with open(filename) as f:
+        return set(_tracer.findall(f.read()))
+
+
+def check_diag_table(exp, index):
+    """Diag table fields no module registers.  Tracers in the field table
+    are accepted for any module; other fields registered under names built
+    at run time are not known, so these are warnings."""
+    problems = []
+    registered = index.diag_fields
+    tracers = field_table_tracers(exp.field_table_file)
+    if not exp.diag_table.is_valid():
+        problems.append((ERROR, 'the diag table has no output files'))
+    for file in exp.diag_table.files.values():
+        for field in file['fields']:
+            module, name = field['module'], field['name']
+            if module not in registered:
+                problems.append((WARNING, '%s: no module registers diagnostics as %r%s'
+                                 % (file['name'], module, _suggest(module, registered))))
+            elif name not in registered[module] and name not in tracers:
+                problems.append((WARNING, '%s: %s does not register %r%s'
+                                 % (file['name'], module, name, _suggest(name, registered[module]))))
+    return problems
+
+
+def check_output_budget(exp, runs, index=None):
+    """Output of `runs` runs that will not fit in the free disk space."""
+    budget = OutputBudget(exp, runs, index)
+    if budget.fits():
+        return []
+    return [(WARNING, '%d runs need about %s but only %s is free, enough for %d runs'
+             % (runs, format_bytes(budget.total), format_bytes(budget.free), budget.runs_that_fit()))]
+
+
+class Preflight(Logger):
+    """Run the checks in this module on an experiment.
+
+    strict: raise warnings as errors.
+    checks: the checks to run, of 'namelist', 'inputfiles', 'grid' and 'diag_table'.
+    """
+
+    CHECKS = ('namelist', 'inputfiles', 'grid', 'diag_table')
+
+    def __init__(self, strict=False, checks=CHECKS):
+        self.strict = strict
+        self.checks = checks
+
+    def check(self, exp, num_cores=None, raise_errors=True, runs=None):
+        """Return the list of (level, message) problems with `exp`, raising
+        PreflightError if there are errors and `raise_errors` is True.
+        With `runs`, also check their output will fit on the disk."""
+        index = namelist_index(exp.codebase) if os.path.isdir(exp.codebase.srcdir) else None
+        if index is None or not index.groups:
+            self.log.warning('No namelists found in %s, not checking the namelist or diag table' % exp.codebase.srcdir)
+        problems = []
+        if 'namelist' in self.checks and index is not None and index.groups:
+            problems.extend(check_namelist(exp, index))
+        if 'inputfiles' in self.checks:
+            problems.extend(check_inputfiles(exp))
+        if 'grid' in self.checks:
+            problems.extend(check_grid(exp, num_cores, index))
+        if 'diag_table' in self.checks and index is not None and index.groups:
+            problems.extend(check_diag_table(exp, index))
+        if runs is not None:
+            problems.extend(check_output_budget(exp, runs, index if index is not None and index.groups else None))
+
+        fatal = [p for p in problems if p[0] == ERROR or self.strict]
+        for level, message in problems:
+            if (level, message) not in fatal:
+                self.log.warning('%s: %s' % (exp.name, message))
+        if fatal and raise_errors:
+            for level, message in fatal:
+                self.log.error('%s: %s' % (exp.name, message))
+            raise PreflightError(fatal)
+        return problems
@@ -0,0 +1,234 @@
+"""Storage formats for the restart archives written at the end of each run.
+
+By default restarts are stored as `resNNNN.tar.gz`, as they always have
+been.  Gzip is slow for high resolution restarts, so other formats can be
+selected per experiment:
+
+    from isca.restarts import get_restart_storage
+    exp.restart_storage = get_restart_storage('fast')
+
+Available storage formats:
+    'tar.gz'     gzipped tar archive (default)
+    'tar'        uncompressed tar archive
+    'fast'       tar archive compressed with zstd or lz4 if available, falling
+                 back to gzip at the lowest compression level
+    'directory'  a plain directory of restart files.  Files are moved
+                 (not copied) into the store and hard linked out again into
+                 the model's INPUT directory, which the model only reads.
+                 Anywhere else they are copied out, so that editing the
+                 extracted files cannot change the stored restart.
+
+Restart archives are always read according to their content, so an
+experiment can restart from an archive written in any of these formats.
+"""
+import os
+import shutil
+import tarfile
+
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+_LZ4_MAGIC = b'\x04\x22\x4d\x18'
+
+
+def _zstd_module():
+    """Return a zstd implementation, preferring the standard library (python>=3.14)."""
+    try:
+        from compression import zstd
+        return 'stdlib', zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return 'zstandard', zstandard
+    except ImportError:
+        return None, None
+
+
+def _lz4_module():
+    try:
+        import lz4.frame
+        return lz4.frame
+    except ImportError:
+        return None
+
+
+def _open_zstd(filename, mode):
+    kind, zstd = _zstd_module()
+    if kind == 'stdlib':
+        return zstd.open(filename, mode)
+    if kind == 'zstandard':
+        fh = open(filename, mode)
+        if 'w' in mode:
+            return zstd.ZstdCompressor(level=3, threads=-1).stream_writer(fh, closefd=True)
+        return zstd.ZstdDecompressor().stream_reader(fh, closefd=True)
+    raise IOError('Cannot open %s: no zstd implementation available.  Install the `zstandard` package.' % filename)
+
+
+def _open_lz4(filename, mode):
+    lz4frame = _lz4_module()
+    if lz4frame is None:
+        raise IOError('Cannot open %s: the `lz4` package is not installed.' % filename)
+    return lz4frame.open(filename, mode)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class RestartStorage(Logger):
+    """Base class for restart storage formats."""
+    name = None
+    suffix = None
+
+    def save(self, archive_file, restart_directory):
+        """Store the contents of `restart_directory` at `archive_file`."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '%s()' % type(self).__name__
+
+
+class TarRestartStorage(RestartStorage):
+    """Tar archive, optionally compressed with one of tarfile's codecs."""
+    name = 'tar'
+    suffix = '.tar'
+    mode = 'w'
+    compresslevel = None
+
+    def save(self, archive_file, restart_directory):
+        kwargs = {} if self.compresslevel is None else {'compresslevel': self.compresslevel}
+        with tarfile.open(archive_file, self.mode, **kwargs) as tar:
+            tar.add(restart_directory, arcname='.')
+
+
+class TarGzRestartStorage(TarRestartStorage):
+    name = 'tar.gz'
+    suffix = '.tar.gz'
+    mode = 'w:gz'
+
+
+class FastTarRestartStorage(RestartStorage):
+    """A tar archive streamed through the fastest available codec:
+    zstd, then lz4, then gzip at compression level 1."""
+    name = 'fast'
+
+    def __init__(self):
+        if _zstd_module()[0] is not None:
+            self.codec = 'zstd'
+            self.suffix = '.tar.zst'
+        elif _lz4_module() is not None:
+            self.codec = 'lz4'
+            self.suffix = '.tar.lz4'
+        else:
+            self.codec = 'gzip'
+            self.suffix = '.tar.gz'
+
+    def save(self, archive_file, restart_directory):
+        if self.codec == 'gzip':
+            with tarfile.open(archive_file, 'w:gz', compresslevel=1) as tar:
+                tar.add(restart_directory, arcname='.')
+            return
+        opener = _open_zstd if self.codec == 'zstd' else _open_lz4
+        with opener(archive_file, 'wb') as fh:
+            with tarfile.open(fileobj=fh, mode='w|') as tar:
+                tar.add(restart_directory, arcname='.')
+
+    def __repr__(self):
+        return '%s(codec=%r)' % (type(self).__name__, self.codec)
+
+
+class DirectoryRestartStorage(RestartStorage):
+    """Restart files kept in a plain directory.
+
+    The restart files are moved into the store, which avoids copying them
+    at all when the run and data directories are on the same filesystem.
+    """
+    name = 'directory'
+    suffix = ''
+
+    def save(self, archive_file, restart_directory):
+        if os.path.exists(archive_file):
+            shutil.rmtree(archive_file)
+        mkdir(archive_file)
+        for f in os.listdir(restart_directory):
+            shutil.move(P(restart_directory, f), P(archive_file, f))
+
+
+RESTART_STORAGE = {cls.name: cls for cls in
+                   (TarGzRestartStorage, TarRestartStorage, FastTarRestartStorage, DirectoryRestartStorage)}
+
+# every file suffix a restart archive may have been written with
+RESTART_SUFFIXES = ('.tar.gz', '.tar.zst', '.tar.lz4', '.tar', '')
+
+
+def get_restart_storage(name):
+    """Return a restart storage object by name, see `RESTART_STORAGE`."""
+    try:
+        return RESTART_STORAGE[name]()
+    except KeyError:
+        raise ValueError('Unknown restart storage %r, choose from %s' % (name, ', '.join(RESTART_STORAGE)))
+
+
+def restart_format(archive_file):
+    """Identify the format of a restart archive from its contents.
+    Returns one of 'directory', 'gzip', 'zstd', 'lz4' or 'tar'."""
+    if os.path.isdir(archive_file):
+        return 'directory'
+    with open(archive_file, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return 'gzip'
+    if magic == _ZSTD_MAGIC:
+        return 'zstd'
+    if magic == _LZ4_MAGIC:
+        return 'lz4'
+    return 'tar'
+
+
+def extract_restart(archive_file, input_directory, link=False):
+    """Extract a restart archive of any supported format into `input_directory`.
+    With `link`, the files of a directory archive are hard linked rather
+    than copied: only use this where the files will not be written to,
+    such as the model INPUT directory.  Returns the list of restart file names."""
+    fmt = restart_format(archive_file)
+    if fmt == 'directory':
+        names = os.listdir(archive_file)
+        for f in names:
+            if link:
+                _link_or_copy(P(archive_file, f), P(input_directory, f))
+            else:
+                shutil.copy2(P(archive_file, f), P(input_directory, f))
+        return names
+    if fmt in ('zstd', 'lz4'):
+        opener = _open_zstd if fmt == 'zstd' else _open_lz4
+        with opener(archive_file, 'rb') as fh:
+            with tarfile.open(fileobj=fh, mode='r|') as tar:
+                names = []
+                for member in tar:
+                    tar.extract(member, path=input_directory)
+                    names.append(member.name)
+    else:
+        with tarfile.open(archive_file, 'r:*') as tar:
+            tar.extractall(path=input_directory)
+            names = tar.getnames()
+    return [os.path.basename(n) for n in names if n not in ('.', './')]
+
+
+def storage_for_file(filename):
+    """Choose the storage format to use when writing to `filename`, from its suffix."""
+    if filename.endswith('.tar.gz'):
+        return TarGzRestartStorage()
+    if filename.endswith('.tar'):
+        return TarRestartStorage()
+    fast = FastTarRestartStorage()
+    if filename.endswith(fast.suffix):
+        return fast
+    if filename.endswith(('.tar.zst', '.tar.lz4')):
+        raise ValueError('Cannot write %s: the compression library for this format is not installed' % filename)
+    return DirectoryRestartStorage()
@@ -0,0 +1,268 @@
+"""A cached index of the output files of an experiment, for fast lazy loading.
+
+Opening many years of output with `xarray.open_mfdataset` reads the header
+of every file and can take minutes.  `RunIndex` records, for each run
+directory of an experiment in GFDL_DATA, the file's size, modification time,
+time values and variable shapes in a small JSON index.  The index is updated
+incrementally: only files that are new or have changed since the last update
+are opened.  Datasets are then assembled from the index alone, and data is
+only read from the files covering the runs, variables and times that are
+actually used.
+
+    from isca.runindex import RunIndex
+    index = RunIndex(P(GFDL_DATA, 'my_exp'), 'atmos_monthly.nc')
+    ds = index.open(runs=range(121, 241), variables=['temp', 'ucomp'])
+
+or, for an experiment object, `exp.open_output('atmos_monthly.nc')`.
+
+Run directories named `run%d`, `run%03d` and `run%04d` are all recognised.
+Requires the `netCDF4` python package.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+INDEX_VERSION = 1
+_RUN_DIRECTORY = re.compile(r'^run(\d+)$')
+
+# netCDF4 is not thread safe
+_read_lock = threading.Lock()
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _attrs(ncobj):
+    return {k: _to_json(ncobj.getncattr(k)) for k in ncobj.ncattrs()}
+
+
+def _read(path, name, key):
+    from netCDF4 import Dataset
+    with _read_lock:
+        with Dataset(path) as nc:
+            var = nc.variables[name]
+            var.set_auto_maskandscale(False)
+            return np.asarray(var[key])
+
+
+class RunFilesArray(BackendArray):
+    """A variable stored in a sequence of files, concatenated along its
+    first (time) dimension.  Only the files overlapping the requested
+    indices are read."""
+
+    def __init__(self, name, paths, lengths, shape, dtype):
+        self.name = name
+        self.paths = paths
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem)
+
+    def _getitem(self, key):
+        times = np.arange(self.shape[0])[key[0]]
+        rest = tuple(key[1:])
+        scalar_time = np.ndim(times) == 0
+        times = np.atleast_1d(times)
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        file_numbers = np.searchsorted(self.offsets, times, side='right') - 1
+        parts = []
+        for n in np.unique(file_numbers):
+            local = times[file_numbers == n] - self.offsets[n]
+            if np.all(np.diff(local) == 1):
+                local = slice(int(local[0]), int(local[-1]) + 1)
+            parts.append(_read(self.paths[n], self.name, (local, ) + rest))
+        if not parts:
+            shape = (0, ) + np.empty(self.shape[1:])[rest].shape
+            return np.empty(shape, dtype=self.dtype)
+        data = np.concatenate(parts, axis=0)
+        if np.any(np.diff(order) < 0):
+            data = data[np.argsort(order)]
+        return data[0] if scalar_time else data
+
+
+class RunIndex(Logger):
+    """Index of one diagnostic output file (e.g. 'atmos_monthly.nc') across
+    all the run directories of an experiment."""
+
+    def __init__(self, datadir, filename='atmos_monthly.nc', indexdir=None):
+        self.datadir = datadir
+        self.filename = filename
+        self.indexdir = indexdir or P(datadir, '.isca_index')
+        self.indexfile = P(self.indexdir, filename + '.json')
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._load()
+            self.update()
+        return self._index
+
+    @property
+    def runs(self):
+        """The run numbers for which the file exists, in order."""
+        return sorted(int(r) for r in self.index['runs'])
+
+    def _load(self):
+        if os.path.isfile(self.indexfile):
+            try:
+                with open(self.indexfile) as f:
+                    index = json.load(f)
+                if index.get('version') == INDEX_VERSION:
+                    return index
+            except ValueError:
+                self.log.warning('Ignoring corrupt index %s' % self.indexfile)
+        return {'version': INDEX_VERSION, 'filename': self.filename, 'runs': {}}
+
+    def save(self):
+        try:
+            mkdir(self.indexdir)
+            fd, tmpfile = tempfile.mkstemp(dir=self.indexdir, prefix='.index')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._index, f)
+            os.replace(tmpfile, self.indexfile)
+        except (OSError, IOError) as e:
+            # e.g. a read-only data directory belonging to someone else
+            self.log.debug('Could not write index %s: %s' % (self.indexfile, e))
+
+    def _scan_file(self, path):
+        from netCDF4 import Dataset
+        with _read_lock:
+            with Dataset(path) as nc:
+                unlimited = [name for name, dim in nc.dimensions.items() if dim.isunlimited()]
+                time_dim = unlimited[0] if unlimited else 'time'
+                variables = {}
+                for name, var in nc.variables.items():
+                    variables[name] = {'dims': list(var.dimensions), 'shape': list(var.shape),
+                                       'dtype': var.dtype.str, 'attrs': _attrs(var)}
+                    # dimension coordinates are small, keep their values
+                    if var.dimensions == (name, ):
+                        var.set_auto_maskandscale(False)
+                        variables[name]['values'] = _to_json(np.asarray(var[:]))
+                return {'time_dim': time_dim, 'attrs': _attrs(nc), 'variables': variables}
+
+    def update(self):
+        """Bring the index up to date with the run directories on disk.
+        Returns the list of run numbers that were (re)indexed."""
+        if self._index is None:
+            self._index = self._load()
+        runs = self._index['runs']
+        found = set()
+        changed = []
+        if os.path.isdir(self.datadir):
+            for entry in os.scandir(self.datadir):
+                match = _RUN_DIRECTORY.match(entry.name)
+                if not match or not entry.is_dir():
+                    continue
+                path = P(entry.path, self.filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                run = str(int(match.group(1)))
+                found.add(run)
+                known = runs.get(run)
+                if (known and known['path'] == P(entry.name, self.filename)
+                        and known['size'] == st.st_size and known['mtime'] == st.st_mtime_ns):
+                    continue
+                try:
+                    info = self._scan_file(path)
+                except (OSError, IOError, RuntimeError) as e:
+                    self.log.warning('Could not index %s: %s' % (path, e))
+                    found.discard(run)
+                    continue
+                info.update({'path': P(entry.name, self.filename), 'size': st.st_size, 'mtime': st.st_mtime_ns})
+                runs[run] = info
+                changed.append(int(run))
+        removed = [r for r in runs if r not in found]
+        for r in removed:
+            del runs[r]
+        if changed:
+            self.log.info('Indexed %d new or changed runs of %s in %s' % (len(changed), self.filename, self.datadir))
+        if removed:
+            self.log.info('Removed %d runs of %s from the index of %s' % (len(removed), self.filename, self.datadir))
+        if changed or removed:
+            self.save()
+        return sorted(changed)
+
+    def open(self, runs=None, variables=None, decode_times=False, update=True):
+        """Open the output of `runs` (default: all runs) as a lazily loaded
+        xarray Dataset.  If `variables` is given, only those variables and
+        the coordinates they need are included."""
+        if update:
+            self.update()
+        available = self.runs
+        runs = available if runs is None else [int(r) for r in runs]
+        missing = sorted(set(runs) - set(available))
+        if missing:
+            raise ValueError('No %s found for runs %s in %s' % (self.filename, missing, self.datadir))
+        if not runs:
+            raise ValueError('No runs of %s to open in %s' % (self.filename, self.datadir))
+
+        entries = [self.index['runs'][str(r)] for r in runs]
+        first = entries[0]
+        time_dim = first['time_dim']
+        paths = [P(self.datadir, e['path']) for e in entries]
+        lengths = [e['variables'][time_dim]['shape'][0] if time_dim in e['variables'] else 0 for e in entries]
+
+        names = list(first['variables'])
+        if variables is not None:
+            wanted = set(variables)
+            unknown = wanted - set(names)
+            if unknown:
+                raise ValueError('Variables %s not found in %s' % (sorted(unknown), self.filename))
+            dims = set()
+            for name in wanted:
+                dims.update(first['variables'][name]['dims'])
+            wanted.update(d for d in dims if d in first['variables'])
+            names = [n for n in names if n in wanted]
+
+        data_vars = {}
+        for name in names:
+            info = first['variables'][name]
+            attrs = info['attrs']
+            if name == time_dim:
+                values = np.concatenate([np.asarray(e['variables'][name]['values'], dtype=info['dtype']) for e in entries])
+                data_vars[name] = xr.Variable(info['dims'], values, attrs)
+            elif 'values' in info:
+                data_vars[name] = xr.Variable(info['dims'], np.asarray(info['values'], dtype=info['dtype']), attrs)
+            elif info['dims'] and info['dims'][0] == time_dim:
+                for e, path in zip(entries, paths):
+                    other = e['variables'].get(name)
+                    if other is None or other['shape'][1:] != info['shape'][1:]:
+                        raise ValueError('%s in %s does not match the first run' % (name, path))
+                shape = (sum(lengths), ) + tuple(info['shape'][1:])
+                array = RunFilesArray(name, paths, lengths, shape, info['dtype'])
+                data_vars[name] = xr.Variable(info['dims'], indexing.LazilyIndexedArray(array), attrs)
+            elif not info['shape']:
+                data_vars[name] = xr.Variable((), _read(paths[0], name, ()), attrs)
+            else:
+                # fields without a time dimension are read from the first run
+                array = RunFilesArray(name, paths[:1], info['shape'][:1], tuple(info['shape']), info['dtype'])
+                data_vars[name] = xr.Variable(info['dims'], indexing.LazilyIndexedArray(array), attrs)
+
+        ds = xr.Dataset(data_vars, attrs=first['attrs'])
+        ds = xr.decode_cf(ds, decode_times=decode_times)
+        ds.attrs['runs'] = '%d-%d' % (runs[0], runs[-1])
+        return ds
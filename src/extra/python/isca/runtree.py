@@ -0,0 +1,319 @@
+"""Run ensembles and parameter sweeps that branch from a common spin-up.
+
+Each member of a `RunTree` is described by the namelist changes it makes
+to a base experiment and the run from which each change applies.  Members
+that share the same configuration for their first k runs share those
+runs: the common prefix is integrated once and the members branch from
+its restart archive.
+
+    from isca.runtree import RunTree, RestartPerturbation
+    tree = RunTree(exp, 'hs_omega', runs=10)
+    for s in [1.0, 10.0, 100.0]:
+        # spin up with Earth's rotation rate, change it from run 4 onward
+        tree.add_member('hs_om_%.0f' % s, {'constants_nml': {'omega': 7.292e-5*s/100}}, start=4)
+    for k in range(100):
+        # identical namelists, perturbed restarts at the start of run 4
+        tree.add_member('hs_ens_%03d' % k, perturbation=RestartPerturbation(seed=k), perturb_run=4)
+
+    print(tree.plan())
+    tree.run(num_cores=16, max_parallel=4)
+
+Shared runs are written to experiments named `<tree name>_shared_<hash>`
+and linked into the data directory of each member, so the output of a
+member looks the same as if it had been run on its own.  Runs that
+already have output and a restart are skipped, so an interrupted tree can
+be run again to complete it.
+"""
+import copy
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+from isca.restarts import extract_restart
+
+
+class RestartPerturbation(object):
+    """Multiply the floating point fields of a restart file by
+    (1 + amplitude*N(0,1)) noise drawn with the given seed.
+
+    filename: the restart file in the restart archive to perturb.
+    variables: the variables to perturb, default all floating point variables
+        that are not coordinates.
+    """
+
+    def __init__(self, amplitude=1e-6, seed=0, filename='spectral_dynamics.res.nc', variables=None):
+        self.amplitude = amplitude
+        self.seed = seed
+        self.filename = filename
+        self.variables = variables
+
+    def key(self):
+        return [self.amplitude, self.seed, self.filename, self.variables]
+
+    def apply(self, restart_directory):
+        from netCDF4 import Dataset
+        rng = np.random.RandomState(self.seed)
+        with Dataset(P(restart_directory, self.filename), 'a') as ds:
+            names = self.variables or [name for name, var in ds.variables.items()
+                                       if name not in ds.dimensions and var.dtype.kind == 'f']
+            for name in names:
+                var = ds.variables[name]
+                data = var[:]
+                var[:] = data * (1 + self.amplitude * rng.standard_normal(data.shape))
+
+    def __repr__(self):
+        return 'RestartPerturbation(amplitude=%r, seed=%r)' % (self.amplitude, self.seed)
+
+
+class Member(object):
+    def __init__(self, name, runs, changes, perturbation=None, perturb_run=None):
+        self.name = name
+        self.runs = runs
+        self.changes = changes
+        self.perturbation = perturbation
+        self.perturb_run = perturb_run
+
+
+class Segment(object):
+    """Consecutive runs shared by the same set of members."""
+
+    def __init__(self, key, members, parent=None):
+        self.key = key
+        self.members = members
+        self.parent = parent
+        self.children = []
+        self.runs = []          # [(run number, namelist)]
+        self.perturbation = None
+        self.exp = None
+
+    @property
+    def first(self):
+        return self.runs[0][0]
+
+    @property
+    def last(self):
+        return self.runs[-1][0]
+
+
+class RunTree(Logger):
+    """Plan and run the members of an ensemble derived from `exp`, sharing
+    runs that have the same configuration.  See the module documentation.
+
+    exp: the base experiment.  Each member starts from a copy of its namelist.
+    name: the name of the tree, used to name the shared experiments.
+    runs: the default number of runs of each member.
+    restart_file: an optional restart archive to start run 1 from.
+    """
+
+    def __init__(self, exp, name, runs=10, restart_file=None):
+        self.exp = exp
+        self.name = name
+        self.runs = runs
+        self.restart_file = restart_file
+        self.members = []
+        self._segments = None
+
+    def add_member(self, name, overrides=None, start=1, changes=None, perturbation=None, perturb_run=None, runs=None):
+        """Add a member named `name`.
+
+        overrides: namelist values applied from run `start` onward.
+        changes: more namelist changes as {run: namelist values}, applied
+            cumulatively in order of run.
+        perturbation: a `RestartPerturbation` applied to the restart at the
+            start of run `perturb_run` (default `start`).
+        runs: the number of runs, default the number given to the tree.
+        """
+        changes = dict(changes or {})
+        if overrides:
+            changes.setdefault(start, {})
+            changes[start] = _merge(changes[start], overrides)
+        if perturbation is not None:
+            perturb_run = perturb_run or start
+            if perturb_run < 2 and self.restart_file is None:
+                raise ValueError('Member %r: a perturbation needs a restart, so it can only be applied from run 2' % name)
+        if name in [m.name for m in self.members]:
+            raise ValueError('A member called %r already exists' % name)
+        self.members.append(Member(name, runs or self.runs, changes, perturbation, perturb_run))
+        self._segments = None
+
+    def member_namelist(self, member, i):
+        """The namelist of `member` for run `i`."""
+        namelist = copy.deepcopy(self.exp.namelist)
+        for run in sorted(member.changes):
+            if run <= i:
+                for section, values in member.changes[run].items():
+                    if section not in namelist:
+                        namelist[section] = {}
+                    namelist[section].update(values)
+        return namelist
+
+    def _run_key(self, member, i):
+        perturbation = member.perturbation.key() if member.perturbation is not None and member.perturb_run == i else None
+        config = {'namelist': self.member_namelist(member, i), 'perturbation': perturbation}
+        return json.dumps(config, sort_keys=True, default=str)
+
+    def segments(self):
+        """Build the tree of segments.  Returns the root segments."""
+        if self._segments is not None:
+            return self._segments
+        roots = []
+        # group the members run by run on the configuration history so far
+        groups = [(None, self.members, hashlib.sha1())]
+        for i in range(1, max([m.runs for m in self.members] or [0]) + 1):
+            next_groups = []
+            for segment, members, history in groups:
+                by_key = {}
+                for member in members:
+                    if member.runs >= i:
+                        by_key.setdefault(self._run_key(member, i), []).append(member)
+                # a new segment starts where the members diverge, some of them
+                # finish, or the restart is perturbed
+                branch = (segment is None or len(by_key) > 1 or
+                          sum(len(g) for g in by_key.values()) != len(members))
+                for key, group in sorted(by_key.items(), key=lambda kv: kv[1][0].name):
+                    h = history.copy()
+                    h.update(key.encode())
+                    perturbation = group[0].perturbation if group[0].perturb_run == i else None
+                    if branch or perturbation is not None:
+                        seg = Segment(h.hexdigest(), group, parent=segment)
+                        seg.perturbation = perturbation
+                        (segment.children if segment is not None else roots).append(seg)
+                    else:
+                        seg = segment
+                        seg.key = h.hexdigest()
+                    seg.runs.append((i, self.member_namelist(group[0], i)))
+                    next_groups.append((seg, group, h))
+            groups = next_groups
+        for segment in self._iter(roots):
+            segment.exp = self._segment_experiment(segment)
+        self._segments = roots
+        return roots
+
+    def _iter(self, segments):
+        for segment in segments:
+            yield segment
+            for child in self._iter(segment.children):
+                yield child
+
+    def _segment_experiment(self, segment):
+        if len(segment.members) == 1 and not segment.children:
+            name = segment.members[0].name
+        else:
+            name = '%s_shared_%s' % (self.name, segment.key[:10])
+        exp = self.exp.derive(name)
+        exp.namelist = copy.deepcopy(segment.runs[0][1])
+        return exp
+
+    def member_runs(self, member):
+        """[(run, experiment that runs it)] for `member`."""
+        runs = []
+        for segment in self._iter(self.segments()):
+            if member in segment.members:
+                runs.extend((i, segment.exp) for i, _ in segment.runs)
+        return sorted(runs, key=lambda r: r[0])
+
+    def savings(self):
+        """(runs if every member ran alone, runs in the tree)"""
+        total = sum(m.runs for m in self.members)
+        shared = sum(len(s.runs) for s in self._iter(self.segments()))
+        return total, shared
+
+    def plan(self):
+        lines = []
+
+        def describe(segment, depth):
+            members = segment.members[0].name if len(segment.members) == 1 else '%d members' % len(segment.members)
+            perturbed = ', perturbed' if segment.perturbation is not None else ''
+            lines.append('%sruns %d-%d  %s  (%s%s)' % ('  '*depth, segment.first, segment.last,
+                                                     segment.exp.name, members, perturbed))
+            for child in segment.children:
+                describe(child, depth + 1)
+
+        for root in self.segments():
+            describe(root, 0)
+        total, shared = self.savings()
+        lines.append('%d runs instead of %d (%.0f%% saved)' % (shared, total, 100.*(total - shared)/max(total, 1)))
+        return '\n'.join(lines)
+
+    def _branch_restart(self, segment):
+        """The restart archive the first run of `segment` starts from."""
+        if segment.parent is None:
+            restart_file = self.restart_file
+        else:
+            restart_file = segment.parent.exp.find_restart_file(segment.first - 1)
+        if segment.perturbation is None or restart_file is None:
+            return restart_file
+        exp = segment.exp
+        perturbed = exp.get_restart_file(segment.first - 1)
+        if os.path.exists(perturbed):
+            return perturbed
+        mkdir(exp.restartdir)
+        mkdir(exp.workdir)
+        tmpdir = tempfile.mkdtemp(dir=exp.workdir, prefix='perturb')
+        try:
+            # a copy: the perturbation is written in place and the parent's
+            # restart must stay as it is for the other branches
+            extract_restart(restart_file, tmpdir, link=False)
+            segment.perturbation.apply(tmpdir)
+            exp.make_restart_archive(perturbed, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.log.info('Branched %s from %s with %r' % (exp.name, restart_file, segment.perturbation))
+        return perturbed
+
+    def run_segment(self, segment, **run_kwargs):
+        exp = segment.exp
+        restart_file = self._branch_restart(segment)
+        for i, namelist in segment.runs:
+            if exp.run_is_complete(i):
+                continue
+            exp.namelist = copy.deepcopy(namelist)
+            first = i == segment.first
+            exp.run(i, restart_file=restart_file if first else None,
+                    use_restart=restart_file is not None if first else True,
+                    overwrite_data=True, **run_kwargs)
+        exp.wait_for_postprocessing()
+
+    def run(self, max_parallel=1, link=True, **run_kwargs):
+        """Run every segment, each after the segment it branches from.
+        Up to `max_parallel` segments run at once.  Other keyword arguments
+        are passed to `Experiment.run`."""
+        self.log.info('Run tree %s:\n%s' % (self.name, self.plan()))
+        with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+            running = {pool.submit(self.run_segment, s, **run_kwargs): s for s in self.segments()}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    segment = running.pop(future)
+                    future.result()
+                    for child in segment.children:
+                        running[pool.submit(self.run_segment, child, **run_kwargs)] = child
+        if link:
+            self.link_members()
+
+    def link_members(self):
+        """Link the shared runs of each member into its data directory."""
+        for member in self.members:
+            datadir = P(os.path.dirname(self.exp.datadir), member.name)
+            for i, exp in self.member_runs(member):
+                if exp.name == member.name:
+                    continue
+                src = P(exp.datadir, exp.runfmt % i)
+                dst = P(datadir, exp.runfmt % i)
+                if os.path.isdir(src) and not os.path.lexists(dst):
+                    mkdir(datadir)
+                    os.symlink(src, dst)
+
+
+def _merge(a, b):
+    merged = {section: dict(values) for section, values in a.items()}
+    for section, values in b.items():
+        merged.setdefault(section, {}).update(values)
+    return merged
@@ -0,0 +1,207 @@
+"""Run several experiments side by side within a fixed budget of cores.
+
+The runs of each experiment are performed strictly in order (run i+1 needs
+the restart from run i), but independent experiments are integrated
+concurrently whenever there are enough free cores.  For example, to run a
+parameter sweep on a 128 core node:
+
+    sched = ExperimentScheduler(total_cores=128)
+    for omega in [0.5, 1.0, 2.0, 4.0]:
+        e = exp.derive('hs_omega_%.1f' % omega)
+        e.update_namelist({'constants_nml': {'omega': omega*7.292e-5}})
+        sched.add(e, runs=range(1, 121), num_cores=32, use_restart=False)
+    sched.run()
+
+The progress of every experiment is recorded in a state file so that if the
+driving python process dies, calling `run()` again on the same schedule
+picks up where it left off.
+"""
+import json
+import os
+import threading
+
+from isca import GFDL_WORK, EventEmitter
+from isca.experiment import FailedRunError
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+
+class CoreBudget(object):
+    """A counting lock over a fixed number of cores."""
+    def __init__(self, total_cores):
+        self.total_cores = total_cores
+        self.free_cores = total_cores
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        if n > self.total_cores:
+            raise ValueError('Cannot acquire %d cores from a budget of %d' % (n, self.total_cores))
+        with self._cond:
+            while self.free_cores < n:
+                self._cond.wait()
+            self.free_cores -= n
+
+    def release(self, n):
+        with self._cond:
+            self.free_cores += n
+            self._cond.notify_all()
+
+
+class ScheduledJob(object):
+    """A chain of runs of a single experiment."""
+    def __init__(self, exp, runs, num_cores, restart_file=None, use_restart=True, run_kwargs=None):
+        self.exp = exp
+        self.runs = list(runs)
+        self.num_cores = num_cores
+        self.restart_file = restart_file
+        self.use_restart = use_restart
+        self.run_kwargs = run_kwargs or {}
+        self.completed = []
+        self.status = 'pending'
+        self.error = None
+
+    @property
+    def name(self):
+        return self.exp.name
+
+    def run_is_complete(self, i):
+        """A run is complete when it has been recorded as such, or
+        when the experiment has marked all its output as in place."""
+        if i in self.completed:
+            return True
+        return self.exp.run_is_complete(i)
+
+    def kwargs_for(self, i):
+        """The arguments passed to `Experiment.run` for run `i`.
+        Only the first run of the chain uses the user supplied restart
+        options; all subsequent runs continue from run i-1."""
+        kwargs = dict(self.run_kwargs, num_cores=self.num_cores)
+        if i == self.runs[0]:
+            kwargs['use_restart'] = self.use_restart
+            kwargs['restart_file'] = self.restart_file
+        return kwargs
+
+
+class ExperimentScheduler(Logger, EventEmitter):
+    """Pack the run chains of many experiments onto `total_cores` cores.
+
+    Events emitted:
+        'job:start' (scheduler, job)
+        'job:run' (scheduler, job, i) once all the output of a run is in place
+        'job:complete' (scheduler, job)
+        'job:failed' (scheduler, job, error)
+    """
+    def __init__(self, total_cores, name='default', statedir=P(GFDL_WORK, 'scheduler')):
+        super(ExperimentScheduler, self).__init__()
+        self.budget = CoreBudget(total_cores)
+        self.name = name
+        self.statedir = statedir
+        self.statefile = P(statedir, '%s.json' % name)
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def add(self, exp, runs, num_cores=8, restart_file=None, use_restart=True, **run_kwargs):
+        """Schedule runs `runs` of experiment `exp` on `num_cores` cores.
+
+        `restart_file` and `use_restart` apply only to the first run in `runs`.
+        Any other keyword arguments are passed to every `exp.run()` call.
+        """
+        if num_cores > self.budget.total_cores:
+            raise ValueError('Experiment %r requests %d cores but the budget is only %d'
+                             % (exp.name, num_cores, self.budget.total_cores))
+        if any(job.name == exp.name for job in self.jobs):
+            # experiments with the same name share a run directory
+            raise ValueError('Experiment %r is already scheduled' % exp.name)
+        job = ScheduledJob(exp, runs, num_cores, restart_file, use_restart, run_kwargs)
+        self.jobs.append(job)
+        return job
+
+    def load_state(self):
+        if not os.path.isfile(self.statefile):
+            return
+        with open(self.statefile) as f:
+            state = json.load(f)
+        for job in self.jobs:
+            if job.name in state:
+                job.completed = state[job.name]['completed']
+        self.log.info('Loaded scheduler state from %s' % self.statefile)
+
+    def save_state(self):
+        with self._lock:
+            state = {job.name: {'completed': job.completed,
+                                'status': job.status,
+                                'error': job.error}
+                     for job in self.jobs}
+            mkdir(self.statedir)
+            tmpfile = self.statefile + '.tmp'
+            with open(tmpfile, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmpfile, self.statefile)
+
+    def _record_complete(self, job, pending):
+        """Record the runs in `pending` whose output is now in place.
+        Returns the runs that are still being post-processed."""
+        still_pending = []
+        for i in pending:
+            if job.exp.run_is_complete(i):
+                job.completed.append(i)
+                self.save_state()
+                self.emit('job:run', self, job, i)
+            else:
+                still_pending.append(i)
+        return still_pending
+
+    def _run_job(self, job):
+        job.status = 'running'
+        self.emit('job:start', self, job)
+        pending = []   # runs that have finished but may still be post-processed
+        try:
+            for i in job.runs:
+                if job.run_is_complete(i):
+                    self.log.info('%s: run %d already complete, skipping' % (job.name, i))
+                    if i not in job.completed:
+                        job.completed.append(i)
+                    continue
+                self.budget.acquire(job.num_cores)
+                try:
+                    ran = job.exp.run(i, **job.kwargs_for(i))
+                finally:
+                    self.budget.release(job.num_cores)
+                if not ran:
+                    raise FailedRunError('run %d did not go ahead, its output already exists' % i)
+                pending = self._record_complete(job, pending + [i])
+            job.exp.wait_for_postprocessing()
+            pending = self._record_complete(job, pending)
+            if pending:
+                raise FailedRunError('runs %s finished but were not marked complete' % pending)
+        except Exception as e:
+            # any error stops this chain only, the other jobs carry on
+            job.status = 'failed'
+            job.error = '%s: %s' % (type(e).__name__, e)
+            self.log.exception('%s failed: %s' % (job.name, job.error))
+            self.save_state()
+            self.emit('job:failed', self, job, e)
+            return
+        job.status = 'complete'
+        self.save_state()
+        self.emit('job:complete', self, job)
+
+    def run(self, resume=True):
+        """Run all scheduled experiments, blocking until they have finished.
+
+        A failure in one experiment stops that experiment's chain only.
+        Returns a dict of experiment name -> final status."""
+        if resume:
+            self.load_state()
+        threads = []
+        for job in self.jobs:
+            t = threading.Thread(target=self._run_job, args=(job,), name=job.name)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        failed = [job.name for job in self.jobs if job.status == 'failed']
+        if failed:
+            self.log.warning('%d of %d experiments failed: %s' % (len(failed), len(self.jobs), ', '.join(failed)))
+        return {job.name: job.status for job in self.jobs}
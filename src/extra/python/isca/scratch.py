@@ -0,0 +1,75 @@
+"""Run the model in a directory on node-local storage.
+
+`GFDL_WORK` is usually on a shared parallel filesystem.  By default the
+model writes its output and restarts there and they are then copied a
+second time to `GFDL_DATA`.  With local scratch enabled the run directory
+is placed on node-local disk or tmpfs instead: input files are staged in,
+the model writes locally, and the output is drained to `GFDL_DATA` in the
+background, each file verified against a SHA-256 checksum of the local copy.
+
+    exp.enable_local_scratch('/dev/shm', min_free_gb=4)
+    exp.run(1)
+
+Before each run the free space in the scratch directory is checked; if it
+is below `min_free_gb` the run falls back to the usual run directory in
+`GFDL_WORK`.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+from isca.inputcache import sha256_file
+
+
+def copy_verified(src, dst, blocksize=1 << 20):
+    """Copy `src` to `dst`, checking that the data written matches the
+    checksum of the data read.  `dst` only appears once it is verified.
+    Returns the SHA-256 hex digest."""
+    h = hashlib.sha256()
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.' + os.path.basename(dst))
+    try:
+        with open(src, 'rb') as fin, os.fdopen(fd, 'wb') as fout:
+            for block in iter(lambda: fin.read(blocksize), b''):
+                h.update(block)
+                fout.write(block)
+            fout.flush()
+            os.fsync(fout.fileno())
+        digest = h.hexdigest()
+        if sha256_file(tmpfile) != digest:
+            raise IOError('Checksum mismatch copying %s to %s' % (src, dst))
+        shutil.copystat(src, tmpfile)
+        os.replace(tmpfile, dst)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    return digest
+
+
+class LocalScratch(Logger):
+    """Node-local storage for experiment run directories.
+
+    scratchdir: the local directory, default $TMPDIR or /tmp.
+    min_free_gb: the free space needed to start a run in scratch.
+    """
+
+    def __init__(self, scratchdir=None, min_free_gb=5.0):
+        self.scratchdir = scratchdir or os.environ.get('TMPDIR', '/tmp')
+        self.min_free_gb = min_free_gb
+
+    def workdir(self, exp):
+        return P(self.scratchdir, 'isca', exp.name)
+
+    def free_gb(self):
+        mkdir(self.scratchdir)
+        return shutil.disk_usage(self.scratchdir).free / 1e9
+
+    def has_space(self):
+        free = self.free_gb()
+        if free < self.min_free_gb:
+            self.log.warning('Only %.1f GB free in %s, %.1f GB needed' % (free, self.scratchdir, self.min_free_gb))
+            return False
+        return True
@@ -0,0 +1,183 @@
+"""Throughput metrics from the progress records the model prints to stdout.
+
+With `json_logging = .true.` in `spectral_dynamics_nml` the model prints a
+JSON record at the end of every model day, either
+
+    {"day": 12, "second": 0, "max_speed": 4.1E+01, "avg_T": 2.6E+02}
+
+without a calendar or
+
+    {"date": "0001-01-12", "time": "00:00:00", "max_speed": 41.0, "avg_T": 260.0}
+
+with one.  `Telemetry` parses these records as the output arrives, stores
+them in a compact columnar buffer together with the wall clock time they
+were received, and computes the model throughput:
+
+    exp.enable_telemetry()
+    exp.run(1)
+    exp.telemetry.sypd           # simulated years per wall clock day
+
+At the end of each successful run a summary and the buffered columns are
+written to `telemetry.json` in the run's output directory.  Use
+`telemetry_summary(exp.datadir)` to compare throughput across runs.
+"""
+from array import array
+import datetime
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from isca.loghandler import Logger
+from isca import calendars
+
+COLUMNS = ('wall_time', 'model_day', 'max_speed', 'avg_T')
+
+
+def _model_day(record, calendar):
+    """Model time of a record in days, or None if it has no time."""
+    if 'day' in record:
+        return record['day'] + record.get('second', 0) / 86400.0
+    if 'date' in record:
+        year, month, day = (int(x) for x in record['date'].split('-'))
+        hour, minute, second = (int(x) for x in record.get('time', '0:0:0').split(':'))
+        try:
+            days = float(calendars.date_to_day_number(year, month, day, calendar))
+        except ValueError:
+            days = float(datetime.date(year, month, day).toordinal() - 1)
+        return days + (hour*3600 + minute*60 + second) / 86400.0
+    return None
+
+
+class Telemetry(Logger):
+    """Columnar buffer of the JSON progress records of the current run.
+
+    `window` is the number of most recent records the live throughput is
+    measured over."""
+
+    def __init__(self, window=10):
+        self.window = window
+        self.start()
+
+    def start(self, run=None, calendar=None):
+        """Clear the buffer at the start of a run.  `calendar` is the
+        `main_nml` calendar, used to convert dates to days and to set the
+        length of a simulated year."""
+        self.run = run
+        self.calendar = calendar
+        try:
+            self.days_per_year = calendars.days_per_year(calendar)
+        except ValueError:
+            # no_calendar runs use 360 day years, as does util.exp_progress
+            self.days_per_year = 365.25 if str(calendar).lower() == 'gregorian' else 360.
+        self.start_time = time.time()
+        self.end_time = None
+        self.columns = {name: array('d') for name in COLUMNS}
+
+    def parse(self, line):
+        """Add `line` to the buffer if it is a progress record.
+        Returns the parsed record, or None for any other output."""
+        # cheap test first: most lines are not JSON
+        stripped = line.lstrip()
+        if not stripped.startswith('{'):
+            return None
+        try:
+            record = json.loads(stripped)
+        except ValueError:
+            return None
+        model_day = _model_day(record, self.calendar)
+        if model_day is None:
+            return None
+        cols = self.columns
+        cols['wall_time'].append(time.time() - self.start_time)
+        cols['model_day'].append(model_day)
+        cols['max_speed'].append(float(record.get('max_speed', np.nan)))
+        cols['avg_T'].append(float(record.get('avg_T', np.nan)))
+        return record
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def __len__(self):
+        return len(self.columns['model_day'])
+
+    def as_arrays(self):
+        return {name: np.frombuffer(col, dtype=np.float64) if len(col) else np.zeros(0)
+                for name, col in self.columns.items()}
+
+    def _rate(self, first):
+        wall, days = self.columns['wall_time'], self.columns['model_day']
+        if len(days) - first < 2 or wall[-1] <= wall[first]:
+            return np.nan
+        return (days[-1] - days[first]) / (wall[-1] - wall[first])
+
+    @property
+    def model_days_per_second(self):
+        """Throughput over the run so far, excluding model start up."""
+        return self._rate(0)
+
+    @property
+    def current_model_days_per_second(self):
+        """Throughput over the last `window` records."""
+        return self._rate(max(0, len(self) - self.window))
+
+    @property
+    def sypd(self):
+        """Simulated years per wall clock day."""
+        return self.model_days_per_second * 86400. / self.days_per_year
+
+    @property
+    def current_sypd(self):
+        return self.current_model_days_per_second * 86400. / self.days_per_year
+
+    def summary(self):
+        wall = self.columns['wall_time']
+        days = self.columns['model_day']
+        end = self.end_time or time.time()
+
+        def _value(x):
+            return None if np.isnan(x) else x
+
+        return {
+            'run': self.run,
+            'calendar': self.calendar,
+            'records': len(self),
+            'wall_time': end - self.start_time,
+            'startup_time': wall[0] if len(wall) else None,
+            'model_days': (days[-1] - days[0]) if len(days) > 1 else 0.,
+            'model_days_per_second': _value(self.model_days_per_second),
+            'sypd': _value(self.sypd),
+        }
+
+    def save(self, filename):
+        """Write the summary and buffered columns to `filename` as JSON."""
+        data = self.summary()
+        data['columns'] = {name: col.tolist() for name, col in self.columns.items()}
+        with open(filename, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        self.log.debug('Telemetry written to %s' % filename)
+
+
+def load_telemetry(filename):
+    """Read a telemetry.json file, with the columns as numpy arrays."""
+    with open(filename) as f:
+        data = json.load(f)
+    data['columns'] = {name: np.array(col) for name, col in data['columns'].items()}
+    return data
+
+
+def telemetry_summary(datadir):
+    """Collect the telemetry summaries of every run in an experiment's data
+    directory into a pandas DataFrame indexed by run number."""
+    import pandas as pd
+    rows = []
+    for filename in glob.glob(os.path.join(datadir, 'run*', 'telemetry.json')):
+        with open(filename) as f:
+            data = json.load(f)
+        data.pop('columns', None)
+        rows.append(data)
+    if not rows:
+        return pd.DataFrame(columns=['run'])
+    return pd.DataFrame(rows).set_index('run').sort_index()
@@ -64,7 +64,7 @@ $mkmf  -a $sourcedir -t $template -p $executable -c "$cppDefs" $pathnames $sourc
 
 fi
 
-make
+make {{ make_opts }}
 
 # $mkmf $make_flags -a $source_dir  -p fms_moist.x -t   $template \
 #     -c "-Duse_libMPI -Duse_netCDF -Duse_LARGEFILE -DINTERNAL_FILE_NML -DOVERLOAD_C8" $pathnames $sourcedir/shared/mpp/include $sourcedir/shared/constants $sourcedir/include
@@ -76,7 +76,7 @@ if [ $? != 0 ]; then
 fi
 
 # --- execute make ---
-make $executable
+make {{ make_opts }} $executable
 if [ $? != 0 ]; then
     echo "ERROR: make failed for $executable"
     exit 1
@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+# Batch job for {{ name }}
+{% for directive in directives -%}
+{{ directive }}
+{% endfor %}
+{% for line in setup -%}
+{{ line }}
+{% endfor %}
+cd {{ jobdir }}
+
+{{ python }} -m isca.jobs {{ specfile }} {{ task_index }}
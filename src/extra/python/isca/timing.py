@@ -0,0 +1,128 @@
+"""Wall time, data volume and core-hours for each phase of a run.
+
+Every `Experiment` has a `PhaseTimer` at `exp.timer`.  Each phase of
+`run()` (setting up the run directory, extracting the restart, running the
+model, combining output, archiving the restart, ...) is timed in a span:
+
+    with self.timer.span('model', run=i, cores=num_cores) as span:
+        ...
+        span['bytes'] = path_size(outputs)
+
+A 'phase:start' and a 'phase:end' event are emitted by the experiment for
+each span, with the span record as the argument, so the timings can be
+streamed elsewhere.  The records are aggregated by phase with
+
+    exp.timer.report()
+    exp.timer.to_csv('timings.csv')
+    exp.timer.to_json('timings.json', raw=True)
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import csv
+import json
+import os
+import threading
+import time
+
+from isca.loghandler import Logger
+
+RECORD_FIELDS = ('run', 'phase', 'start', 'wall_time', 'bytes', 'cores', 'core_hours', 'status')
+REPORT_FIELDS = ('phase', 'count', 'wall_time', 'mean_wall_time', 'bytes', 'core_hours', 'failed')
+
+
+def path_size(*paths):
+    """Total size in bytes of the given files and directories."""
+    total = 0
+    for path in paths:
+        if path is None or not os.path.exists(path):
+            continue
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    try:
+                        total += os.lstat(os.path.join(root, f)).st_size
+                    except OSError:
+                        pass
+        else:
+            total += os.path.getsize(path)
+    return total
+
+
+class PhaseTimer(Logger):
+    """Collects timed spans, emitting events through `emitter`
+    (usually the experiment)."""
+
+    def __init__(self, emitter=None):
+        self.emitter = emitter
+        self.records = []
+        self._lock = threading.Lock()
+
+    def _emit(self, event, record):
+        if self.emitter is not None:
+            self.emitter.emit(event, self.emitter, record)
+
+    @contextmanager
+    def span(self, phase, run=None, cores=1):
+        """Time the enclosed block as `phase`.  Yields the record, a dict to
+        which the block can add the number of `bytes` it moved."""
+        record = {'run': run, 'phase': phase, 'start': time.time(), 'wall_time': None,
+                  'bytes': 0, 'cores': cores, 'core_hours': None, 'status': 'running'}
+        self._emit('phase:start', record)
+        start = time.perf_counter()
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['wall_time'] = time.perf_counter() - start
+            record['core_hours'] = record['wall_time'] * record['cores'] / 3600.
+            with self._lock:
+                self.records.append(record)
+            self.log.debug('%s (run %s) took %.2fs' % (phase, run, record['wall_time']))
+            self._emit('phase:end', record)
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def report(self, runs=None):
+        """Totals for each phase, in the order the phases first ran.
+        If `runs` is given, only those runs are included."""
+        totals = OrderedDict()
+        with self._lock:
+            records = list(self.records)
+        for r in records:
+            if runs is not None and r['run'] not in runs:
+                continue
+            t = totals.setdefault(r['phase'], {'phase': r['phase'], 'count': 0, 'wall_time': 0.,
+                                               'bytes': 0, 'core_hours': 0., 'failed': 0})
+            t['count'] += 1
+            t['wall_time'] += r['wall_time']
+            t['bytes'] += r['bytes']
+            t['core_hours'] += r['core_hours']
+            t['failed'] += r['status'] == 'failed'
+        for t in totals.values():
+            t['mean_wall_time'] = t['wall_time'] / t['count']
+        return list(totals.values())
+
+    def format_report(self, runs=None):
+        lines = ['%-18s %6s %12s %12s %12s %12s' % ('phase', 'count', 'wall (s)', 'mean (s)', 'MB', 'core-hours')]
+        for t in self.report(runs):
+            lines.append('%-18s %6d %12.2f %12.2f %12.1f %12.3f' % (t['phase'], t['count'], t['wall_time'],
+                                                                 t['mean_wall_time'], t['bytes']/1e6, t['core_hours']))
+        return '\n'.join(lines)
+
+    def to_json(self, filename, raw=False):
+        """Write the report, or every span record if `raw` is True, as JSON."""
+        with open(filename, 'w') as f:
+            json.dump(list(self.records) if raw else self.report(), f, indent=1)
+
+    def to_csv(self, filename, raw=False):
+        """Write the report, or every span record if `raw` is True, as CSV."""
+        fields, rows = (RECORD_FIELDS, list(self.records)) if raw else (REPORT_FIELDS, self.report())
+        with open(filename, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
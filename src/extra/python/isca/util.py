@@ -4,7 +4,6 @@ import json
 import logging
 import os
 from os.path import join as P
-import tarfile
 import sys
 
 import numpy as np
@@ -15,6 +14,8 @@ import sh
 from isca import GFDL_BASE
 from isca.create_alert import disk_space_alert
 from isca.loghandler import suppress_stdout
+from isca.helpers import mkdir
+from isca.restarts import extract_restart, storage_for_file
 
 @contextmanager
 def no_context(*args, **kwargs):
@@ -131,7 +132,7 @@ def delete_all_restarts(exp, exceptions=None):
 
 
 
-def interpolate_output(infile, outfile, all_fields=True, var_names=[], p_levs = "input"):
+def interpolate_output(infile, outfile, all_fields=True, var_names=[], p_levs = "input", tool="plevel.sh"):
     """Interpolate data from sigma to pressure levels. Includes option to remove original file.
 
     This is a very thin wrapper around the plevel.sh script found in
@@ -150,10 +151,10 @@ def interpolate_output(infile, outfile, all_fields=True, var_names=[], p_levs =
         * A list of integer pascal values
         * "input": Interpolate onto the pfull values in the input file
         * "even": Interpolate onto evenly spaced in Pa levels.
+    tool: "plevel.sh" to use the compiled interpolator, or "python" to use
+        the numpy implementation in `isca.plevel`, which needs no compilation.
     Outputs to outfile.
     """
-    interpolator = sh.Command(P(GFDL_BASE, 'postprocessing', 'plevel_interpolation', 'scripts', 'plevel.sh'))
-
     # Select from pre-chosen pressure levels, or input new ones in hPa in the format below.
     if isinstance(p_levs, str):
         if p_levs.upper() == "INPUT":
@@ -167,6 +168,14 @@ def interpolate_output(infile, outfile, all_fields=True, var_names=[], p_levs =
     else:
         levels = p_levs
 
+    if tool == "python":
+        from isca.plevel import interpolate_to_pressure
+        interpolate_to_pressure(infile, outfile, levels, var_names=var_names, all_fields=all_fields)
+        return
+    elif tool != "plevel.sh":
+        raise ValueError("Unknown interpolation tool '{}'".format(tool))
+
+    interpolator = sh.Command(P(GFDL_BASE, 'postprocessing', 'plevel_interpolation', 'scripts', 'plevel.sh'))
     plev = " ".join("{:.0f}".format(x) for x in reversed(sorted(levels)))
     if all_fields:
         interpolator = interpolator.bake('-a')
@@ -177,18 +186,18 @@ def interpolate_output(infile, outfile, all_fields=True, var_names=[], p_levs =
 
 @contextmanager
 def edit_restart_archive(restart_archive, outfile='./res_edit.tar.gz', tmp_dir='./restart_edit'):
-    with tarfile.open(restart_archive, 'r:gz') as tar:
-        tar.extractall(path=tmp_dir)
-        restart_files = [os.path.join(tmp_dir, x.split('/')[-1]) for x in  tar.getnames() if x != '.']
+    """Extract a restart archive of any format for editing and write the edited files
+    to `outfile`.  The format of `outfile` is chosen from its suffix, see `isca.restarts`."""
+    mkdir(tmp_dir)
+    restart_files = [os.path.join(tmp_dir, x) for x in extract_restart(restart_archive, tmp_dir)]
     try:
         yield {os.path.basename(f): f for f in restart_files}
         if outfile is not None:
-            with tarfile.open(outfile, 'w:gz') as out:
-                for f in restart_files:
-                    out.add(f, arcname=os.path.basename(f))
+            storage_for_file(outfile).save(outfile, tmp_dir)
     finally:
         for f in restart_files:
-            os.remove(f)
+            if os.path.exists(f):
+                os.remove(f)
         os.removedirs(tmp_dir)
 
 
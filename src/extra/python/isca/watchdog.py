@@ -0,0 +1,129 @@
+"""Stop runs that have gone numerically unstable.
+
+With `json_logging` turned on the spectral core prints the maximum wind
+speed and the global mean lowest level temperature every model day.  The
+watchdog checks each of these records and kills the model as soon as a
+value is NaN or outside the configured limits, instead of letting an
+unstable run carry on until it crashes or finishes with garbage.
+
+    exp.enable_watchdog(max_speed=250., retries=2)
+    exp.run(1)
+
+With `retries` the run is then repeated from the same restart with
+`dt_atmos` reduced by `dt_factor`, up to `retries` times, by both `run`
+and `run_chain` (and so also by jobs, see `isca.jobs`).  The smaller
+timestep is kept for the following runs.  Each decision is recorded in
+`<datadir>/watchdog.json`; when no retries are left `BlowUpError` (a
+`FailedRunError`) is raised.
+"""
+import json
+import math
+import os
+import tempfile
+import time
+
+from isca.loghandler import Logger
+from isca.helpers import mkdir, P
+
+
+class Watchdog(Logger):
+    """Check the JSON progress records of a run against limits.
+
+    max_speed: the maximum wind speed, m/s.
+    min_temperature, max_temperature: limits on the global mean temperature, K.
+    limits: other limits as {field: (minimum, maximum)}, either may be None.
+    retries: the number of times to retry a run that blew up.
+    dt_factor: the factor the timestep is reduced by for each retry.
+    min_dt: the smallest timestep to retry with, s.
+    """
+
+    def __init__(self, max_speed=250., min_temperature=None, max_temperature=None, limits=None,
+                 retries=0, dt_factor=0.5, min_dt=60):
+        self.limits = dict(limits or {})
+        if max_speed is not None:
+            self.limits['max_speed'] = (None, max_speed)
+        if min_temperature is not None or max_temperature is not None:
+            self.limits['avg_T'] = (min_temperature, max_temperature)
+        self.retries = retries
+        self.dt_factor = dt_factor
+        self.min_dt = min_dt
+        self.attempts = {}
+        self.decisions = []
+        self.start(None)
+
+    def start(self, run):
+        self.run = run
+        self.reason = None
+        self.last_record = None
+
+    def check_record(self, record):
+        """The reason `record` shows the run has blown up, or None."""
+        for field, value in record.items():
+            if isinstance(value, float) and math.isnan(value):
+                return '%s is NaN' % field
+        for field, (lo, hi) in self.limits.items():
+            value = record.get(field)
+            if not isinstance(value, (int, float)):
+                continue
+            if math.isinf(value) or (hi is not None and value > hi) or (lo is not None and value < lo):
+                return '%s=%g outside limits (%s, %s)' % (field, value, lo, hi)
+        return None
+
+    def check_line(self, line):
+        """The reason a line of model output shows the run has blown up, or None."""
+        stripped = line.lstrip()
+        if not stripped.startswith('{'):
+            return None
+        try:
+            record = json.loads(stripped)
+        except ValueError:
+            # fixed width fields overflow to asterisks
+            if '"max_speed"' in stripped and '*' in stripped:
+                return 'progress record overflowed: %s' % stripped.strip()
+            return None
+        self.last_record = record
+        return self.check_record(record)
+
+    def check_output(self, exp, line):
+        """Check a line of the output of `exp`, killing the run if it has
+        blown up.  Returns the reason, or None."""
+        if self.reason is not None:
+            return self.reason
+        reason = self.check_line(line)
+        if reason is not None:
+            self.reason = reason
+            self.log.error('Run %s has blown up (%s), killing it' % (self.run, reason))
+            exp.kill_run()
+        return reason
+
+    def next_timestep(self, run, dt):
+        """The timestep to retry `run` with, or None if no more retries.
+        The timestep is kept a whole number of seconds that divides a day."""
+        attempts = self.attempts.get(run, 0)
+        if dt is None or attempts >= self.retries:
+            return None
+        new_dt = int(dt * self.dt_factor)
+        while new_dt > 0 and 86400 % new_dt:
+            new_dt -= 1
+        if new_dt < max(self.min_dt or 1, 1) or new_dt >= dt:
+            return None
+        self.attempts[run] = attempts + 1
+        return new_dt
+
+    def record(self, exp, run, reason, dt, new_dt):
+        """Record the decision taken for a run that blew up."""
+        decision = {'run': run, 'time': time.time(), 'reason': reason, 'last_record': self.last_record,
+                    'dt_atmos': dt, 'new_dt_atmos': new_dt, 'action': 'retry' if new_dt else 'fail'}
+        self.decisions.append(decision)
+        filename = P(exp.datadir, 'watchdog.json')
+        decisions = []
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                decisions = json.load(f)
+        decisions.append(decision)
+        mkdir(exp.datadir)
+        fd, tmpfile = tempfile.mkstemp(dir=exp.datadir, prefix='.watchdog')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(decisions, f, indent=1)
+        os.replace(tmpfile, filename)
+        return decision
@@ -0,0 +1,53 @@
+"""Compare cftime + FakeDT with isca.calendars for building calendar coordinates.
+
+Usage:
+    python benchmark_calendar.py [years] [steps_per_day]
+
+Times are generated for `years` years (default 50) of output at
+`steps_per_day` (default 4, i.e. 6-hourly) and converted to year, month,
+day, day of year, season and sequential season indices with both methods,
+for each calendar.  The results are checked to be identical.
+"""
+import sys
+import time
+
+import cftime
+import numpy as np
+
+from cmip_time import FakeDT
+from isca import calendars
+
+UNITS = 'days since 0001-01-01 00:00:00'
+
+
+def old_path(times, calendar):
+    dates = FakeDT(cftime.num2date(times, UNITS, calendar=calendar), units=UNITS, calendar=calendar)
+    seasons = np.zeros(len(times))
+    for season, months in enumerate(((12, 1, 2), (3, 4, 5), (6, 7, 8), (9, 10, 11))):
+        seasons[np.isin(dates.month, months)] = season
+    seq = np.zeros_like(seasons)
+    for t in range(1, len(seq)):
+        seq[t] = seq[t-1] + (seasons[t] != seasons[t-1])
+    return dates.year, dates.month, dates.day, dates.dayofyear, seasons, seq
+
+
+def new_path(times, calendar):
+    dates = calendars.day_number_to_date(times, UNITS, calendar)
+    seasons = dates.season
+    return dates.year, dates.month, dates.day, dates.dayofyear, seasons, calendars.recurring_to_sequential(seasons)
+
+
+if __name__ == '__main__':
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    steps_per_day = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print('%-10s %10s %12s %12s %10s' % ('calendar', 'steps', 'cftime (s)', 'numpy (s)', 'identical'))
+    for calendar, year_length in (('360_day', 360), ('noleap', 365), ('julian', 365.25)):
+        times = np.arange(int(years*year_length*steps_per_day)) / float(steps_per_day)
+        start = time.time()
+        old = old_path(times, calendar)
+        old_time = time.time() - start
+        start = time.time()
+        new = new_path(times, calendar)
+        new_time = time.time() - start
+        identical = all(np.array_equal(a, b) for a, b in zip(old, new))
+        print('%-10s %10d %12.3f %12.4f %10s' % (calendar, len(times), old_time, new_time, identical))
@@ -0,0 +1,69 @@
+"""Compare the speed of mppnccombine.x and isca.combine on a set of fragments.
+
+Usage:
+    python benchmark_combine.py /path/to/run/atmos_daily.nc [/path/to/run/atmos_monthly.nc ...]
+
+Each argument is the base name of a set of `.NNNN` fragments left in a run
+directory (e.g. from an experiment run with `save_run=True`).  The fragments
+are copied to a temporary directory and combined with each tool in turn.
+The combined files from both tools are checked to hold identical data.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import sh
+from netCDF4 import Dataset
+
+from isca import GFDL_BASE
+from isca.combine import find_fragments, combine_files
+
+P = os.path.join
+
+
+def stage(filebases, tmpdir):
+    staged = []
+    for filebase in filebases:
+        for fragment in find_fragments(filebase):
+            shutil.copy(fragment, tmpdir)
+        staged.append(P(tmpdir, os.path.basename(filebase)))
+    return staged
+
+
+def run_mppnccombine(filebases):
+    combinetool = sh.Command(P(GFDL_BASE, 'postprocessing', 'mppnccombine.x'))
+    for filebase in filebases:
+        combinetool(filebase)
+
+
+def run_python(filebases):
+    combine_files(filebases)
+
+
+def same_data(file1, file2):
+    with Dataset(file1) as a, Dataset(file2) as b:
+        for name in a.variables:
+            if not np.array_equal(a.variables[name][:], b.variables[name][:]):
+                print('  %s differs' % name)
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    filebases = sys.argv[1:]
+    results = {}
+    for name, fn in (('mppnccombine', run_mppnccombine), ('python', run_python)):
+        tmpdir = tempfile.mkdtemp(prefix='combine_%s_' % name)
+        staged = stage(filebases, tmpdir)
+        start = time.time()
+        fn(staged)
+        results[name] = (time.time() - start, staged)
+        print('%-14s %8.2f s' % (name, results[name][0]))
+
+    identical = all(same_data(a, b) for a, b in zip(results['mppnccombine'][1], results['python'][1]))
+    print('Outputs identical: %s' % identical)
+    for _, staged in results.values():
+        shutil.rmtree(os.path.dirname(staged[0]))
@@ -0,0 +1,61 @@
+"""Compare plevel.sh and isca.plevel on model output files.
+
+Usage:
+    python benchmark_plevel.py $GFDL_DATA/my_exp/run0001/atmos_monthly.nc [...]
+
+Each file is interpolated to the standard "even" pressure levels with both
+tools, along with `slp` and `height`.  The time taken is reported and the
+largest difference between the two outputs is printed for every field.
+plevel.sh must have been compiled, see `postprocessing/plevel_interpolation/README`.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from netCDF4 import Dataset
+
+from isca.plevel import interpolate_files
+from isca.util import interpolate_output
+
+P = os.path.join
+
+LEVELS = [100000, 95000, 90000, 85000, 80000, 75000, 70000, 65000, 60000, 55000,
+          50000, 45000, 40000, 35000, 30000, 25000, 20000, 15000, 10000, 5000]
+DERIVED = ['slp', 'hght']
+
+
+def max_differences(file1, file2):
+    with Dataset(file1) as a, Dataset(file2) as b:
+        for name, var in a.variables.items():
+            if name not in b.variables or var.ndim < 3:
+                continue
+            x, y = var[:], b.variables[name][:]
+            if not np.array_equal(np.ma.getmaskarray(x), np.ma.getmaskarray(y)):
+                print('  %-12s masks differ' % name)
+            diff = np.ma.abs(x.astype(np.float64) - y.astype(np.float64))
+            scale = np.ma.abs(x).max() or 1.
+            print('  %-12s max abs diff %10.3g  (relative %8.2g)' % (name, diff.max(), diff.max()/scale))
+
+
+if __name__ == '__main__':
+    infiles = sys.argv[1:]
+    tmpdir = tempfile.mkdtemp(prefix='plevel_benchmark_')
+    fortran = [P(tmpdir, 'fortran_%d.nc' % i) for i in range(len(infiles))]
+    python = [P(tmpdir, 'python_%d.nc' % i) for i in range(len(infiles))]
+
+    start = time.time()
+    for infile, outfile in zip(infiles, fortran):
+        interpolate_output(infile, outfile, var_names=DERIVED, p_levs=LEVELS)
+    print('%-10s %8.2f s' % ('plevel.sh', time.time() - start))
+
+    start = time.time()
+    interpolate_files(zip(infiles, python), LEVELS, var_names=DERIVED)
+    print('%-10s %8.2f s' % ('python', time.time() - start))
+
+    for infile, f, p in zip(infiles, fortran, python):
+        print(infile)
+        max_differences(f, p)
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,58 @@
+"""Compare the restart storage formats in isca.restarts on a real restart archive.
+
+Usage:
+    python benchmark_restart_storage.py $GFDL_DATA/my_exp/restarts/res0012.tar.gz
+
+For each storage format the restart files are written and read back, and
+the time taken and size on disk are reported.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from isca.restarts import RESTART_STORAGE, extract_restart
+
+P = os.path.join
+
+
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(P(path, f)) for f in os.listdir(path))
+
+
+if __name__ == '__main__':
+    restart_archive = sys.argv[1]
+    tmpdir = tempfile.mkdtemp(prefix='restart_benchmark_')
+    source = P(tmpdir, 'source')
+    os.mkdir(source)
+    extract_restart(restart_archive, source)
+    print('%d restart files, %.1f MB uncompressed\n' % (len(os.listdir(source)), disk_size(source)/1e6))
+
+    print('%-10s %-10s %10s %10s %10s' % ('storage', 'codec', 'write (s)', 'read (s)', 'size (MB)'))
+    for name, cls in RESTART_STORAGE.items():
+        storage = cls()
+        resdir = P(tmpdir, 'RESTART')
+        shutil.copytree(source, resdir)
+        archive = P(tmpdir, 'res0001' + storage.suffix)
+
+        start = time.time()
+        storage.save(archive, resdir)
+        write_time = time.time() - start
+
+        indir = P(tmpdir, 'INPUT')
+        os.mkdir(indir)
+        start = time.time()
+        extract_restart(archive, indir)
+        read_time = time.time() - start
+
+        print('%-10s %-10s %10.2f %10.2f %10.1f' % (name, getattr(storage, 'codec', '-'),
+                                                   write_time, read_time, disk_size(archive)/1e6))
+        for path in (resdir, indir, archive):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    shutil.rmtree(tmpdir)
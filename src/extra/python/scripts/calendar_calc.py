@@ -4,6 +4,8 @@ from cmip_time import FakeDT
 import numpy as np
 import pdb
 
+from isca import calendars
+
 __author__='Stephen Thomson'
 
 def day_number_to_datetime_array(time_in, calendar_type, units_in):
@@ -22,7 +24,14 @@ def day_number_to_date(time_in, calendar_type = '360_day', units_in = 'days sinc
     normal datetime objects, so Mike's FakeDT does this for you. First step is to turn input times
     into an array of datetime objects, and then FakeDT makes the array have the attributes of the
     elements themselves.
+
+    For the calendars in isca.calendars the attributes are computed directly from the time
+    array instead, which is much faster.
     """
+    try:
+        return calendars.day_number_to_date(time_in, units_in, calendar_type)
+    except ValueError:
+        pass
 
     time_in = day_number_to_datetime_array(time_in, calendar_type, units_in)
 
@@ -33,50 +42,18 @@ def day_number_to_date(time_in, calendar_type = '360_day', units_in = 'days sinc
 
 def month_to_season(months_in, avg_or_daily):
 
-    seasons=np.zeros(len(months_in))
-    idx_djf=(months_in==1)|(months_in==2)|(months_in==12)    
-    idx_mam=(months_in==3)|(months_in==4)|(months_in==5)
-    idx_jja=(months_in==6)|(months_in==7)|(months_in==8)
-    idx_son=(months_in==9)|(months_in==10)|(months_in==11)
-
-    seasons[idx_djf]=0
-    seasons[idx_mam]=1
-    seasons[idx_jja]=2
-    seasons[idx_son]=3
-
-    return seasons
+    # float indices, as these functions have always returned
+    return calendars.month_to_season(months_in).astype(float)
 
 
 def month_to_two_months(months_in, avg_or_daily):
 
-    two_months=np.zeros(len(months_in))
-    idx_jf=(months_in==1)|(months_in==2)
-    idx_ma=(months_in==3)|(months_in==4)
-    idx_mj=(months_in==5)|(months_in==6)
-    idx_ja=(months_in==7)|(months_in==8)
-    idx_so=(months_in==9)|(months_in==10)
-    idx_nd=(months_in==11)|(months_in==12)
-        
-    two_months[idx_jf]=0
-    two_months[idx_ma]=1
-    two_months[idx_mj]=2
-    two_months[idx_ja]=3
-    two_months[idx_so]=4
-    two_months[idx_nd]=5    
-
-    return two_months
+    return calendars.month_to_two_months(months_in).astype(float)
 
 def recurring_to_sequential(time_in):
 
-    seq_time=np.zeros_like(time_in)
-
-    for time in np.arange(len(seq_time)-1)+1:        
-        if time_in[time]!=time_in[time-1]:
-            seq_time[time]=seq_time[time-1]+1
-        else:
-            seq_time[time]=seq_time[time-1]
-
-    return seq_time
+    # the same type as the input
+    return calendars.recurring_to_sequential(time_in).astype(np.asarray(time_in).dtype)
         
 
 
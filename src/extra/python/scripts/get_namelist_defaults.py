@@ -3,7 +3,12 @@ Recursively scans the argument directory for f90 files with `namelist`
 declarations.
 
 The default values of those are then found from the surrounding file and
-all compiled and written to output `defaults.nml`.
+all compiled and written to output `defaults.nml`.  The scan is cached by
+`isca.nmlindex.NamelistIndex` in `defaults.nml.index.json` next to the
+output, so running the script again only rescans files that have changed.
+
+The scan is done by the `isca` package, so like the other scripts using
+it this needs GFDL_BASE, GFDL_WORK and GFDL_DATA to be set.
 
 e.g. Running from this directory on the src tree:
 ````
@@ -24,60 +29,24 @@ $ head -10 defaults.nml
 
 """
 
-import fnmatch
-import mmap
 import os
-import re
 import sys
 
 import f90nml
 
-parsers = (int, f90nml.parser.pybool, f90nml.parser.pyfloat, f90nml.parser.pycomplex, f90nml.parser.pystr)
+from isca.nmlindex import NamelistIndex
 
 base_dir = sys.argv[1]
 
-namelist_defaults = {}
-for root, dirnames, filenames in os.walk(base_dir, followlinks=True):
-        for filename in fnmatch.filter(filenames, '*.[Ff]90') :
-            #print('Searching file %r' % filename)
-            with open(os.path.join(root, filename), 'r+') as f:
-                data = mmap.mmap(f.fileno(), 0)
-                mo = re.search(br'namelist\s*/\s*(\w+)\s*/\s*([\w\s,\&!]+?[^&])\n', data,  re.MULTILINE| re.IGNORECASE)
-                if mo:
-                    sector = mo.group(1).decode()
-                    nml = namelist_defaults.setdefault(sector, {})
-                    #nml['_filename'] = filename
-
-                    # process the list of namelist parameters
-                    params = mo.group(2).replace(b'&', b' ').replace(b'\n', b' ') #.replace(b',', b' ')
-                    params = params.split(b',')
-                    # remove comments and additional whitespace
-                    params = [p.partition(b'!')[0].strip() for p in params if p.strip()]
-                    for p in params:
-                        # search for first reference to parameter in the file
-                        # and get the default value
-
-                        #r = br'(\w+).*::\s*' + p + br'\s*=\s*([\w\d\.]+)'
-                        if p:
-                            r = br'(.*)' + p + br'.*=\s*((?:\(\/[\d\s,+\-.]+\/\))|(?:\'.*\')|(?:\".*\")|[\-+\w\d.]+)'
-                            mp = re.search(r, data, re.IGNORECASE)
-                            if mp:
-                                if '!' in mp.group(1).decode():
-                                    continue
-                                value =  mp.group(2).decode()
-                                for parse in parsers:
-                                    try:
-                                        value = parse(value)
-                                        break
-                                    except:
-                                        continue
-                                nml[p.decode()] = value
-                            else:
-                                nml[p.decode()] = 'UNDEFINED'
+# only files changed since the last run are scanned again
+index = NamelistIndex(base_dir, indexfile=os.path.abspath('defaults.nml.index.json'))
 
+namelist_defaults = {}
+for group, params in sorted(index.groups.items()):
+    namelist_defaults[group] = {param: 'UNDEFINED' if info['default'] is None else info['default']
+                                for param, info in params.items()}
 
-#print(namelist_defaults)
 n = f90nml.Namelist()
 n.update(namelist_defaults)
 n.write('defaults.nml')
-print('defaults.nml written')
\ No newline at end of file
+print('defaults.nml written')
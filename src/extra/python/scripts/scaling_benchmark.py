@@ -0,0 +1,42 @@
+"""Run a strong scaling benchmark of one of the test cases.
+
+Usage:
+    python scaling_benchmark.py $GFDL_BASE/exp/test_cases/held_suarez/held_suarez_test_case.py \
+        --cores 1 2 4 8 16 --resolutions T21 T42 --days 5
+
+Resolutions may be given as e.g. T42 or T42:40 to also set the number of
+levels.  Results are printed and appended to $GFDL_WORK/benchmarks/<name>.csv.
+Pass --compare COMMIT_A COMMIT_B to compare two commits from the results
+file instead of running.
+"""
+import argparse
+
+from isca.benchmark import ScalingBenchmark, load_test_case, compare_results
+
+
+def parse_resolution(value):
+    if ':' in value:
+        res, levels = value.split(':')
+        return res, int(levels)
+    return value, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling benchmark of an Isca test case')
+    parser.add_argument('test_case', help='test case script defining `exp` at module level')
+    parser.add_argument('--cores', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--resolutions', type=parse_resolution, nargs='+', default=[None])
+    parser.add_argument('--days', type=int, default=5, help='model days per benchmark run')
+    parser.add_argument('--name', default=None, help='name to store the results under')
+    parser.add_argument('--compare', nargs=2, metavar=('COMMIT_A', 'COMMIT_B'))
+    args = parser.parse_args()
+
+    exp = load_test_case(args.test_case)
+    bench = ScalingBenchmark(exp, days=args.days, name=args.name)
+    if args.compare:
+        for res, levels, cores, a, b, change in compare_results(bench.resultsfile, *args.compare):
+            print('%-6s %6s %6d %10.2f %10.2f %+8.1f%%' % (res, levels or '-', cores, a, b, 100*change))
+    else:
+        exp.codebase.compile()
+        bench.strong(args.cores, args.resolutions)
+        print(bench.format_results())
@@ -0,0 +1,33 @@
+import pytest
+
+from isca import Experiment
+
+COMMIT = '1a2b3c4d' * 5
+
+
+class FakeCodeBase(object):
+    """A codebase that is never compiled, for experiments that are set up
+    but not run."""
+    name = 'fake'
+    executable_name = 'fake.x'
+
+    def __init__(self, srcdir='/nonexistent'):
+        self.srcdir = srcdir
+
+    def write_source_control_status(self, filename):
+        with open(filename, 'w') as f:
+            f.write('commit %s\n' % COMMIT)
+
+
+@pytest.fixture
+def make_experiment(tmp_path):
+    """Make experiments with their work and data directories in `tmp_path`."""
+    def make(name='exp', codebase=None):
+        return Experiment(name, codebase or FakeCodeBase(), workbase=str(tmp_path / 'work'),
+                          database=str(tmp_path / 'data'))
+    return make
+
+
+@pytest.fixture
+def experiment(make_experiment):
+    return make_experiment()
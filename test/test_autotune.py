@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from isca import Namelist
+from isca.autotune import CoreAutotuner, valid_core_counts, check_core_count, fit_cost_model
+
+
+@pytest.mark.parametrize('lat_max, num_fourier, expected', [
+    (64, 42, [1, 2, 4, 8, 16, 32]),          # T42
+    (128, 85, [1, 2, 4, 8, 16, 32, 64]),     # T85
+    (96, 21, [1, 2, 3, 4, 6, 8, 12, 16]),    # more latitudes than a T21 grid needs
+])
+def test_valid_core_counts(lat_max, num_fourier, expected):
+    assert valid_core_counts(lat_max, num_fourier) == expected
+
+
+def test_valid_core_counts_max_cores():
+    assert valid_core_counts(128, 85, max_cores=20) == [1, 2, 4, 8, 16]
+
+
+def test_check_core_count(experiment):
+    assert check_core_count(experiment, 7)    # no spectral core
+    experiment.namelist = Namelist({'spectral_dynamics_nml': {'lat_max': 128, 'num_fourier': 85}})
+    assert check_core_count(experiment, 64)
+    assert not check_core_count(experiment, 48)
+
+
+def test_fit_cost_model():
+    cores = np.array([1, 2, 4, 8, 16, 32])
+    assert fit_cost_model(cores, 2. + 60./cores + 0.05*cores) == pytest.approx((2., 60., 0.05))
+    # one timing: perfect scaling
+    assert fit_cost_model([4], [10.]) == (0., 40., 0.)
+
+
+@pytest.fixture
+def tuner(experiment, tmp_path):
+    experiment.namelist = Namelist({'spectral_dynamics_nml': {'lat_max': 64, 'num_fourier': 42}})
+    tuner = CoreAutotuner(experiment, cachefile=str(tmp_path / 'autotune' / 'cache.json'))
+    tuner.save_timings({n: 1. + 64./n + 0.1*n for n in (1, 4, 16)})
+    return tuner
+
+
+def test_choose(tuner):
+    assert tuner.timings() == pytest.approx({1: 65.1, 4: 17.4, 16: 6.6})
+    assert tuner.choose(max_cores=64, objective='fastest', probe=False) == 32
+    assert tuner.choose(max_cores=64, objective='core_hours', probe=False) == 1
+    # 16 cores run at 0.62 and 8 cores at 0.83 of the efficiency of one
+    assert tuner.choose(max_cores=64, objective='balanced', min_efficiency=0.7, probe=False) == 8
+    with pytest.raises(ValueError):
+        tuner.choose(max_cores=64, objective='cheapest', probe=False)
+
+
+def test_config_key_ignores_run_length(tuner):
+    key = tuner.config_key()
+    tuner.exp.update_namelist({'main_nml': {'days': 30}})
+    assert tuner.config_key() == key
+    tuner.exp.update_namelist({'main_nml': {'dt_atmos': 600}})
+    assert tuner.config_key() != key
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import cftime
+import numpy as np
+import pytest
+
+from isca import calendars
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'extra', 'python', 'scripts'))
+
+
+@pytest.mark.parametrize('calendar', ['360_day', 'noleap', 'julian'])
+@pytest.mark.parametrize('units', ['days since 0001-01-01 00:00:00', 'hours since 1979-03-01 06:00:00',
+                                   'seconds since 2000-02-29'])
+def test_matches_cftime(calendar, units):
+    if calendar != 'julian':
+        units = units.replace('2000-02-29', '2000-02-28')
+    scale = calendars.parse_units(units)[0]
+    rng = np.random.RandomState(0)
+    # about 300 years, including the first days and whole hours
+    days = np.concatenate([np.arange(0, 800, 0.25), rng.uniform(0, 300 * 366, 2000)])
+    time = np.round(days * 86400 / scale)
+    dates = calendars.day_number_to_date(time, units, calendar)
+    expected = cftime.num2date(time, units, calendar)
+    for attr, cf_attr in [('year', 'year'), ('month', 'month'), ('day', 'day'), ('hour', 'hour'),
+                          ('minute', 'minute'), ('second', 'second'), ('dayofyear', 'dayofyr')]:
+        np.testing.assert_array_equal(getattr(dates, attr), [getattr(d, cf_attr) for d in expected], err_msg=attr)
+
+
+def test_aliases_and_errors():
+    time = np.arange(0, 400, 30.)
+    a = calendars.day_number_to_date(time, calendar='thirty_day_months')
+    b = calendars.day_number_to_date(time, calendar='360_day')
+    np.testing.assert_array_equal(a.month, b.month)
+    with pytest.raises(ValueError):
+        calendars.day_number_to_date(time, calendar='gregorian')
+    with pytest.raises(ValueError):
+        calendars.parse_units('fortnights since 0001-01-01')
+
+
+@pytest.mark.parametrize('calendar', ['360_day', 'noleap', 'julian'])
+def test_date_to_day_number(calendar):
+    days = np.arange(0, 3000, 7)
+    dates = calendars.day_number_to_date(days, 'days since 0001-01-01', calendar)
+    np.testing.assert_array_equal(calendars.date_to_day_number(dates.year, dates.month, dates.day, calendar), days)
+
+
+def test_seasons():
+    months = np.arange(1, 13)
+    np.testing.assert_array_equal(calendars.month_to_season(months), [0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
+    np.testing.assert_array_equal(calendars.month_to_two_months(months), [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5])
+    np.testing.assert_array_equal(calendars.recurring_to_sequential([1, 1, 2, 2, 1]), [0, 0, 1, 1, 2])
+
+
+def test_calendar_calc_types():
+    calendar_calc = pytest.importorskip('calendar_calc')
+    months = np.array([12, 1, 6])
+    seasons = calendar_calc.month_to_season(months, 'avg')
+    assert seasons.dtype == np.float64
+    np.testing.assert_array_equal(seasons, [0., 0., 2.])
+    assert calendar_calc.month_to_two_months(months, 'avg').dtype == np.float64
+    sequential = calendar_calc.recurring_to_sequential(np.array([0., 0., 1.]))
+    assert sequential.dtype == np.float64
+    np.testing.assert_array_equal(sequential, [0., 0., 1.])
+    assert calendar_calc.recurring_to_sequential(np.array([3, 3, 1])).dtype == np.array([3]).dtype
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from isca import Namelist
+from isca.catalog import Catalog, namelist_hash
+
+from conftest import COMMIT
+
+
+@pytest.fixture
+def make_run(make_experiment):
+    """Make experiment `name` with the output of run `i`."""
+    def make(name, i, namelist):
+        exp = make_experiment(name)
+        exp.namelist = namelist
+        outdir = exp.get_outputdir(i)
+        os.makedirs(outdir)
+        with open(os.path.join(outdir, 'atmos_monthly.nc'), 'wb') as f:
+            f.write(b'x' * 100)
+        exp.write_namelist(outdir)
+        exp.codebase.write_source_control_status(os.path.join(outdir, 'git_hash_used.txt'))
+        return exp
+    return make
+
+
+def test_namelist_hash():
+    nml = {'main_nml': {'days': 30, 'dt_atmos': 600},
+           'spectral_dynamics_nml': {'num_fourier': 42, 'valid_range': [100., 800.], 'initial_sphum': [2e-6]}}
+    h = namelist_hash(Namelist(nml))
+    assert namelist_hash(nml) == h
+    # as read back from input.nml
+    assert namelist_hash({'MAIN_NML': {'dt_atmos': 600, 'days': 30},
+                          'spectral_dynamics_nml': {'num_fourier': 42, 'valid_range': [100., 800.],
+                                                    'initial_sphum': 2e-6}}) == h
+    assert namelist_hash({'main_nml': {'days': 31, 'dt_atmos': 600}}) != h
+
+
+def test_run_and_experiment_hashes_agree(tmp_path, make_run):
+    catalog = Catalog(str(tmp_path / 'catalog.sqlite'))
+    namelist = Namelist({'main_nml': {'days': 30, 'dt_atmos': 600},
+                         'spectral_dynamics_nml': {'num_fourier': 21, 'lon_max': 64, 'lat_max': 32,
+                                                   'initial_sphum': [2e-6]}})
+    exp = make_run('exp', 1, namelist)
+    catalog.record_run(exp, 1, num_cores=4)
+    experiment, = catalog.experiments()
+    run, = catalog.runs()
+    assert run['namelist_hash'] == experiment['namelist_hash']
+    assert catalog.runs(namelist_hash=experiment['namelist_hash']) == [run]
+    assert run['resolution'] == experiment['resolution'] == 'T21'
+    assert run['commit_id'] == COMMIT
+    assert run['num_cores'] == 4
+
+
+def test_scan_and_queries(tmp_path, make_run):
+    catalog = Catalog(str(tmp_path / 'catalog.sqlite'))
+    namelist = Namelist({'main_nml': {'days': 30}})
+    for i in (1, 2):
+        make_run('held_suarez', i, namelist)
+    make_run('frierson', 1, namelist)
+    datadir = str(tmp_path / 'data')
+    assert catalog.scan(datadir) == 3
+    assert catalog.scan(datadir) == 0    # unchanged since the last scan
+    assert [e['name'] for e in catalog.experiments(name='held%')] == ['held_suarez']
+    assert len(catalog.runs(commit=COMMIT[:7])) == 3
+    assert [f['name'] for f in catalog.files('frierson', 1, pattern='*.nc')] == ['atmos_monthly.nc']
+    usage = {u['experiment']: u for u in catalog.usage()}
+    assert usage['held_suarez']['runs'] == 2
+    assert usage['held_suarez']['bytes'] == 2 * usage['frierson']['bytes']
+
+    catalog.forget('held_suarez', runs=[2])
+    assert [r['run'] for r in catalog.runs(experiment='held_suarez')] == [1]
+    catalog.forget('held_suarez')
+    assert catalog.runs(experiment='held_suarez') == []
+    assert catalog.files('held_suarez') == []
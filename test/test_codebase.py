@@ -0,0 +1,27 @@
+from isca.codebase import env_mkmf_template
+
+
+def write_env(tmp_path, text):
+    path = tmp_path / 'env'
+    path.write_text(text)
+    return str(path)
+
+
+def test_template_from_env_file(tmp_path, monkeypatch):
+    monkeypatch.setenv('GFDL_MKMF_TEMPLATE', 'inherited')
+    env = write_env(tmp_path, 'echo Loading\n# export GFDL_MKMF_TEMPLATE=commented\n'
+                              'export GFDL_MKMF_TEMPLATE=gfort\nexport F90=mpifort\n')
+    assert env_mkmf_template(env) == 'gfort'
+
+
+def test_last_export_wins(tmp_path):
+    env = write_env(tmp_path, 'export GFDL_MKMF_TEMPLATE="ia64"\nexport GFDL_MKMF_TEMPLATE=dt2  # cluster\n')
+    assert env_mkmf_template(env) == 'dt2'
+
+
+def test_template_inherited_or_default(tmp_path, monkeypatch):
+    env = write_env(tmp_path, 'module load ifort\n')
+    monkeypatch.setenv('GFDL_MKMF_TEMPLATE', 'inherited')
+    assert env_mkmf_template(env) == 'inherited'
+    monkeypatch.delenv('GFDL_MKMF_TEMPLATE')
+    assert env_mkmf_template(env) == 'ia64'
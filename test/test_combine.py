@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from isca.combine import combine_fragments, combine_files, find_fragments
+
+NLAT, NLON, NT = 4, 6, 3
+LAT = np.linspace(-60, 60, NLAT)
+LON = np.arange(NLON) * 60.
+TEMP = np.arange(NT * NLAT * NLON, dtype='f4').reshape(NT, NLAT, NLON)
+
+
+def write_fragments(filebase, lat_blocks=2, lon_blocks=2):
+    """The fields above, split over a lat_blocks x lon_blocks decomposition
+    as FMS writes them."""
+    nfiles = lat_blocks * lon_blocks
+    k = 0
+    for lat in np.array_split(np.arange(NLAT), lat_blocks):
+        for lon in np.array_split(np.arange(NLON), lon_blocks):
+            with Dataset('%s.%04d' % (filebase, k), 'w') as ds:
+                ds.NumFilesInSet = nfiles
+                ds.title = 'test'
+                ds.createDimension('time', None)
+                ds.createDimension('lat', len(lat))
+                ds.createDimension('lon', len(lon))
+                ds.createDimension('nv', 2)
+                v = ds.createVariable('lat', 'f8', ('lat', ))
+                v.domain_decomposition = np.array([1, NLAT, lat[0] + 1, lat[-1] + 1], 'i4')
+                v[:] = LAT[lat]
+                v = ds.createVariable('lon', 'f8', ('lon', ))
+                v.domain_decomposition = np.array([1, NLON, lon[0] + 1, lon[-1] + 1], 'i4')
+                v[:] = LON[lon]
+                ds.createVariable('time', 'f8', ('time', ))[:] = np.arange(NT)
+                ds.createVariable('nv', 'f8', ('nv', ))[:] = [1, 2]
+                v = ds.createVariable('temp', 'f4', ('time', 'lat', 'lon'), fill_value=-1e20)
+                v.units = 'K'
+                v[:] = TEMP[:, lat][:, :, lon]
+            k += 1
+
+
+def check_combined(filename):
+    with Dataset(filename) as ds:
+        assert 'NumFilesInSet' not in ds.ncattrs()
+        assert ds.title == 'test'
+        assert ds.dimensions['time'].isunlimited()
+        np.testing.assert_array_equal(ds.variables['lat'][:], LAT)
+        np.testing.assert_array_equal(ds.variables['lon'][:], LON)
+        np.testing.assert_array_equal(ds.variables['nv'][:], [1, 2])
+        temp = ds.variables['temp']
+        assert temp.units == 'K'
+        assert temp._FillValue == np.float32(-1e20)
+        assert 'domain_decomposition' not in ds.variables['lat'].ncattrs()
+        np.testing.assert_array_equal(temp[:], TEMP)
+
+
+@pytest.mark.parametrize('lat_blocks, lon_blocks', [(1, 1), (2, 1), (2, 3), (4, 1)])
+def test_combine_fragments(tmp_path, lat_blocks, lon_blocks):
+    filebase = str(tmp_path / 'atmos_monthly.nc')
+    write_fragments(filebase, lat_blocks, lon_blocks)
+    assert len(find_fragments(filebase)) == lat_blocks * lon_blocks
+    assert combine_fragments(filebase) == filebase
+    check_combined(filebase)
+
+
+def test_missing_fragment(tmp_path):
+    filebase = str(tmp_path / 'atmos_monthly.nc')
+    write_fragments(filebase)
+    os.remove(filebase + '.0003')
+    with pytest.raises(IOError):
+        combine_fragments(filebase)
+
+
+def test_combine_files(tmp_path):
+    filebases = [str(tmp_path / name) for name in ('atmos_monthly.nc', 'atmos_daily.nc')]
+    for filebase in filebases:
+        write_fragments(filebase)
+    assert combine_files(filebases, processes=2, remove_fragments=True) == filebases
+    for filebase in filebases:
+        check_combined(filebase)
+        assert find_fragments(filebase) == []
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from isca.equilibrium import EquilibriumMonitor, drift, global_mean, GRAVITY
+
+
+def spin_up(i, timescale=20., seasonal=5.):
+    """Monthly global mean surface temperature relaxing to 288 K, with a
+    seasonal cycle and a little noise."""
+    noise = np.random.RandomState(i).normal(scale=0.02)
+    return 288. - 30.*np.exp(-i/timescale) + seasonal*np.sin(2*np.pi*i/12.) + noise
+
+
+def write_output(outdir, t_surf, temp=None):
+    os.makedirs(outdir)
+    with Dataset(os.path.join(outdir, 'atmos_monthly.nc'), 'w') as ds:
+        for name, size in (('time', None), ('pfull', 2), ('phalf', 3), ('lat', 4), ('latb', 5), ('lon', 8)):
+            ds.createDimension(name, size)
+        ds.createVariable('lat', 'f8', ('lat', ))[:] = [-67.5, -22.5, 22.5, 67.5]
+        ds.createVariable('latb', 'f8', ('latb', ))[:] = [-90., -45., 0., 45., 90.]
+        ds.createVariable('pfull', 'f8', ('pfull', ))[:] = [250., 750.]
+        ds.createVariable('phalf', 'f8', ('phalf', ))[:] = [0., 500., 1000.]
+        ds.createVariable('t_surf', 'f4', ('time', 'lat', 'lon'))[:] = t_surf
+        if temp is not None:
+            ds.createVariable('temp', 'f4', ('time', 'pfull', 'lat', 'lon'))[:] = temp
+
+
+def test_drift():
+    # a seasonal cycle does not drift
+    change, slope, blocks = drift(5.*np.sin(2*np.pi*np.arange(1, 37)/12.), period=12)
+    assert len(blocks) == 3
+    assert change == pytest.approx(0., abs=1e-12)
+    change, slope, blocks = drift(np.arange(24.), period=12)
+    assert slope == pytest.approx(12.) and change == pytest.approx(24.)
+    assert np.isnan(drift([1., 2.], period=12)[0])
+
+
+def test_detects_spin_up(tmp_path):
+    monitor = EquilibriumMonitor(str(tmp_path / 'equilibrium.json'), window=36, period=12, tolerance=0.1)
+    spun_up = None
+    for i in range(1, 241):
+        monitor.series['t_surf'][i] = spin_up(i)
+        if monitor.check():
+            spun_up = i
+            break
+    # the drift between the first and last years of the window falls below
+    # 0.1 K about 7 e-folding times in, and the 5 K seasonal cycle is not
+    # mistaken for drift
+    assert 130 < spun_up < 170
+    assert monitor.result['t_surf']['passed']
+    assert abs(monitor.result['t_surf']['drift']) <= 0.1
+    assert 'ok' in monitor.summary()
+
+
+def test_state_is_saved(tmp_path):
+    statefile = str(tmp_path / 'data' / 'equilibrium.json')
+    monitor = EquilibriumMonitor(statefile, window=4, period=2, tolerance=0.5)
+    for i in range(1, 5):
+        write_output(str(tmp_path / ('run%04d' % i)), np.full((1, 4, 8), 280. + 0.1*(i % 2)))
+        monitor.add_output(i, str(tmp_path / ('run%04d' % i)))
+    assert monitor.equilibrated
+    # a gap in the runs starts the window again
+    monitor.series['t_surf'][6] = 280.
+    assert not monitor.check()
+    monitor.save()
+    assert EquilibriumMonitor(statefile, window=4, period=2).series['t_surf'][3] == pytest.approx(280.1)
+
+
+def test_global_mean(tmp_path):
+    t_surf = np.zeros((2, 4, 8))
+    t_surf[:, 1:3] = 1.     # between 45S and 45N
+    temp = np.full((2, 2, 4, 8), 250.)
+    write_output(str(tmp_path / 'run0001'), t_surf, temp)
+    filename = str(tmp_path / 'run0001' / 'atmos_monthly.nc')
+    assert global_mean(filename, 't_surf') == pytest.approx(np.sin(np.pi/4))
+    assert global_mean(filename, 'temp', vertical='mean') == pytest.approx(250.)
+    assert global_mean(filename, 'temp') == pytest.approx(250. * 1e5 / GRAVITY)
+    assert global_mean(filename, 'temp', pressure_range=(500., 1000.)) == pytest.approx(250. * 5e4 / GRAVITY)
+
+
+def test_window_covers_two_periods(tmp_path):
+    with pytest.raises(ValueError):
+        EquilibriumMonitor(str(tmp_path / 'equilibrium.json'), window=12, period=12)
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from isca import DiagTable
+from isca.jobs import first_incomplete_run
+from isca.postprocess import PostProcessingError
+
+
+@pytest.fixture
+def exp(experiment):
+    exp = experiment
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_monthly', 30, 'days')
+    os.makedirs(exp.restartdir)
+    for i in (1, 2):
+        os.makedirs(exp.get_outputdir(i))
+        open(exp.get_restart_file(i), 'w').close()
+    return exp
+
+
+def write_diag_output(exp):
+    os.makedirs(exp.rundir)
+    with open(os.path.join(exp.rundir, 'atmos_monthly.nc'), 'w') as f:
+        f.write('output')
+
+
+def test_output_and_restart_are_not_complete(exp):
+    assert not exp.run_is_complete(1)
+    assert first_incomplete_run(exp, 1, 2) == 1
+    exp.mark_run_complete(1)
+    assert exp.run_is_complete(1)
+    assert first_incomplete_run(exp, 1, 2) == 2
+
+
+def test_complete_after_async_postprocessing(exp):
+    exp.enable_async_postprocessing()
+    write_diag_output(exp)
+    exp.collect_diag_output(1, num_cores=1)
+    exp.wait_for_postprocessing()
+    assert os.path.isfile(os.path.join(exp.get_outputdir(1), 'atmos_monthly.nc'))
+    assert exp.run_is_complete(1)
+
+
+def test_failed_postprocessing_is_not_complete(exp):
+    exp.enable_async_postprocessing()
+    exp.combine_tool = 'python'
+    os.makedirs(exp.rundir)
+    with open(os.path.join(exp.rundir, 'atmos_monthly.nc.0000'), 'w') as f:
+        f.write('not netcdf')    # fails to combine
+    exp.collect_diag_output(1, num_cores=2)
+    with pytest.raises(PostProcessingError):
+        exp.wait_for_postprocessing()
+    assert not exp.run_is_complete(1)
+    assert first_incomplete_run(exp, 1, 2) == 1
+
+
+@pytest.fixture
+def chain_exp(experiment, tmp_path, monkeypatch):
+    """An experiment whose model writes a restart each run and fails in run 2."""
+    exp = experiment
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_monthly', 30, 'days')
+    exp.field_table_file = str(tmp_path / 'field_table')
+    open(exp.field_table_file, 'w').close()
+    exp.enable_local_scratch(str(tmp_path / 'scratch'), min_free_gb=0, async_drain=False)
+
+    def execute(i):
+        if i == 2:
+            raise RuntimeError('model failed in run 2')
+        with open(os.path.join(exp.rundir, 'RESTART', 'coupler.res'), 'w') as f:
+            f.write('run %d' % i)
+        with open(os.path.join(exp.rundir, 'atmos_monthly.nc'), 'w') as f:
+            f.write('output')
+    monkeypatch.setattr(exp, 'write_runscript', lambda *args: None)
+    monkeypatch.setattr(exp, 'execute', execute)
+    return exp
+
+
+def test_failed_chain_archives_restart(chain_exp, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(18, 'Invalid cross-device link')
+    monkeypatch.setattr(os, 'link', cross_device)
+    os.makedirs(os.path.join(chain_exp.workdir, 'chain_restart'))   # left by an earlier failure
+    with pytest.raises(RuntimeError, match='model failed in run 2'):
+        chain_exp.run_chain(1, 3, num_cores=1, use_restart=False)
+    assert chain_exp.rundir.startswith(chain_exp.scratch.scratchdir)
+    assert os.path.exists(chain_exp.get_restart_file(1))
+    assert os.listdir(os.path.dirname(chain_exp.rundir)) == ['run']
+
+
+def test_failed_chain_keeps_model_error(chain_exp, monkeypatch):
+    def failed_archive(archive_file, restart_directory):
+        raise IOError('disk full')
+    monkeypatch.setattr(chain_exp, 'make_restart_archive', failed_archive)
+    with pytest.raises(RuntimeError, match='model failed in run 2'):
+        chain_exp.run_chain(1, 3, num_cores=1, use_restart=False)
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from isca import DiagTable, Namelist
+from isca.iobudget import OutputBudget, run_seconds, model_grid, format_bytes
+
+
+class FakeIndex(object):
+    groups = {'spectral_dynamics_nml': {'num_levels': {'type': 'integer', 'default': 25, 'array': False}}}
+    diag_fields = {'dynamics': {'ps': {'axes': ['lon', 'lat'], 'static': False},
+                                'temp': {'axes': ['lon', 'lat', 'pfull'], 'static': False},
+                                'zsurf': {'axes': ['lon', 'lat'], 'static': True}}}
+
+
+@pytest.fixture
+def exp(experiment):
+    exp = experiment
+    exp.namelist = Namelist({'main_nml': {'days': 30, 'dt_atmos': 600},
+                             'spectral_dynamics_nml': {'lon_max': 64, 'lat_max': 32}})
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_daily', 1, 'days', time_units='days')
+    exp.diag_table.add_file('atmos_monthly', 30, 'days', time_units='days')
+    for name in ('ps', 'temp', 'zsurf'):
+        exp.diag_table.add_field('dynamics', name, files=['atmos_daily'], time_avg=True)
+    exp.diag_table.add_field('dynamics', 'ps', files=['atmos_monthly'], time_avg=True)
+    return exp
+
+
+def test_run_seconds():
+    assert run_seconds({'main_nml': {'days': 30}}) == 30 * 86400
+    assert run_seconds({'main_nml': {'months': 1, 'hours': 12}}) == 30 * 86400 + 12 * 3600
+    assert run_seconds({}) == 0
+
+
+def test_model_grid(exp):
+    assert model_grid(exp) == {'lon': 64, 'lat': 32, 'pfull': 18, 'phalf': 19}
+    assert model_grid(exp, FakeIndex())['pfull'] == 25
+    exp.namelist = Namelist({'shallow_dynamics_nml': {'num_lon': 128, 'num_lat': 64}})
+    assert model_grid(exp) == {'lon': 128, 'lat': 64, 'pfull': 1, 'phalf': 2}
+
+
+def test_records(exp):
+    table = exp.diag_table
+    assert table.records('atmos_daily', 30 * 86400) == 30
+    assert table.records('atmos_monthly', 30 * 86400) == 1
+    table.add_file('atmos_step', 0, 'days')
+    assert table.records('atmos_step', 86400, dt=600) == 144
+    table.add_file('atmos_end', -1, 'days')
+    assert table.records('atmos_end', 86400) == 1
+
+
+def test_estimate(exp):
+    budget = OutputBudget(exp, runs=10, index=FakeIndex(), restart_bytes=1000)
+    daily = budget.files['atmos_daily']
+    assert daily['records'] == 30
+    assert daily['fields'] == {'ps': 64 * 32 * 4 * 30, 'temp': 64 * 32 * 25 * 4 * 30, 'zsurf': 64 * 32 * 4}
+    assert daily['assumed'] == []
+    # the fields dominate, the rest is the axes and time bounds
+    assert 0 < daily['bytes'] - sum(daily['fields'].values()) < 10000
+    assert budget.bytes_per_run == budget.output_bytes + 1000
+    assert budget.total == 10 * budget.bytes_per_run
+
+    budget.free = budget.total * 2
+    assert budget.fits()
+    budget.free = budget.bytes_per_run * 5
+    assert not budget.fits()
+    assert budget.runs_that_fit() == 4
+
+
+def test_unknown_fields_assumed_3d(exp):
+    budget = OutputBudget(exp, runs=1, restart_bytes=0)
+    assert sorted(budget.files['atmos_daily']['assumed']) == ['ps', 'temp', 'zsurf']
+    assert budget.files['atmos_daily']['fields']['ps'] == 64 * 32 * 18 * 4 * 30
+
+
+def test_suggestions(exp):
+    budget = OutputBudget(exp, runs=24, index=FakeIndex(), restart_bytes=12000)
+    suggestions = [s for _, s in budget.suggestions()]
+    assert suggestions[0] == 'write the 3-D fields of atmos_daily (temp) to a monthly file instead'
+    assert 'halve the output frequency of atmos_daily (every 1 days)' in suggestions
+    assert 'keep only every 12th restart archive once runs have finished' in suggestions
+    assert budget.summary().startswith('exp: 24 runs of 30 days on a 64x32x25 grid')
+
+
+def test_measured_restart(exp):
+    assert OutputBudget(exp).restart_estimated
+    os.makedirs(exp.restartdir)
+    with open(exp.get_restart_file(1), 'wb') as f:
+        f.write(b'x' * 1234)
+    budget = OutputBudget(exp)
+    assert not budget.restart_estimated
+    assert budget.restart_bytes == 1234
+
+
+def test_format_bytes():
+    assert format_bytes(999) == '999 B'
+    assert format_bytes(1500) == '1.5 kB'
+    assert format_bytes(2.5e12) == '2.5 TB'
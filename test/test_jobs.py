@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from isca.jobs import JobManager, LocalBackend, check_run_kwargs, COMPLETED, FAILED, RUNNING, UNKNOWN
+
+SCRIPT = '''
+from isca import Experiment
+
+from conftest import FakeCodeBase
+
+exp = Experiment('exp', FakeCodeBase(), workbase=%(work)r, database=%(data)r)
+'''
+
+
+def write_test_case(tmp_path):
+    script = tmp_path / 'test_case.py'
+    script.write_text(SCRIPT % {'work': str(tmp_path / 'work'), 'data': str(tmp_path / 'data')})
+    return str(script)
+
+
+def complete_run(tmp_path, i):
+    outdir = tmp_path / 'data' / 'exp' / ('run%04d' % i)
+    outdir.mkdir(parents=True)
+    (outdir / 'run_complete').write_text('')
+    restartdir = tmp_path / 'data' / 'exp' / 'restarts'
+    restartdir.mkdir(exist_ok=True)
+    (restartdir / ('res%04d.tar.gz' % i)).write_text('')
+
+
+def submitted_earlier(tmp_path, script):
+    """The jobs.json left by a python process that submitted a chain of two
+    jobs and exited while they were running."""
+    manager = JobManager(LocalBackend(), name='chain', statedir=str(tmp_path / 'jobs'))
+    for first in (1, 3):
+        task = {'script': script, 'variable': 'exp', 'start': first, 'end': first + 1}
+        job = manager._new_job('exp_%d' % first, [task], 1, depends_on=0 if first == 3 else None)
+        job.update(job_id='local1.%d' % first, state=RUNNING, attempts=1)
+    manager.save_state()
+    return JobManager(LocalBackend(), name='chain', statedir=str(tmp_path / 'jobs'))
+
+
+def test_local_job_ids(tmp_path, monkeypatch):
+    script = tmp_path / 'job.sh'
+    script.write_text('exit 0\n')
+    monkeypatch.setattr(LocalBackend, 'write_script', lambda self, job, array_size=None, dependency=None: str(script))
+    backend = LocalBackend()
+    job_id = backend.submit({'jobdir': str(tmp_path)})
+    # ids from an earlier python process cannot be mistaken for this one's
+    assert job_id == 'local%d.1' % os.getpid()
+    backend.wait(job_id)
+    assert backend.status(job_id) == COMPLETED
+    assert backend.status('local1') == UNKNOWN
+
+
+def test_untracked_local_jobs(tmp_path):
+    script = write_test_case(tmp_path)
+    for i in (1, 2, 3):
+        complete_run(tmp_path, i)
+    manager = submitted_earlier(tmp_path, script)
+    states = [job['state'] for job in manager.update()]
+    assert states == [COMPLETED, FAILED]
+
+
+def test_resubmit_untracked_local_jobs(tmp_path, monkeypatch):
+    script = write_test_case(tmp_path)
+    complete_run(tmp_path, 1)
+    manager = submitted_earlier(tmp_path, script)
+    submitted = []
+    monkeypatch.setattr(LocalBackend, 'submit', lambda self, job, array_size=None, dependency=None:
+                        submitted.append((job['index'], dependency)) or 'local2.%d' % job['index'])
+    resubmitted = manager.resubmit_failed()
+    assert [job['index'] for job in resubmitted] == [0, 1]
+    assert submitted == [(0, None), (1, 'local2.0')]
+
+
+def test_run_kwargs_checked_at_submission(tmp_path, monkeypatch):
+    check_run_kwargs('run', {'save_run': True, 'mpirun_opts': '-v'})
+    check_run_kwargs('run_chain', {'archive_interval': 6})
+    with pytest.raises(TypeError, match='save_run'):
+        check_run_kwargs('run_chain', {'save_run': True})
+    with pytest.raises(TypeError, match='num_cores'):
+        check_run_kwargs('run', {'num_cores': 16})
+    with pytest.raises(ValueError):
+        check_run_kwargs('run_all', {})
+
+    submitted = []
+    monkeypatch.setattr(LocalBackend, 'submit', lambda self, job, array_size=None, dependency=None:
+                        submitted.append(job) or 'local2.%d' % job['index'])
+    manager = JobManager(LocalBackend(), name='chain', statedir=str(tmp_path / 'jobs'))
+    with pytest.raises(TypeError):
+        manager.submit_chain(write_test_case(tmp_path), 1, 4, method='run_chain', save_run=True)
+    with pytest.raises(TypeError):
+        manager.submit_ensemble([(write_test_case(tmp_path), 'exp')], 1, 4, method='run_chain', save_run=True)
+    assert submitted == [] and manager.jobs == []
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+from isca.manifest import ManifestWriter, compare_runs, read_manifest
+
+TEMP = 250 + np.arange(4 * 3 * 2, dtype='f8').reshape(4, 3, 2)
+
+
+def write_run(outdir, temp=TEMP, restart=b'restart', chunk_size=1):
+    os.makedirs(outdir)
+    workdir = outdir + '_files'
+    os.makedirs(workdir)
+    with Dataset(os.path.join(workdir, 'atmos_daily.nc'), 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 3)
+        ds.createDimension('lon', 2)
+        ds.createVariable('time', 'f8', ('time', ))[:] = np.arange(4)
+        ds.createVariable('temp', 'f8', ('time', 'lat', 'lon'))[:] = temp
+    with open(os.path.join(workdir, 'coupler.res'), 'wb') as f:
+        f.write(restart)
+    writer = ManifestWriter(chunk_size)
+    writer.add_files(outdir, {'atmos_daily.nc': os.path.join(workdir, 'atmos_daily.nc')})
+    writer.add_files(outdir, {'RESTART/coupler.res': os.path.join(workdir, 'coupler.res')})
+    return outdir
+
+
+def test_manifest_contents(tmp_path):
+    manifest = read_manifest(write_run(str(tmp_path / 'run0001')))
+    assert sorted(manifest['files']) == ['RESTART/coupler.res', 'atmos_daily.nc']
+    temp = manifest['files']['atmos_daily.nc']['variables']['temp']
+    assert temp['shape'] == [4, 3, 2]
+    assert len(temp['chunks']) == 4
+    assert temp['chunks'][1]['min'] == TEMP[1].min()
+    assert temp['chunks'][1]['max'] == TEMP[1].max()
+    assert np.isclose(temp['chunks'][1]['mean'], TEMP[1].mean())
+    assert 'sha256' in manifest['files']['RESTART/coupler.res']
+
+
+def test_identical(tmp_path):
+    a = write_run(str(tmp_path / 'a'))
+    b = write_run(str(tmp_path / 'b'))
+    result = compare_runs(a, b)
+    assert result.status == 'identical'
+    assert result
+
+
+def test_close_and_different(tmp_path):
+    perturbed = TEMP.copy()
+    perturbed[2] *= 1 + 1e-10
+    a = write_run(str(tmp_path / 'a'))
+    b = write_run(str(tmp_path / 'b'), temp=perturbed)
+    result = compare_runs(a, b)
+    assert result.status == 'different'
+    assert result.first_difference == ('atmos_daily.nc', 'temp', 2)
+    assert not result
+    assert compare_runs(a, b, rtol=1e-8).status == 'close'
+
+
+def test_chunk_size(tmp_path):
+    perturbed = TEMP.copy()
+    perturbed[3, 0, 0] += 1
+    a = write_run(str(tmp_path / 'a'), chunk_size=2)
+    b = write_run(str(tmp_path / 'b'), temp=perturbed, chunk_size=2)
+    assert compare_runs(a, b).first_difference == ('atmos_daily.nc', 'temp', 2)
+
+
+def test_restart_and_missing_files(tmp_path):
+    a = write_run(str(tmp_path / 'a'))
+    b = write_run(str(tmp_path / 'b'), restart=b'other')
+    result = compare_runs(a, b, stop_at_first_difference=False)
+    assert result.first_difference == ('RESTART/coupler.res', None, None)
+    manifest = read_manifest(a)
+    del manifest['files']['atmos_daily.nc']
+    result = compare_runs(manifest, a)
+    assert result.differences[0][3] == 'only in second manifest'
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from isca import DiagTable, Namelist
+from isca.memo import RunMemo
+
+
+@pytest.fixture
+def make_memo_experiment(make_experiment):
+    def make(name, inputfile):
+        exp = make_experiment(name)
+        exp.namelist = Namelist({'main_nml': {'days': 30, 'dt_atmos': 600}})
+        exp.diag_table = DiagTable()
+        exp.diag_table.add_file('atmos_monthly', 30, 'days')
+        exp.diag_table.add_field('dynamics', 'ps')
+        exp.inputfiles = [inputfile]
+        return exp
+    return make
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def write_run(exp, i):
+    os.makedirs(exp.get_outputdir(i))
+    write(os.path.join(exp.get_outputdir(i), 'atmos_monthly.nc'), 'output %d' % i)
+    os.makedirs(exp.restartdir, exist_ok=True)
+    write(exp.get_restart_file(i), 'restart %d' % i)
+    exp.mark_run_complete(i)
+
+
+def test_spec_hash(tmp_path, make_memo_experiment):
+    memo = RunMemo(str(tmp_path / 'memo'))
+    inputfile = write(str(tmp_path / 'ozone.nc'), 'ozone')
+    a = make_memo_experiment('a', inputfile)
+    b = make_memo_experiment('b', inputfile)
+    spec = memo.spec_hash(a, None, 16)
+    # the name of the experiment is not part of the specification
+    assert memo.spec_hash(b, None, 16) == spec
+    assert memo.spec_hash(a, None, 32) != spec
+    b.update_namelist({'main_nml': {'days': 31}})
+    assert memo.spec_hash(b, None, 16) != spec
+    b.namelist = Namelist({'main_nml': {'dt_atmos': 600, 'days': 30}})
+    assert memo.spec_hash(b, None, 16) == spec
+    b.diag_table.add_field('dynamics', 'bk')
+    assert memo.spec_hash(b, None, 16) != spec
+
+    # the calendar changes the base date written to the diag table
+    c = make_memo_experiment('c', inputfile)
+    c.diag_table.calendar = 'thirty_day'
+    assert memo.spec_hash(c, None, 16) != spec
+
+    # input files are identified by their contents
+    write(inputfile, 'new ozone')
+    os.utime(inputfile, ns=(0, 0))
+    assert memo.spec_hash(a, None, 16) != spec
+
+
+def test_restart_hash(tmp_path, make_memo_experiment):
+    memo = RunMemo(str(tmp_path / 'memo'))
+    exp = make_memo_experiment('a', write(str(tmp_path / 'ozone.nc'), 'ozone'))
+    restart = write(str(tmp_path / 'res0001.tar.gz'), 'restart')
+    same = write(str(tmp_path / 'copy.tar.gz'), 'restart')
+    assert memo.restart_hash(exp, restart) == memo.restart_hash(exp, same)
+    assert memo.restart_hash(exp, restart).startswith('file:')
+    assert memo.restart_hash(exp, None) is None
+
+    # restarts written by a recorded run are identified by its specification
+    spec = memo.spec_hash(exp, None, 16)
+    write_run(exp, 1)
+    memo.record(exp, 1, spec)
+    assert memo.restart_hash(exp, exp.get_restart_file(1)) == 'run:' + spec
+
+
+def test_lookup_and_reuse(tmp_path, make_memo_experiment):
+    memo = RunMemo(str(tmp_path / 'memo'))
+    inputfile = write(str(tmp_path / 'ozone.nc'), 'ozone')
+    a = make_memo_experiment('a', inputfile)
+    b = make_memo_experiment('b', inputfile)
+    spec = memo.spec_hash(a, None, 16)
+    assert memo.lookup(a, spec) is None
+    write_run(a, 1)
+    memo.record(a, 1, spec)
+    entry = memo.lookup(b, spec)
+    assert entry['experiment'] == 'a'
+
+    memo.reuse(b, 1, entry, spec)
+    assert b.run_is_complete(1)
+    with open(os.path.join(b.get_outputdir(1), 'atmos_monthly.nc')) as f:
+        assert f.read() == 'output 1'
+    # the index still points at the run that produced the output
+    assert memo.lookup(b, spec)['experiment'] == 'a'
+    # and the chain continues from the reused restart as from the original
+    assert memo.restart_hash(b, b.get_restart_file(1)) == 'run:' + spec
+
+    # incomplete output is not reused
+    os.remove(os.path.join(a.get_outputdir(1), a.completefile))
+    assert memo.lookup(b, spec) is None
@@ -0,0 +1,96 @@
+import os
+
+from isca.nmlindex import NamelistIndex, fortran_statements, parse_value, field_axes, scan_source
+
+SOURCE = """
+module dynamics_mod
+#ifdef DEBUG
+use debug_mod
+#endif
+implicit none
+character(len=8) :: mod_name = 'dynamics'   ! used to register diagnostics
+integer :: num_fourier = 42, num_levels=18
+real    :: damping_coeff = 1.15740741e-4_dp
+real, dimension(2) :: valid_range = (/100., 800./)
+logical :: do_water_correction = .true.
+character(len=64) :: init_file = "INPUT/init.nc"
+integer :: lon_max(3)
+namelist /dynamics_nml/ num_fourier, num_levels, &
+                        damping_coeff, & ! the damping
+! a comment line within the statement
+                        valid_range, do_water_correction, init_file, lon_max
+contains
+subroutine dynamics_init(axes, Time)
+  id_ps = register_diag_field(mod_name, 'ps', axes(1:2), Time, 'surface pressure', 'Pa')
+  id_temp = register_diag_field(mod_name, 'temp', axes(1:3), Time, 'temperature', 'K')
+  id_bk = register_static_field(mod_name, 'bk', (/axes(4)/), 'vertical coordinate', 'Pa')
+  id_w = register_diag_field('vert', 'omega', (/id_lon,id_lat,id_phalf/), Time, 'omega', 'Pa/s')
+  id_gm = register_diag_field(trim(mod_name), 'global_mean', Time, 'global mean', 'K')
+end subroutine
+end module
+"""
+
+
+def test_fortran_statements():
+    statements = fortran_statements(SOURCE)
+    assert not [s for s in statements if s.startswith('#')]
+    namelist = [s for s in statements if s.startswith('namelist')]
+    assert len(namelist) == 1
+    assert 'lon_max' in namelist[0] and 'the damping' not in namelist[0]
+
+
+def test_parse_value():
+    assert parse_value('42') == 42
+    assert parse_value('1.5d-3') == 1.5e-3
+    assert parse_value('1.0_dp') == 1.0
+    assert parse_value('.false.') is False
+    assert parse_value("'fv'") == 'fv'
+    assert parse_value('pi') == 'pi'
+    assert parse_value('') is None
+
+
+def test_field_axes():
+    assert field_axes('axes(1:2)') == ['lon', 'lat']
+    assert field_axes('axes(1:3)') == ['lon', 'lat', 'pfull']
+    assert field_axes('(/id_lon, id_lat, id_phalf/)') == ['lon', 'lat', 'phalf']
+    assert field_axes('Time') == []
+    assert field_axes('unknown_axes') is None
+
+
+def test_scan_source():
+    groups, diag_fields = scan_source(SOURCE)
+    nml = groups['dynamics_nml']
+    assert nml['num_fourier'] == {'type': 'integer', 'default': 42, 'array': False}
+    assert nml['num_levels']['default'] == 18
+    assert nml['damping_coeff']['type'] == 'real'
+    assert nml['damping_coeff']['default'] == 1.15740741e-4
+    assert nml['valid_range']['array']
+    assert nml['do_water_correction']['default'] is True
+    assert nml['init_file'] == {'type': 'character', 'default': 'INPUT/init.nc', 'array': False}
+    assert nml['lon_max']['array']
+    assert diag_fields['dynamics']['ps'] == {'axes': ['lon', 'lat'], 'static': False}
+    assert diag_fields['dynamics']['temp']['axes'] == ['lon', 'lat', 'pfull']
+    assert diag_fields['dynamics']['bk'] == {'axes': ['phalf'], 'static': True}
+    assert diag_fields['dynamics']['global_mean']['axes'] == []
+    assert diag_fields['vert']['omega']['axes'] == ['lon', 'lat', 'phalf']
+
+
+def test_index_refresh(tmp_path):
+    srcdir = tmp_path / 'src'
+    srcdir.mkdir()
+    (srcdir / 'dynamics.F90').write_text(SOURCE)
+    indexfile = str(tmp_path / 'index.json')
+    index = NamelistIndex(str(srcdir), indexfile)
+    assert index.defaults()['dynamics_nml']['num_fourier'] == 42
+    assert index.group_files('dynamics_nml') == ['dynamics.F90']
+    assert os.path.isfile(indexfile)
+
+    # unchanged files are not scanned again
+    index = NamelistIndex(str(srcdir), indexfile, refresh=False)
+    assert index.refresh() == 0
+    (srcdir / 'other.f90').write_text('integer :: n = 1\nnamelist /other_nml/ n\n')
+    assert index.refresh() == 1
+    assert index.groups['other_nml']['n']['default'] == 1
+    os.remove(str(srcdir / 'other.f90'))
+    index.refresh()
+    assert 'other_nml' not in index.groups
@@ -0,0 +1,214 @@
+import numpy as np
+import pytest
+
+from isca.plevel import (PressureInterpolator, full_level_pressure, interpolate_to_pressure,
+                         GRAV, RDGAS, D608)
+
+PK = np.array([0., 2000., 5000., 3000., 1000., 0.])
+BK = np.array([0., 0., 0.1, 0.4, 0.75, 1.])
+POUT = [100000., 85000., 50000., 20000., 1000.]
+
+
+# --- column by column ports of the Fortran routines, as reference values ---
+
+def fortran_pfull(phalf):
+    # pressure_variables in the spectral model, with a zero top pressure
+    nlev = len(phalf) - 1
+    lph = [p*np.log(p) if p > 0 else 0. for p in phalf]
+    return np.array([np.exp((lph[k+1] - lph[k]) / (phalf[k+1] - phalf[k]) - 1.) for k in range(nlev)])
+
+
+def fortran_interp_init(pfull, pout):
+    # pres_interp_init, with kbot the lowest level; 0-based indices
+    nlev = len(pfull)
+    log_pfull = np.log(pfull)
+    index, factr, mask = [], [], []
+    for lpo in np.log(pout):
+        k, m = nlev - 1, True
+        for kk in range(1, nlev):
+            if lpo <= log_pfull[kk]:
+                k, m = kk, False
+                break
+        f = (lpo - log_pfull[k]) / (log_pfull[k-1] - log_pfull[k])
+        index.append(k)
+        factr.append(max(-0.5, min(1.5, f)))
+        mask.append(m)
+    return index, factr, mask
+
+
+def fortran_pres_interp(data, index, factr):
+    return np.array([data[k] + f*(data[k-1] - data[k]) for k, f in zip(index, factr)])
+
+
+def fortran_temp_extrap(tin, pfull, pout, index, mask, tout):
+    rrlaps = 1./6.5e-3
+    tout = tout.copy()
+    for n, lpo in enumerate(np.log(pout)):
+        if mask[n]:
+            k = index[n] - 1
+            rglp21 = 0.5*(RDGAS/GRAV) * (lpo - np.log(pfull[k]))
+            tout[n] = tin[k] * (rrlaps + rglp21)/(rrlaps - rglp21)
+    return tout
+
+
+def fortran_compute_height(zsurf, temp, sphum, pfull, phalf):
+    nlev = len(pfull)
+    zfull = np.empty(nlev)
+    zb = zsurf*GRAV
+    lpb = np.log(phalf[nlev])
+    for k in range(nlev-1, -1, -1):
+        lpf = np.log(pfull[k])
+        wtb = lpb - lpf
+        if k == 0 and phalf[0] <= 0.:
+            wta = wtb
+        else:
+            lpt = np.log(phalf[k])
+            wta = lpf - lpt
+        vt = temp[k]*(1.0 + D608*sphum[k])*RDGAS
+        zt = zb + vt*(wta + wtb)
+        zfull[k] = (zb + vt*wtb)/GRAV
+        zb = zt
+        if k > 0 or phalf[0] > 0.:
+            lpb = lpt
+    return zfull
+
+
+@pytest.fixture
+def columns():
+    # (time, level, lat, lon), with a range of surface pressures
+    ps = np.array([[[101000., 95000.], [70000., 55000.]]])
+    nlev = len(PK) - 1
+    temp = np.empty((1, nlev) + ps.shape[1:])
+    sphum = np.empty_like(temp)
+    for k in range(nlev):
+        temp[:, k] = 220. + 15.*k + ps/20000.
+        sphum[:, k] = 1e-3*k
+    zsurf = np.array([[0., 500.], [3000., 5000.]])
+    return ps, temp, sphum, zsurf
+
+
+def column_phalf(ps):
+    return PK + BK*ps
+
+
+def test_full_level_pressure():
+    phalf = column_phalf(100000.)
+    pfull = full_level_pressure(phalf[np.newaxis, :])[0]
+    np.testing.assert_allclose(pfull, fortran_pfull(phalf), rtol=1e-12)
+    assert np.all(np.diff(pfull) > 0)
+    assert np.all((pfull > phalf[:-1]) & (pfull < phalf[1:]))
+
+
+def test_interp_matches_fortran(columns):
+    ps, temp, sphum, zsurf = columns
+    interp = PressureInterpolator(PK, BK, ps, POUT)
+    tout = interp.interp(temp)
+    for j in range(ps.shape[1]):
+        for i in range(ps.shape[2]):
+            pfull = fortran_pfull(column_phalf(ps[0, j, i]))
+            index, factr, mask = fortran_interp_init(pfull, POUT)
+            np.testing.assert_array_equal(interp.index[0, :, j, i], index)
+            np.testing.assert_allclose(interp.factr[0, :, j, i], factr, rtol=1e-10)
+            np.testing.assert_array_equal(interp.mask[0, :, j, i], mask)
+            expected = fortran_pres_interp(temp[0, :, j, i], index, factr)
+            np.testing.assert_allclose(tout[0, :, j, i], expected, rtol=1e-12)
+            extrap = fortran_temp_extrap(temp[0, :, j, i], pfull, POUT, index, mask, expected)
+            np.testing.assert_allclose(interp.extrapolate_temp(temp, tout)[0, :, j, i], extrap, rtol=1e-12)
+
+
+def test_interp_reproduces_model_levels():
+    ps = np.array([[100000.]])
+    pfull = full_level_pressure(column_phalf(ps[0, 0])[np.newaxis, :])[0]
+    interp = PressureInterpolator(PK, BK, ps, pfull[::-1])
+    data = np.arange(len(pfull), dtype=np.float64)[np.newaxis, :, np.newaxis] * 3.
+    np.testing.assert_allclose(interp.interp(data)[0, :, 0], data[0, ::-1, 0], atol=1e-12)
+    assert not interp.mask.any()
+
+
+def test_interp_is_linear_in_log_pressure():
+    ps = np.array([[100000.]])
+    pout = [90000., 60000., 30000.]
+    interp = PressureInterpolator(PK, BK, ps, pout)
+    data = 2.*interp.log_pfull + 7.
+    np.testing.assert_allclose(interp.interp(data)[0, :, 0], 2.*np.log(pout) + 7., rtol=1e-12)
+
+
+def test_extrapolation_is_limited():
+    ps = np.array([[100000.]])
+    interp = PressureInterpolator(PK, BK, ps, [1.])
+    # far above the top level: limited to half a layer beyond it
+    assert interp.factr[0, 0, 0] == 1.5
+    data = interp.log_pfull
+    expected = data[0, 0, 0] + 0.5*(data[0, 0, 0] - data[0, 1, 0])
+    np.testing.assert_allclose(interp.interp(data)[0, 0, 0], expected)
+
+
+def test_below_surface_is_masked():
+    ps = np.array([[100000.], [60000.]])
+    interp = PressureInterpolator(PK, BK, ps, [80000.])
+    assert not interp.mask[0, 0, 0]
+    assert interp.mask[1, 0, 0]
+
+
+def test_height_matches_fortran(columns):
+    ps, temp, sphum, zsurf = columns
+    interp = PressureInterpolator(PK, BK, ps, POUT)
+    zfull = interp.full_level_height(zsurf, temp, sphum)
+    for j in range(ps.shape[1]):
+        for i in range(ps.shape[2]):
+            phalf = column_phalf(ps[0, j, i])
+            expected = fortran_compute_height(zsurf[j, i], temp[0, :, j, i], sphum[0, :, j, i],
+                                              fortran_pfull(phalf), phalf)
+            np.testing.assert_allclose(zfull[0, :, j, i], expected, rtol=1e-12)
+    assert np.all(zfull[:, :-1] > zfull[:, 1:])
+    assert np.all(zfull[:, -1] > zsurf)
+
+
+def test_height_single_level_zero_top():
+    ps = np.array([[100000.]])
+    interp = PressureInterpolator(np.array([0., 0.]), np.array([0., 1.]), ps, [50000.])
+    temp = np.full((1, 1, 1), 250.)
+    zfull = interp.full_level_height(np.array([10.]), temp, np.zeros_like(temp))
+    # pfull = ps/e, so the level is one scale height of the layer above the surface
+    np.testing.assert_allclose(interp.pfull[0, 0, 0], 100000./np.e)
+    np.testing.assert_allclose(zfull[0, 0, 0], 10. + RDGAS*250./GRAV)
+    # the single level is used at every output level
+    assert interp.factr[0, 0, 0] == 0.
+    np.testing.assert_array_equal(interp.interp(temp), temp)
+
+
+def test_interpolate_to_pressure(tmp_path):
+    Dataset = pytest.importorskip('netCDF4').Dataset
+    infile, outfile = str(tmp_path / 'in.nc'), str(tmp_path / 'out.nc')
+    nlev = len(PK) - 1
+    ps = np.array([[[101000., 70000.]], [[99000., 60000.]], [[100000., 55000.]]])
+    with Dataset(infile, 'w') as ds:
+        for name, size in (('time', None), ('pfull', nlev), ('phalf', nlev + 1), ('lat', 1), ('lon', 2)):
+            ds.createDimension(name, size)
+        ds.createVariable('pfull', 'f4', ('pfull',))[:] = np.arange(nlev)
+        ds.createVariable('pk', 'f4', ('phalf',))[:] = PK
+        ds.createVariable('bk', 'f4', ('phalf',))[:] = BK
+        ds.createVariable('ps', 'f4', ('time', 'lat', 'lon'))[:] = ps
+        ds.createVariable('zsurf', 'f4', ('lat', 'lon'))[:] = [[0., 3000.]]
+        interp = PressureInterpolator(PK.astype(np.float32).astype(np.float64),
+                                      BK.astype(np.float32).astype(np.float64), ps, POUT)
+        ds.createVariable('temp', 'f4', ('time', 'pfull', 'lat', 'lon'))[:] = 200. + 10.*interp.log_pfull
+        ucomp = ds.createVariable('ucomp', 'f4', ('time', 'pfull', 'lat', 'lon'))
+        ucomp.missing_value = -1e10
+        ucomp[:] = interp.log_pfull
+
+    interpolate_to_pressure(infile, outfile, POUT, var_names=['slp', 'hght'], time_chunk=2)
+
+    with Dataset(outfile) as ds:
+        ds.set_auto_mask(False)
+        np.testing.assert_allclose(ds.variables['pfull'][:], np.array(POUT)/100.)
+        u = ds.variables['ucomp'][:]
+        expected = np.where(interp.mask, -1e10, interp.interp(interp.log_pfull))
+        np.testing.assert_allclose(u, expected, rtol=1e-6)
+        assert np.all(u[interp.mask] == -1e10)
+        assert np.any(interp.mask) and not np.all(interp.mask)
+        np.testing.assert_allclose(u[~interp.mask], np.broadcast_to(
+            np.log(POUT)[np.newaxis, :, np.newaxis, np.newaxis], u.shape)[~interp.mask], rtol=1e-5)
+        assert ds.variables['height'].shape == u.shape
+        assert np.all(ds.variables['height'][:][interp.mask] == -1000.)
+        assert ds.variables['slp'].shape == ps.shape
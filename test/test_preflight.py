@@ -0,0 +1,119 @@
+import pytest
+
+from isca import DiagTable, Namelist
+from isca.preflight import (Preflight, PreflightError, ERROR, WARNING, check_namelist, check_inputfiles,
+                            check_grid, check_diag_table)
+from isca.nmlindex import NamelistIndex
+
+from conftest import FakeCodeBase
+
+SOURCE = """
+module spectral_dynamics_mod
+character(len=16) :: mod_name = 'dynamics'
+integer :: lon_max = 128, lat_max = 64, num_fourier = 42, num_spherical = 43, num_levels = 18
+real :: robert_coeff = 0.04
+logical :: do_water_correction = .true.
+real, dimension(2) :: valid_range = (/100., 800./)
+character(len=64) :: initial_file = ''
+namelist /spectral_dynamics_nml/ lon_max, lat_max, num_fourier, num_spherical, num_levels, &
+                                 robert_coeff, do_water_correction, valid_range, initial_file
+contains
+subroutine init(axes, Time)
+  id_ps = register_diag_field(mod_name, 'ps', axes(1:2), Time, 'surface pressure', 'Pa')
+  id_temp = register_diag_field(mod_name, 'temp', axes(1:3), Time, 'temperature', 'K')
+end subroutine
+end module
+"""
+
+FIELD_TABLE = '''"TRACER", "atmos_mod", "sphum"
+           "longname", "specific humidity"
+           "units", "kg/kg" /
+'''
+
+
+@pytest.fixture
+def exp(tmp_path, make_experiment):
+    srcdir = tmp_path / 'src'
+    (srcdir / 'extra' / 'model' / 'fake').mkdir(parents=True)
+    (srcdir / 'spectral_dynamics.F90').write_text(SOURCE)
+    (srcdir / 'extra' / 'model' / 'fake' / 'field_table').write_text(FIELD_TABLE)
+    exp = make_experiment(codebase=FakeCodeBase(str(srcdir)))
+    exp.namelist = Namelist({'spectral_dynamics_nml': {'num_fourier': 42, 'robert_coeff': 0.03}})
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_monthly', 30, 'days')
+    exp.diag_table.add_field('dynamics', 'ps')
+    exp.diag_table.add_field('dynamics', 'sphum')
+    return exp
+
+
+@pytest.fixture
+def index(exp, tmp_path):
+    return NamelistIndex(exp.codebase.srcdir, str(tmp_path / 'index.json'))
+
+
+def messages(problems, level=ERROR):
+    return [message for l, message in problems if l == level]
+
+
+def test_valid_namelist(exp, index):
+    exp.update_namelist({'spectral_dynamics_nml': {'valid_range': [150., 350.], 'lon_max': [128]}})
+    assert check_namelist(exp, index) == []
+
+
+def test_namelist_typos(exp, index):
+    exp.update_namelist({'spectral_dynamics_nml': {'robert_coef': 0.03}})
+    exp.namelist['spectral_dynamics'] = {'num_fourier': 42}
+    errors = messages(check_namelist(exp, index))
+    assert "robert_coef is not a parameter of spectral_dynamics_nml (did you mean 'robert_coeff'?)" in errors
+    assert ("namelist group spectral_dynamics is not read by any module (did you mean 'spectral_dynamics_nml'?)"
+            in errors)
+
+
+def test_namelist_types(exp, index):
+    exp.update_namelist({'spectral_dynamics_nml': {'num_levels': 18.5, 'do_water_correction': 1,
+                                                   'robert_coeff': [0.03, 0.04], 'initial_file': 'INPUT/init.nc'}})
+    errors = messages(check_namelist(exp, index))
+    assert len(errors) == 3
+    assert 'spectral_dynamics_nml:robert_coeff is a scalar but was given 2 values' in errors
+
+
+def test_inputfiles(exp, tmp_path):
+    exp.inputfiles = [str(tmp_path / 'missing.nc')]
+    exp.update_namelist({'spectral_dynamics_nml': {'initial_file': 'INPUT/init.nc'}})
+    errors = messages(check_inputfiles(exp))
+    assert len(errors) == 2
+    (tmp_path / 'init.nc').write_text('')
+    exp.inputfiles = [str(tmp_path / 'init.nc')]
+    assert check_inputfiles(exp) == []
+
+
+def test_grid(exp, index):
+    assert check_grid(exp, 16, index) == []
+    assert len(messages(check_grid(exp, 12, index))) == 1
+    exp.update_namelist({'spectral_dynamics_nml': {'lon_max': 64, 'lat_max': 31}})
+    problems = check_grid(exp, None, index)
+    assert messages(problems) == ['lat_max=31 must be even']
+    assert len(messages(problems, WARNING)) == 1
+
+
+def test_diag_table(exp, index):
+    # sphum is a tracer in the field table
+    assert check_diag_table(exp, index) == []
+    exp.diag_table.add_field('dynamic', 'ps')
+    exp.diag_table.add_field('dynamics', 'tmp')
+    warnings = messages(check_diag_table(exp, index), WARNING)
+    assert len(warnings) == 2
+    assert "atmos_monthly: dynamics does not register 'tmp' (did you mean 'temp'?)" in warnings
+
+
+def test_preflight(exp):
+    assert Preflight().check(exp, num_cores=16) == []
+    exp.diag_table.add_field('dynamics', 'tmp')
+    assert len(Preflight().check(exp, num_cores=16)) == 1
+    with pytest.raises(PreflightError) as e:
+        Preflight(strict=True).check(exp, num_cores=16)
+    assert len(e.value.problems) == 1
+    with pytest.raises(PreflightError):
+        Preflight().check(exp, num_cores=12)
+    problems = Preflight(checks=('namelist', )).check(exp, num_cores=12, raise_errors=False)
+    assert problems == []
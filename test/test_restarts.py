@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from isca.restarts import (get_restart_storage, restart_format, extract_restart, storage_for_file,
+                           RESTART_STORAGE)
+
+FILES = {'atmosphere.res.nc': b'\x89HDF\r\n' + bytes(range(256)) * 16,
+         'coupler.res': b'     2        (Calendar)\n  2000     1     1\n'}
+
+
+def write_restart_dir(path):
+    os.makedirs(path)
+    for name, data in FILES.items():
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(data)
+
+
+def read_dir(path):
+    result = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as f:
+            result[name] = f.read()
+    return result
+
+
+@pytest.mark.parametrize('name', sorted(RESTART_STORAGE))
+def test_round_trip(tmp_path, name):
+    storage = get_restart_storage(name)
+    resdir = str(tmp_path / 'RESTART')
+    write_restart_dir(resdir)
+    archive = str(tmp_path / ('res0001' + storage.suffix))
+    storage.save(archive, resdir)
+
+    indir = str(tmp_path / 'INPUT')
+    os.makedirs(indir)
+    names = extract_restart(archive, indir)
+    assert sorted(names) == sorted(FILES)
+    assert read_dir(indir) == FILES
+
+
+@pytest.mark.parametrize('name, expected', [('tar.gz', 'gzip'), ('tar', 'tar'), ('directory', 'directory')])
+def test_restart_format(tmp_path, name, expected):
+    storage = get_restart_storage(name)
+    resdir = str(tmp_path / 'RESTART')
+    write_restart_dir(resdir)
+    archive = str(tmp_path / ('res0001' + storage.suffix))
+    storage.save(archive, resdir)
+    assert restart_format(archive) == expected
+
+
+def test_fast_format_matches_codec(tmp_path):
+    storage = get_restart_storage('fast')
+    resdir = str(tmp_path / 'RESTART')
+    write_restart_dir(resdir)
+    archive = str(tmp_path / ('res0001' + storage.suffix))
+    storage.save(archive, resdir)
+    assert restart_format(archive) == storage.codec
+
+
+def test_storage_for_file():
+    assert storage_for_file('res0001.tar.gz').name == 'tar.gz'
+    assert storage_for_file('res0001.tar').name == 'tar'
+    assert storage_for_file('res0001').name == 'directory'
+
+
+def test_directory_extract_copies(tmp_path):
+    archive = str(tmp_path / 'res0001')
+    write_restart_dir(archive)
+    outdir = str(tmp_path / 'edit')
+    os.makedirs(outdir)
+    extract_restart(archive, outdir)
+    with open(os.path.join(outdir, 'coupler.res'), 'r+b') as f:
+        f.write(b'edited')
+    assert read_dir(archive) == FILES
+
+
+def test_directory_extract_link(tmp_path):
+    archive = str(tmp_path / 'res0001')
+    write_restart_dir(archive)
+    indir = str(tmp_path / 'INPUT')
+    os.makedirs(indir)
+    extract_restart(archive, indir, link=True)
+    for name in FILES:
+        assert os.path.samefile(os.path.join(archive, name), os.path.join(indir, name))
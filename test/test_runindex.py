@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+from netCDF4 import Dataset
+
+from isca.runindex import RunIndex
+
+
+def write_run(datadir, i, months=3):
+    rundir = os.path.join(datadir, 'run%04d' % i)
+    os.makedirs(rundir)
+    path = os.path.join(rundir, 'atmos_monthly.nc')
+    with Dataset(path, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 4)
+        time = ds.createVariable('time', 'f8', ('time', ))
+        time.units = 'days since 0001-01-01 00:00:00'
+        time.calendar = 'thirty_day_months'
+        time[:] = 30. * np.arange((i - 1) * months, i * months) + 15.
+        ds.createVariable('lat', 'f4', ('lat', ))[:] = np.linspace(-60, 60, 4)
+        ds.createVariable('zsurf', 'f4', ('lat', ))[:] = np.arange(4) * 100.
+        temp = ds.createVariable('temp', 'f4', ('time', 'lat'))
+        temp.units = 'K'
+        temp[:] = 250. + i + np.arange(months)[:, None] * 0.1 + np.arange(4)[None, :]
+    return path
+
+
+@pytest.fixture
+def datadir(tmp_path):
+    datadir = str(tmp_path / 'exp')
+    paths = [write_run(datadir, i) for i in (1, 2, 3)]
+    return datadir, paths
+
+
+def concat(paths):
+    return xr.concat([xr.open_dataset(p, decode_times=False) for p in paths], dim='time', data_vars='minimal')
+
+
+def test_open_matches_concat(datadir):
+    datadir, paths = datadir
+    ds = RunIndex(datadir).open()
+    expected = concat(paths)
+    xr.testing.assert_identical(ds.drop_attrs(), expected.drop_attrs())
+    assert ds.attrs['runs'] == '1-3'
+
+
+def test_lazy_selection(datadir):
+    datadir, paths = datadir
+    index = RunIndex(datadir)
+    ds = index.open(runs=[2, 3], variables=['temp'])
+    assert sorted(ds.variables) == ['lat', 'temp', 'time']
+    expected = concat(paths[1:])
+    # across the boundary between the files, and in reverse order
+    for key in (slice(1, 5), [4, 0, 3], 5):
+        np.testing.assert_array_equal(ds.temp[key].values, expected.temp[key].values)
+    np.testing.assert_array_equal(ds.temp[:, 2].values, expected.temp[:, 2].values)
+
+
+def test_incremental_update(datadir):
+    datadir, paths = datadir
+    index = RunIndex(datadir)
+    assert index.runs == [1, 2, 3]
+    # a new index is read from disk, so nothing is scanned again
+    assert RunIndex(datadir).update() == []
+    write_run(datadir, 4)
+    os.remove(paths[0])
+    assert index.update() == [4]
+    assert index.runs == [2, 3, 4]
+    with pytest.raises(ValueError):
+        index.open(runs=[1, 2])
+    with pytest.raises(ValueError):
+        index.open(variables=['ucomp'])
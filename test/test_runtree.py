@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from isca.restarts import DirectoryRestartStorage
+from isca.runtree import RunTree, RestartPerturbation, Segment
+
+
+@pytest.fixture
+def make_dir_experiment(make_experiment):
+    def make(name):
+        exp = make_experiment(name)
+        exp.restart_storage = DirectoryRestartStorage()
+        return exp
+    return make
+
+
+def read_dir(path):
+    result = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as f:
+            result[name] = f.read()
+    return result
+
+
+def test_branch_leaves_parent_restart(tmp_path, make_dir_experiment):
+    parent = make_dir_experiment('parent')
+    archive = parent.get_restart_file(1)
+    os.makedirs(archive)
+    with Dataset(os.path.join(archive, 'spectral_dynamics.res.nc'), 'w') as ds:
+        ds.createDimension('x', 16)
+        ds.createVariable('x', 'f8', ('x', ))[:] = np.arange(16)
+        ds.createVariable('vors', 'f8', ('x', ))[:] = np.linspace(1, 2, 16)
+    with open(os.path.join(archive, 'coupler.res'), 'w') as f:
+        f.write('     2        (Calendar)\n')
+    before = read_dir(archive)
+
+    tree = RunTree(parent, 'tree', runs=2)
+    root = Segment('root', [], None)
+    root.exp = parent
+    root.runs = [(1, parent.namelist)]
+    branch = Segment('branch', [], parent=root)
+    branch.exp = make_dir_experiment('branch')
+    branch.runs = [(2, parent.namelist)]
+    branch.perturbation = RestartPerturbation(amplitude=1e-3, seed=1)
+
+    perturbed = tree._branch_restart(branch)
+    assert read_dir(archive) == before
+    with Dataset(os.path.join(perturbed, 'spectral_dynamics.res.nc')) as ds:
+        vors = ds.variables['vors'][:]
+        assert not np.array_equal(vors, np.linspace(1, 2, 16))
+        assert np.array_equal(ds.variables['x'][:], np.arange(16))
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from isca.scheduler import CoreBudget, ExperimentScheduler
+
+
+class FakeExperiment(object):
+    """Runs complete once `wait_for_postprocessing` is called, as with
+    asynchronous post-processing."""
+
+    def __init__(self, name, result=True, error=None):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.ran = []
+        self.complete = set()
+
+    def run(self, i, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.ran.append(i)
+        return self.result
+
+    def run_is_complete(self, i):
+        return i in self.complete
+
+    def wait_for_postprocessing(self):
+        self.complete.update(self.ran)
+
+
+def make_scheduler(tmp_path, exp, runs=(1, 2)):
+    sched = ExperimentScheduler(total_cores=4, statedir=str(tmp_path))
+    sched.add(exp, runs=runs, num_cores=2)
+    events = []
+    sched.on('job:run', lambda s, job, i: events.append(('run', i)))
+    sched.on('job:failed', lambda s, job, e: events.append(('failed', type(e).__name__)))
+    return sched, events
+
+
+def test_budget_too_many_cores():
+    with pytest.raises(ValueError):
+        CoreBudget(4).acquire(5)
+
+
+def test_budget_blocks_until_released():
+    budget = CoreBudget(4)
+    budget.acquire(3)
+    acquired = threading.Event()
+
+    def take():
+        budget.acquire(2)
+        acquired.set()
+    t = threading.Thread(target=take)
+    t.start()
+    assert not acquired.wait(0.1)
+    budget.release(3)
+    assert acquired.wait(5)
+    t.join()
+    assert budget.free_cores == 2
+
+
+def test_runs_recorded_once_postprocessed(tmp_path):
+    exp = FakeExperiment('exp')
+    sched, events = make_scheduler(tmp_path, exp)
+    assert sched.run() == {'exp': 'complete'}
+    assert sched.jobs[0].completed == [1, 2]
+    assert events == [('run', 1), ('run', 2)]
+
+
+def test_run_that_does_not_go_ahead_fails(tmp_path):
+    exp = FakeExperiment('exp', result=False)
+    sched, events = make_scheduler(tmp_path, exp)
+    assert sched.run() == {'exp': 'failed'}
+    assert sched.jobs[0].completed == []
+    assert exp.ran == [1]
+    assert events == [('failed', 'FailedRunError')]
+
+
+def test_unexpected_error_fails_job(tmp_path):
+    exp = FakeExperiment('exp', error=RuntimeError('boom'))
+    sched, events = make_scheduler(tmp_path, exp)
+    assert sched.run() == {'exp': 'failed'}
+    assert sched.jobs[0].error == 'RuntimeError: boom'
+    assert events == [('failed', 'RuntimeError')]
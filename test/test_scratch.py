@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from isca import scratch
+from isca.inputcache import sha256_file
+from isca.scratch import LocalScratch, copy_verified
+
+DATA = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / 'atmos_monthly.nc'
+    path.write_bytes(DATA)
+    (tmp_path / 'data').mkdir()
+    return str(path)
+
+
+def test_copy_verified(src, tmp_path):
+    dst = str(tmp_path / 'data' / 'atmos_monthly.nc')
+    digest = copy_verified(src, dst, blocksize=1000)
+    assert digest == sha256_file(src)
+    with open(dst, 'rb') as f:
+        assert f.read() == DATA
+    assert os.listdir(str(tmp_path / 'data')) == ['atmos_monthly.nc']
+
+
+def test_copy_verified_corrupted(src, tmp_path, monkeypatch):
+    def corrupting_sha256_file(filename):
+        # the data on disk differs from the data that was written
+        with open(filename, 'r+b') as f:
+            f.seek(100)
+            f.write(b'\0')
+        return sha256_file(filename)
+    monkeypatch.setattr(scratch, 'sha256_file', corrupting_sha256_file)
+    dst = str(tmp_path / 'data' / 'atmos_monthly.nc')
+    with pytest.raises(IOError, match='Checksum mismatch'):
+        copy_verified(src, dst)
+    # neither the corrupt copy nor its temporary file are left behind
+    assert os.listdir(str(tmp_path / 'data')) == []
+    with open(src, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_fallback_without_space(experiment, tmp_path):
+    rundir = experiment.rundir
+    experiment.enable_local_scratch(str(tmp_path / 'scratch'), min_free_gb=0, async_drain=False)
+    experiment.select_rundir()
+    assert experiment.rundir == os.path.join(str(tmp_path / 'scratch'), 'isca', 'exp', 'run')
+    experiment.scratch.min_free_gb = 1e12
+    experiment.select_rundir()
+    assert experiment.rundir == rundir
+
+
+def test_scratch_default(monkeypatch):
+    monkeypatch.setenv('TMPDIR', '/local/tmp')
+    assert LocalScratch().scratchdir == '/local/tmp'
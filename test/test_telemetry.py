@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from isca import telemetry
+from isca.telemetry import Telemetry, load_telemetry
+
+# as printed by spectral_dynamics with json_logging, without and with a calendar
+NO_CALENDAR = ' {"day":%6d  ,"second":%6d  ,"max_speed": 0.412345E+02   ,"avg_T": 0.262000E+03   }'
+CALENDAR = ' {"date": "0001-%02d-%02d", "time": "12:00:00", "max_speed":  41.2   ,"avg_T": 262.0   }'
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(telemetry.time, 'time', clock)
+    return clock
+
+
+def test_parse_records(clock):
+    t = Telemetry()
+    t.start(1)
+    assert t.parse(' Integration completed through     3 days     0 seconds') is None
+    assert t.parse(' {"not": "progress"}') is None
+    assert t.parse(' {"day": ******') is None
+    record = t.parse(NO_CALENDAR % (3, 43200))
+    assert record['max_speed'] == pytest.approx(41.2345)
+    t.start(2, 'thirty_day')
+    t.parse(CALENDAR % (2, 1))
+    t.parse(CALENDAR % (2, 2))
+    columns = t.as_arrays()
+    np.testing.assert_allclose(columns['model_day'], [30.5, 31.5])
+    np.testing.assert_allclose(columns['avg_T'], [262., 262.])
+    assert len(t) == 2
+
+
+def test_throughput_windows(clock):
+    t = Telemetry(window=3)
+    t.start(1, 'thirty_day')
+    assert np.isnan(t.model_days_per_second)
+    # start up takes 20 s, then a day every 2 s, then every 0.5 s
+    clock.now += 20.
+    for day in range(1, 11):
+        t.parse(NO_CALENDAR % (day, 0))
+        clock.now += 2. if day < 6 else 0.5
+    assert t.model_days_per_second == pytest.approx(9 / 12.)
+    # the last 3 records are 2 days in 1 s
+    assert t.current_model_days_per_second == pytest.approx(2.)
+    assert t.sypd == pytest.approx(9 / 12. * 86400 / 360.)
+    assert t.current_sypd == pytest.approx(2. * 86400 / 360.)
+
+
+def test_summary_and_save(clock, tmp_path):
+    t = Telemetry()
+    t.start(4, 'no_leap')
+    clock.now += 5.
+    for day in (1, 2, 3):
+        t.parse(NO_CALENDAR % (day, 0))
+        clock.now += 1.
+    t.finish()
+    summary = t.summary()
+    assert summary['run'] == 4
+    assert summary['records'] == 3
+    assert summary['startup_time'] == pytest.approx(5.)
+    assert summary['wall_time'] == pytest.approx(8.)
+    assert summary['model_days'] == 2.
+    assert summary['sypd'] == pytest.approx(86400 / 365.)
+
+    filename = str(tmp_path / 'telemetry.json')
+    t.save(filename)
+    data = load_telemetry(filename)
+    np.testing.assert_allclose(data['columns']['model_day'], [1., 2., 3.])
+    assert data['model_days_per_second'] == pytest.approx(1.)
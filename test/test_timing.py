@@ -0,0 +1,72 @@
+import csv
+import json
+
+import pytest
+
+from isca import EventEmitter
+from isca.timing import PhaseTimer, path_size
+
+
+def make_timer():
+    emitter = EventEmitter()
+    events = []
+    emitter.on('phase:start', lambda emitter, record: events.append(('start', record['phase'], record['status'])))
+    emitter.on('phase:end', lambda emitter, record: events.append(('end', record['phase'], record['status'])))
+    return PhaseTimer(emitter), events
+
+
+def test_nested_spans():
+    timer, events = make_timer()
+    with timer.span('model', run=1, cores=16) as outer:
+        with timer.span('combine', run=1) as inner:
+            inner['bytes'] = 100
+        outer['bytes'] = 50
+    assert events == [('start', 'model', 'running'), ('start', 'combine', 'running'),
+                      ('end', 'combine', 'ok'), ('end', 'model', 'ok')]
+    # spans are recorded as they end, the inner one first
+    assert [r['phase'] for r in timer.records] == ['combine', 'model']
+    combine, model = timer.records
+    assert model['wall_time'] >= combine['wall_time'] >= 0
+    assert model['start'] <= combine['start']
+    assert model['core_hours'] == pytest.approx(model['wall_time'] * 16 / 3600.)
+    assert (combine['bytes'], model['bytes']) == (100, 50)
+
+
+def test_failed_span():
+    timer, events = make_timer()
+    with pytest.raises(RuntimeError):
+        with timer.span('model', run=2):
+            raise RuntimeError('model failed')
+    assert events == [('start', 'model', 'running'), ('end', 'model', 'failed')]
+    assert timer.records[0]['status'] == 'failed'
+
+
+def test_report(tmp_path):
+    timer = PhaseTimer()
+    for run in (1, 2):
+        with timer.span('setup', run) as span:
+            span['bytes'] = 10 * run
+        with timer.span('model', run, cores=4):
+            pass
+    report = timer.report()
+    assert [t['phase'] for t in report] == ['setup', 'model']
+    assert (report[0]['count'], report[0]['bytes'], report[0]['failed']) == (2, 30, 0)
+    assert report[0]['mean_wall_time'] == pytest.approx(report[0]['wall_time'] / 2)
+    assert timer.report(runs=[2])[0]['bytes'] == 20
+    assert 'setup' in timer.format_report()
+
+    timer.to_json(str(tmp_path / 'timings.json'), raw=True)
+    with open(str(tmp_path / 'timings.json')) as f:
+        assert len(json.load(f)) == 4
+    timer.to_csv(str(tmp_path / 'timings.csv'))
+    with open(str(tmp_path / 'timings.csv')) as f:
+        assert [row['phase'] for row in csv.DictReader(f)] == ['setup', 'model']
+    timer.clear()
+    assert timer.report() == []
+
+
+def test_path_size(tmp_path):
+    (tmp_path / 'dir').mkdir()
+    (tmp_path / 'dir' / 'a').write_bytes(b'x' * 10)
+    (tmp_path / 'b').write_bytes(b'x' * 5)
+    assert path_size(str(tmp_path / 'dir'), str(tmp_path / 'b'), None, str(tmp_path / 'missing')) == 15
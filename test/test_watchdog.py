@@ -0,0 +1,139 @@
+import json
+import os
+
+import pytest
+
+from isca import DiagTable, Namelist
+from isca.experiment import BlowUpError
+from isca.watchdog import Watchdog
+
+# progress records as printed by spectral_dynamics with json_logging
+STABLE = ' {"day":     3  ,"second":     0  ,"max_speed": 0.412345E+02   ,"avg_T": 0.262000E+03   }'
+FAST = ' {"day":     4  ,"second":     0  ,"max_speed": 0.312345E+03   ,"avg_T": 0.262000E+03   }'
+NAN = ' {"date": "0001-01-05", "time": "00:00:00", "max_speed":   NaN   ,"avg_T": 262.0   }'
+OVERFLOW = ' {"date": "0001-01-05", "time": "00:00:00", "max_speed":******   ,"avg_T": 262.0   }'
+
+
+class FakeExperiment(object):
+    def __init__(self):
+        self.killed = 0
+
+    def kill_run(self):
+        self.killed += 1
+
+
+@pytest.mark.parametrize('line, reason', [
+    (STABLE, None),
+    (' Integration completed through     3 days     0 seconds', None),
+    (FAST, 'max_speed=312.345 outside limits (None, 250.0)'),
+    (NAN, 'max_speed is NaN'),
+    (OVERFLOW, 'progress record overflowed'),
+])
+def test_check_line(line, reason):
+    found = Watchdog().check_line(line)
+    if reason is None:
+        assert found is None
+    else:
+        assert found.startswith(reason)
+
+
+def test_temperature_and_other_limits():
+    watchdog = Watchdog(max_speed=None, min_temperature=200., max_temperature=300., limits={'day': (None, 3)})
+    assert watchdog.check_line(STABLE) is None
+    assert watchdog.check_line(STABLE.replace('0.262000E+03', '0.150000E+03')).startswith('avg_T=150')
+    assert watchdog.check_line(FAST).startswith('day=4')
+
+
+def test_check_output_kills_once():
+    exp = FakeExperiment()
+    watchdog = Watchdog()
+    watchdog.start(1)
+    assert watchdog.check_output(exp, STABLE) is None
+    assert exp.killed == 0
+    assert watchdog.check_output(exp, FAST) is not None
+    assert watchdog.check_output(exp, NAN) == watchdog.reason
+    assert exp.killed == 1
+    assert watchdog.last_record['max_speed'] == pytest.approx(312.345)
+    watchdog.start(2)
+    assert watchdog.reason is None
+
+
+def test_next_timestep():
+    watchdog = Watchdog(retries=3, dt_factor=0.5, min_dt=100)
+    # halved, then reduced to divide a day
+    assert watchdog.next_timestep(1, 900) == 450
+    assert watchdog.next_timestep(1, 450) == 225
+    # 112 does not divide a day and 108 is the next that does
+    assert watchdog.next_timestep(2, 225) == 108
+    # not below min_dt
+    assert watchdog.next_timestep(2, 108) is None
+    # no more than `retries` per run
+    assert watchdog.next_timestep(1, 225) == 108
+    assert watchdog.next_timestep(1, 1800) is None
+    assert Watchdog(retries=0).next_timestep(1, 900) is None
+    assert Watchdog(retries=1).next_timestep(1, None) is None
+
+
+@pytest.fixture
+def exp(experiment):
+    experiment.namelist = Namelist({'main_nml': {'days': 30, 'dt_atmos': 600}})
+    experiment.enable_watchdog(max_speed=250., retries=2, min_dt=200)
+    return experiment
+
+
+def test_reduce_timestep(exp):
+    events = []
+    exp.on('run:blowup', lambda exp, i, reason, new_dt: events.append((i, new_dt)))
+    exp.watchdog.check_line(FAST)
+    assert exp.reduce_timestep(1, 'max_speed too high')
+    assert exp.namelist['main_nml']['dt_atmos'] == 300
+    assert exp.namelist['spectral_dynamics_nml']['json_logging']
+    # 150 is below min_dt
+    assert not exp.reduce_timestep(1, 'max_speed too high')
+    assert exp.namelist['main_nml']['dt_atmos'] == 300
+    assert events == [(1, 300), (1, None)]
+
+    with open(os.path.join(exp.datadir, 'watchdog.json')) as f:
+        decisions = json.load(f)
+    assert [(d['dt_atmos'], d['new_dt_atmos'], d['action']) for d in decisions] == [(600, 300, 'retry'), (300, None, 'fail')]
+    assert decisions[0]['last_record']['max_speed'] == pytest.approx(312.345)
+
+
+def test_derive_copies_watchdog(exp):
+    exp.watchdog.min_dt = 120
+    new_exp = exp.derive('derived')
+    w = new_exp.watchdog
+    assert w is not exp.watchdog
+    assert w.limits == exp.watchdog.limits
+    assert (w.retries, w.dt_factor, w.min_dt) == (2, 0.5, 120)
+    assert w.attempts == {}
+
+
+def test_run_chain_retries(exp, tmp_path, monkeypatch):
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_monthly', 30, 'days')
+    exp.field_table_file = str(tmp_path / 'field_table')
+    open(exp.field_table_file, 'w').close()
+    timesteps = []
+
+    def execute(i):
+        with open(os.path.join(exp.rundir, 'input.nml')) as f:
+            dt = int(f.read().split('dt_atmos = ')[1].split()[0])
+        timesteps.append((i, dt))
+        if dt > 300 or i == 2:
+            exp.watchdog.check_output(exp, FAST)
+            raise BlowUpError(exp.watchdog.reason)
+        with open(os.path.join(exp.rundir, 'RESTART', 'coupler.res'), 'w') as f:
+            f.write('run %d' % i)
+        with open(os.path.join(exp.rundir, 'atmos_monthly.nc'), 'w') as f:
+            f.write('output')
+    monkeypatch.setattr(exp, 'write_runscript', lambda *args: None)
+    monkeypatch.setattr(exp, 'execute', execute)
+    monkeypatch.setattr(exp, 'kill_run', lambda: None)
+
+    with pytest.raises(BlowUpError):
+        exp.run_chain(1, 2, num_cores=1, use_restart=False)
+    # run 1 is retried once, run 2 until the timestep would go below min_dt
+    assert timesteps == [(1, 600), (1, 300), (2, 300)]
+    assert exp.run_is_complete(1)
+    assert os.path.exists(exp.get_restart_file(1))